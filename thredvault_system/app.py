@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import database as db
 import models as md
+import catalog as ct
 from datetime import date, datetime, timedelta
 import os
 import shutil
@@ -43,80 +44,95 @@ def ensure_csv_columns():
             df.to_csv(md.ORDERS_FILE, index=False)
     except: pass
 
+@st.cache_resource
+def recover_storage():
+    """Finishes or undoes writes a crashed session left behind and renumbers
+    repeated sale IDs (once per server)."""
+    recovered = db.recover()
+    db.unique_ids()
+    return recovered
+
+@st.cache_resource
+def start_backups():
+    """Background backups for the server's lifetime; saves never wait on them."""
+    db.start_backups()
+
+recover_storage()
 ensure_csv_columns()
+start_backups()
+
+# --- CACHED DATA ---
+# DataFrames are cached per file, keyed by db.data_version(). That token changes
+# on every database.py write (and when another process touches the file), so
+# the st.rerun() after a save re-parses only the file that was written. Typed
+# frames are built from db.load_records(), whose numbers and dates are already
+# parsed (once per file version, shared with the CLI-style reports).
+@st.cache_data(show_spinner=False, max_entries=16)
+def _cached_frame(filename, version, typed):
+    columns = md.FILE_COLUMNS[filename]
+    if not typed:
+        rows = db.load_csv(filename)
+        return pd.DataFrame(rows) if rows else pd.DataFrame(columns=columns)
+    records = db.load_records(filename)
+    df = pd.DataFrame({c: [getattr(r, c) for r in records] for c in columns})
+    if 'Date' in columns: df['Date_Obj'] = pd.to_datetime(pd.Series([r.Day for r in records], index=df.index, dtype=object))
+    # Blank WAC_Group labels are filled in one merge, not row by row.
+    if 'Brand' in columns: ct.fill_wac_groups(df)
+    return df
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _cached_columns(filename, version, columns, start, end):
+    return pd.DataFrame(db.scan_columns(filename, list(columns), start, end), columns=list(columns))
+
+def load_columns(filename, columns, start=None, end=None):
+    """Only `columns` of the sales/orders rows dated start..end, read from the
+    columnar copy when it is enabled."""
+    return _cached_columns(filename, db.data_version(filename), tuple(columns), start, end)
+
+def load_frame(filename, typed=False):
+    """DataFrame of a data file; typed converts numeric columns, adds Date_Obj and
+    backfills missing WAC_Group labels."""
+    return _cached_frame(filename, db.data_version(filename), typed)
 
 # --- SESSION STATE ---
 if 'sales_cart' not in st.session_state: st.session_state.sales_cart = []
 if 'purchase_cart' not in st.session_state: st.session_state.purchase_cart = []
 if 'receive_cart' not in st.session_state: st.session_state.receive_cart = []
 
-# --- SORTING CONSTANTS ---
-ESSENTIALS_ORDER = ["B22", "L/O", "D/O", "1977 IRON", "1977 D/O", "BLACK", "WHITE"]
-DENIM_TEARS_ORDER = ["BLACK", "GREY"]
-SP5DER_ORDER = ["PINK", "BLUE", "BLACK"]
-ERIC_EMANUEL_ORDER = ["BLACK", "NAVY", "GREY", "LIGHT BLUE", "RED", "WHITE"]
-YZY_ORDER = ["BONE", "ONYX"]
-
-TYPE_ORDER = ["HOODIE", "PANT", "TEE", "SHORTS", "SLIDES"]
-
-# Specific WAC Group Order for Summary Table
-WAC_GROUP_ORDER = [
-    "Ess_HoodiePant", "Ess_TeeShort", "Den_HoodiePant", 
-    "Spdr_HoodiePant", "Eric_EmanShorts", "YZY_Slides"
-]
-
 # --- HELPER FUNCTIONS ---
-def get_custom_color_index(brand, color):
-    c = str(color).upper().strip()
-    b = str(brand).upper().strip()
-    
-    order_list = []
-    if b == "ESSENTIALS": order_list = ESSENTIALS_ORDER
-    elif b == "DENIM TEARS": order_list = DENIM_TEARS_ORDER
-    elif b == "SP5DER": order_list = SP5DER_ORDER
-    elif b == "ERIC EMANUEL": order_list = ERIC_EMANUEL_ORDER
-    elif b == "YZY" or b == "ADIDAS": order_list = YZY_ORDER
-    
-    if c in order_list: return order_list.index(c)
-    for i, val in enumerate(order_list):
-        if val in c: return i
-    return 99
-
-def get_type_index(type_):
-    t = str(type_).upper()
-    try: return TYPE_ORDER.index(t)
-    except: return 99
-
-def get_inventory_display_group(brand, type_):
-    b = str(brand).upper(); t = str(type_).upper()
-    if b == "ESSENTIALS":
-        if t in ["HOODIE", "PANT"]: return "ESSENTIALS (Sweats)"
-        return "ESSENTIALS (Tees/Shorts)"
-    return b
-
-def get_group_sort_order(group_name):
-    if "ESSENTIALS (Sweats)" in group_name: return 1
-    if "ESSENTIALS (Tees" in group_name: return 2
-    if "DENIM TEARS" in group_name: return 3
-    if "SP5DER" in group_name: return 4
-    if "ERIC EMANUEL" in group_name: return 5
-    if "YZY" in group_name: return 6
-    return 99
-
-def get_wac_group_sort_order(wac_group):
-    try: return WAC_GROUP_ORDER.index(wac_group)
-    except: return 99
-
-def calculate_time_horizon_metrics(df, start_date, end_date):
-    if df.empty: return {"Revenue": 0.0, "Profit": 0.0, "Units": 0}
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-    mask = (df['Date'] >= pd.to_datetime(start_date)) & (df['Date'] <= pd.to_datetime(end_date)) & (df['Status'] == 'Completed')
-    period_df = df.loc[mask]
-    return {
-        "Revenue": period_df['Sale_Price'].sum(), 
-        "Profit": period_df['Profit'].sum(),
-        "Units": len(period_df)
-    }
+def editor_changes(key, shown_df):
+    """(updated, deleted, added) rows from the change set of st.data_editor `key`.
+    `shown_df` must be the frame the editor was given; updated is [(old, new)]."""
+    state = st.session_state.get(key) or {}
+    base = shown_df.to_dict('records')
+    deleted_pos = {int(i) for i in state.get('deleted_rows', [])}
+    updated = [(base[int(i)], dict(base[int(i)], **chg))
+               for i, chg in state.get('edited_rows', {}).items() if int(i) not in deleted_pos]
+    deleted = [base[i] for i in sorted(deleted_pos)]
+    added = [dict(r) for r in state.get('added_rows', [])]
+    return updated, deleted, added
+
+def apply_editor_changes(filename, columns, updated, deleted, added):
+    """db.apply_row_changes, showing a clash with another session's edit instead
+    of raising. Returns the number of missing rows, or None if nothing was saved."""
+    try:
+        return db.apply_row_changes(filename, columns, updated, deleted, added)
+    except db.ConflictError as e:
+        st.error(f"Not saved: {e}. Reload to see their change, then re-apply yours.")
+        return None
+
+def retry_or_report(operation):
+    """db.retry_on_conflict, showing an error once other sessions have won every
+    attempt instead of raising. Returns (saved, what `operation` returned)."""
+    try:
+        return True, db.retry_on_conflict(operation)
+    except db.ConflictError as e:
+        st.error(f"Not saved: {e}. Another session kept changing the same data; reload the page and retry.")
+        return False, None
+
+def calculate_time_horizon_metrics(start_date, end_date):
+    # Two binary searches over the cumulative KPI arrays; None means open-ended.
+    return db.period_metrics(start_date, end_date)
 
 def infer_brand_and_group(type_str, color_str):
     t = type_str.upper()
@@ -129,6 +145,73 @@ def infer_brand_and_group(type_str, color_str):
     if "SHORT" in t or "TEE" in t or "SHIRT" in t: return brand, "TEE" if "SHIRT" in t else "SHORTS", "Ess_TeeShort"
     return brand, "HOODIE" if "HOOD" in t else "PANT", "Ess_HoodiePant"
 
+# --- INVENTORY PAGE FRAGMENTS ---
+# The Inventory page is split into fragments so a cell edit reruns only the
+# table it belongs to. Sorting and the cost summary are computed once per
+# inventory version and shared by every fragment.
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", lambda f: f)
+INVENTORY_EDIT_COLUMNS = ['Brand', 'Type', 'Color', 'Size', 'Quantity', 'WAC_Cost', 'WAC_Group']
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def inventory_layout(version):
+    """(cost summary, [(display group, [(type, editor frame)])]) in display order."""
+    df = _cached_frame(md.INVENTORY_FILE, version, True)
+    if df.empty: return None, []
+    df = df[df['Color'].astype(str).str.strip() != ''].copy()
+    df['Total Value'] = df['Quantity'] * df['WAC_Cost']
+    
+    wac_summ = df.groupby(['WAC_Group']).agg(
+        Brand=('Brand', 'first'),
+        Type_Desc=('Type', lambda x: "/".join(sorted(set(x)))), 
+        Total_Units=('Quantity', 'sum'), 
+        Total_Cost=('Total Value', 'sum')
+    ).reset_index()
+    wac_summ['Avg Cost'] = wac_summ['Total_Cost'] / wac_summ['Total_Units']
+    wac_summ['Sort_Key'] = ct.wac_group_ranks(wac_summ['WAC_Group'])
+    wac_summ = wac_summ.sort_values('Sort_Key').drop(columns=['Sort_Key'])
+    
+    tables = []
+    for g, group_df in ct.sort_inventory(df).groupby('Display_Group', sort=False):
+        types = [(t, sub_df[INVENTORY_EDIT_COLUMNS]) for t, sub_df in group_df.groupby('Type', sort=False)]
+        tables.append((g, types))
+    return wac_summ, tables
+
+@fragment
+def inventory_summary(wac_summ):
+    st.subheader("📊 Cost Basis Summary")
+    st.dataframe(wac_summ.style.format({'Total_Cost': "${:,.2f}", 'Avg Cost': "${:.2f}"}), use_container_width=True, hide_index=True)
+
+@fragment
+def inventory_group(g, types):
+    st.markdown(f"### {g}")
+    for t, shown in types:
+        st.caption(f"**{t}**")
+        st.data_editor(
+            shown, 
+            key=f"editor_{g}_{t}", 
+            num_rows="dynamic", 
+            use_container_width=True
+        )
+        st.text("") # Spacing
+
+@fragment
+def inventory_save_bar(editor_frames):
+    if st.button("💾 SAVE ALL INVENTORY CHANGES", type="primary"):
+        updated, deleted, added = [], [], []
+        for key, shown in editor_frames:
+            u, d, a = editor_changes(key, shown)
+            updated += u; deleted += d; added += a
+        for r in [new for _, new in updated] + added:
+            r['Quantity'] = str(int(r.get('Quantity') or 0))
+            r['WAC_Cost'] = str(float(r.get('WAC_Cost') or 0))
+        
+        missing = apply_editor_changes(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, updated, deleted, added)
+        if missing is None: return
+        if missing: st.warning(f"{missing} edited rows no longer exist (changed elsewhere) and were skipped.")
+        else:
+            st.success("Inventory Updated Successfully!")
+            st.rerun()
+
 # --- SIDEBAR ---
 st.sidebar.title("🔐 Thredvault")
 main_menu = st.sidebar.radio("Navigate:", 
@@ -141,24 +224,12 @@ main_menu = st.sidebar.radio("Navigate:",
 if main_menu == "Dashboard":
     st.title("CEO Dashboard 🚀")
     
-    # 1. LOAD ALL DATA
-    sales_data = db.load_csv(md.SALES_FILE)
-    sales_df = pd.DataFrame(sales_data)
-    if not sales_df.empty:
-        if 'Status' not in sales_df.columns: sales_df['Status'] = 'Completed'
-        sales_df['Date'] = pd.to_datetime(sales_df['Date'], errors='coerce')
-        sales_df['Sale_Price'] = pd.to_numeric(sales_df['Sale_Price'], errors='coerce').fillna(0.0)
-        sales_df['Profit'] = pd.to_numeric(sales_df['Profit'], errors='coerce').fillna(0.0)
-    
-    inv_data = db.load_csv(md.INVENTORY_FILE)
-    inv_df = pd.DataFrame(inv_data) if inv_data else pd.DataFrame(columns=md.INVENTORY_COLUMNS)
+    # 1. LOAD ALL DATA (sales KPIs come from the daily rollup)
+    inv_df = load_frame(md.INVENTORY_FILE, typed=True)
     if not inv_df.empty:
-        inv_df['Quantity'] = pd.to_numeric(inv_df['Quantity'], errors='coerce').fillna(0)
-        inv_df['WAC_Cost'] = pd.to_numeric(inv_df['WAC_Cost'], errors='coerce').fillna(0.0)
         inv_df['Total Value'] = inv_df['Quantity'] * inv_df['WAC_Cost']
 
-    orders_data = db.load_csv(md.ORDERS_FILE)
-    orders_df = pd.DataFrame(orders_data) if orders_data else pd.DataFrame(columns=md.ORDER_COLUMNS)
+    orders_df = load_columns(md.ORDERS_FILE, ['Status', 'Total_Cost'])
 
     fin = db.load_financials()
     
@@ -168,19 +239,11 @@ if main_menu == "Dashboard":
     start_of_month = today.replace(day=1)
     
     # Filter sales strictly within this month
-    if not sales_df.empty:
-        mtd_mask = (sales_df['Date'] >= start_of_month) & \
-                   (sales_df['Date'] <= today) & \
-                   (sales_df['Status'] == 'Completed')
-        mtd_df = sales_df.loc[mtd_mask]
-        
-        # Calculate sums for MTD
-        mtd_rev = mtd_df['Sale_Price'].sum()
-        mtd_prof = mtd_df['Profit'].sum()
-        mtd_units = len(mtd_df)
-        mtd_margin = (mtd_prof / mtd_rev * 100) if mtd_rev > 0 else 0.0
-    else:
-        mtd_rev = 0.0; mtd_prof = 0.0; mtd_units = 0; mtd_margin = 0.0
+    mtd = calculate_time_horizon_metrics(start_of_month, today)
+    mtd_rev = mtd['Revenue']
+    mtd_prof = mtd['Profit']
+    mtd_units = mtd['Units']
+    mtd_margin = (mtd_prof / mtd_rev * 100) if mtd_rev > 0 else 0.0
 
     # Period Display
     col_p1, col_p2, col_p3, col_p4 = st.columns(4)
@@ -197,7 +260,7 @@ if main_menu == "Dashboard":
     in_transit_val = 0.0
     if not orders_df.empty:
         pending = orders_df[(orders_df['Status'] != 'Received') & (orders_df['Status'] != 'Cancelled')]
-        if not pending.empty: in_transit_val = pd.to_numeric(pending['Total_Cost'], errors='coerce').sum()
+        if not pending.empty: in_transit_val = pending['Total_Cost'].sum()
 
     on_hand_stock_val = inv_df['Total Value'].sum() if not inv_df.empty else 0.0
     total_committed_stock = on_hand_stock_val + in_transit_val
@@ -245,12 +308,11 @@ if main_menu == "Dashboard":
         "Month-to-Date": (start_of_month, today),
         "Quarter-to-Date": (start_q, today),
         "Year-to-Date": (start_y, today),
-        "All Time (System Log Only)": (pd.Timestamp.min, today)
+        "All Time (System Log Only)": (None, today)
     }
     
     horizon_data = []
-    for lbl, (s, e) in horizons.items():
-        m = calculate_time_horizon_metrics(sales_df, s, e)
+    for lbl, m in db.horizon_metrics(horizons).items():
         horizon_data.append({
             "Period": lbl, 
             "Revenue": f"${m['Revenue']:,.2f}", 
@@ -268,27 +330,27 @@ if main_menu == "Dashboard":
     # But since you want to match specific numbers, we use the BASE + Current approach
     # to avoid double counting or missing data if the import wasn't perfect.
     
-    # Note: If you imported your sales log, `sales_df` contains that history.
+    # Note: If you imported your sales log, sales.csv contains that history.
     # To prevent double counting with HISTORICAL_BASE, we should ideally NOT use HISTORICAL_BASE if sales.csv is full.
     # However, you asked to override to specific numbers.
     
     # For now, we will calculate based on `sales.csv` contents assuming you imported your history correctly.
     # If `sales.csv` is empty, it uses the base.
     
-    # Recalculate totals from dataframe
-    completed_sales = sales_df[sales_df['Status'] == 'Completed'] if not sales_df.empty else pd.DataFrame()
+    # Recalculate totals from the rollup (every completed sale, dated or not)
+    completed = calculate_time_horizon_metrics(None, None)
     
     # If we have data, we use the data. If not, we use your base numbers as starting points?
     # Actually, your request implies you want these specific numbers displayed NOW.
     # The best way is to treat `sales.csv` as the source of truth.
     # If the numbers don't match, it means `sales.csv` is missing rows or has wrong prices.
     
-    calc_rev = completed_sales['Sale_Price'].sum() if not completed_sales.empty else 0.0
-    calc_prof = completed_sales['Profit'].sum() if not completed_sales.empty else 0.0
-    calc_sold = len(completed_sales)
+    calc_rev = completed['Revenue']
+    calc_prof = completed['Profit']
+    calc_sold = completed['Units']
     
     # Use calculated values if they exist, otherwise fallback or assume they are part of the total
-    # NOTE: Since you imported legacy sales, `sales_df` SHOULD contain everything.
+    # NOTE: Since you imported legacy sales, sales.csv SHOULD contain everything.
     
     total_rev = calc_rev
     total_prof = calc_prof
@@ -325,78 +387,19 @@ if main_menu == "Dashboard":
 # ==============================================================================
 elif main_menu == "Inventory":
     st.title("📦 Inventory Overview")
-    data = db.load_csv(md.INVENTORY_FILE)
-    if not data: st.warning("Empty Inventory."); st.stop()
+    wac_summ, tables = inventory_layout(db.data_version(md.INVENTORY_FILE))
+    if wac_summ is None: st.warning("Empty Inventory."); st.stop()
 
-    df = pd.DataFrame(data)
-    df = df[df['Color'].astype(str).str.strip() != '']
-    df['Quantity'] = pd.to_numeric(df['Quantity'])
-    df['WAC_Cost'] = pd.to_numeric(df['WAC_Cost'])
-    
     # 1. Cost Summary - Grouped by WAC Group
-    st.subheader("📊 Cost Basis Summary")
-    df['Total Value'] = df['Quantity'] * df['WAC_Cost']
-    
-    wac_summ = df.groupby(['WAC_Group']).agg(
-        Brand=('Brand', 'first'),
-        Type_Desc=('Type', lambda x: "/".join(sorted(set(x)))), 
-        Total_Units=('Quantity', 'sum'), 
-        Total_Cost=('Total Value', 'sum')
-    ).reset_index()
-    
-    wac_summ['Avg Cost'] = wac_summ['Total_Cost'] / wac_summ['Total_Units']
-    wac_summ['Sort_Key'] = wac_summ['WAC_Group'].apply(get_wac_group_sort_order)
-    wac_summ = wac_summ.sort_values('Sort_Key').drop(columns=['Sort_Key'])
-    
-    st.dataframe(wac_summ.style.format({'Total_Cost': "${:,.2f}", 'Avg Cost': "${:.2f}"}), use_container_width=True, hide_index=True)
+    inventory_summary(wac_summ)
     st.divider()
     
     # 2. Detailed Editable Tables (Brand -> Type)
     st.subheader("📝 Edit Inventory")
-    
-    df['Color_Rank'] = df.apply(lambda x: get_custom_color_index(x['Brand'], x['Color']), axis=1)
-    df['Type_Rank'] = df['Type'].apply(get_type_index)
-    df['Size_Rank'] = df['Size'].apply(lambda x: md.SIZE_SORT_ORDER.get(x, 99))
-    df['Display_Group'] = df.apply(lambda x: get_inventory_display_group(x['Brand'], x['Type']), axis=1)
-    
-    groups = sorted(df['Display_Group'].unique(), key=get_group_sort_order)
-    
-    all_edited_dfs = []
-    
-    for g in groups:
-        st.markdown(f"### {g}")
-        group_df = df[df['Display_Group'] == g].copy()
-        
-        # Sub-divide by Type
-        unique_types = sorted(group_df['Type'].unique(), key=get_type_index)
-        
-        for t in unique_types:
-            sub_df = group_df[group_df['Type'] == t].sort_values(by=['Color_Rank', 'Size_Rank'])
-            
-            if not sub_df.empty:
-                st.caption(f"**{t}**")
-                cols_to_show = ['Brand', 'Type', 'Color', 'Size', 'Quantity', 'WAC_Cost', 'WAC_Group']
-                
-                edited = st.data_editor(
-                    sub_df[cols_to_show], 
-                    key=f"editor_{g}_{t}", 
-                    num_rows="dynamic", 
-                    use_container_width=True
-                )
-                all_edited_dfs.append(edited)
-                st.text("") # Spacing
+    for g, types in tables:
+        inventory_group(g, types)
 
-    if st.button("💾 SAVE ALL INVENTORY CHANGES", type="primary"):
-        if all_edited_dfs:
-            final_df = pd.concat(all_edited_dfs, ignore_index=True)
-            records = final_df.to_dict('records')
-            for r in records:
-                r['Quantity'] = str(int(r['Quantity']))
-                r['WAC_Cost'] = str(float(r['WAC_Cost']))
-            
-            db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, records)
-            st.success("Inventory Updated Successfully!")
-            st.rerun()
+    inventory_save_bar([(f"editor_{g}_{t}", shown) for g, types in tables for t, shown in types])
 
 # ==============================================================================
 # 3. RECEIVE STOCK
@@ -413,7 +416,7 @@ elif main_menu == "Receive Stock":
             if type_ == "Other": type_ = st.text_input("Type").upper()
         with c2:
             color_opts = md.BRAND_COLORS.get(brand, ["BLACK"])
-            if brand == "ESSENTIALS": color_opts = ESSENTIALS_ORDER
+            if brand == "ESSENTIALS": color_opts = ct.ESSENTIALS_ORDER
             color = st.selectbox("Color", color_opts + ["Other"])
             if color == "Other": color = st.text_input("Color").upper()
             size = st.selectbox("Size", md.SIZE_MAP.get(brand, ["S", "M"]) + ["Other"])
@@ -443,26 +446,26 @@ elif main_menu == "Receive Stock":
             total = pd.to_numeric(edited['Total_Value']).sum()
             st.metric("Total Batch Cost", f"${total:,.2f}")
             if st.button("✅ COMMIT"):
-                inv = db.load_csv(md.INVENTORY_FILE)
-                for item in st.session_state.receive_cart:
-                    found = False
-                    for row in inv:
-                        if (row['Brand'] == item['Brand'] and row['Type'] == item['Type'] and 
-                            row['Color'] == item['Color'] and row['Size'] == item['Size']):
+                def receive_batch():
+                    # Stock increments commute, so a clash with another save just re-runs on fresh stock.
+                    inv = db.load_inventory_index()
+                    for item in st.session_state.receive_cart:
+                        row = inv.get(item['Brand'], item['Type'], item['Color'], item['Size'])
+                        if row:
                             old_q, old_c = int(row['Quantity']), float(row['WAC_Cost'])
                             new_q = old_q + item['Quantity']
                             new_c = ((old_q * old_c) + (item['Quantity'] * item['Unit_Cost'])) / new_q
-                            row['Quantity'] = str(new_q); row['WAC_Cost'] = str(round(new_c, 2))
-                            found = True; break
-                    if not found:
-                        inv.append({
-                            "Brand": item['Brand'], "Type": item['Type'], "Color": item['Color'], 
-                            "Size": item['Size'], "Quantity": str(item['Quantity']), 
-                            "WAC_Cost": str(item['Unit_Cost']), "WAC_Group": item['WAC_Group']
-                        })
-                db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, inv)
-                for g in set(x['WAC_Group'] for x in st.session_state.receive_cart): db.recalculate_global_wac(g)
-                st.session_state.receive_cart = []; st.success("Done!"); st.rerun()
+                            inv.update(row, Quantity=str(new_q), WAC_Cost=str(round(new_c, 2)))
+                        else:
+                            inv.upsert({
+                                "Brand": item['Brand'], "Type": item['Type'], "Color": item['Color'], 
+                                "Size": item['Size'], "Quantity": str(item['Quantity']), 
+                                "WAC_Cost": str(item['Unit_Cost']), "WAC_Group": item['WAC_Group']
+                            })
+                    for g in set(x['WAC_Group'] for x in st.session_state.receive_cart): db.recalculate_global_wac(g, inv)
+                    db.save_inventory(inv)
+                saved, _ = retry_or_report(receive_batch)
+                if saved: st.session_state.receive_cart = []; st.success("Done!"); st.rerun()
         if st.button("Clear Batch"): st.session_state.receive_cart = []; st.rerun()
 
 # ==============================================================================
@@ -476,10 +479,9 @@ elif main_menu == "Log Sale":
     
     # --- TAB 1: MANUAL ENTRY ---
     with tab_sale:
-        inv = db.load_csv(md.INVENTORY_FILE)
-        if not inv: st.error("Empty Inv"); st.stop()
-        df = pd.DataFrame(inv)
-        df = df[pd.to_numeric(df['Quantity']) > 0]
+        df = load_frame(md.INVENTORY_FILE, typed=True)
+        if df.empty: st.error("Empty Inv"); st.stop()
+        df = df[df['Quantity'] > 0]
         
         c1, c2, c3, c4 = st.columns(4)
         brand = c1.selectbox("Brand", df['Brand'].unique())
@@ -539,44 +541,15 @@ elif main_menu == "Log Sale":
             status = st.selectbox("Status", ["Completed", "Pending"])
             
             if st.button(f"✅ CONFIRM AS {status.upper()}", type="primary"):
-                cinv = db.load_csv(md.INVENTORY_FILE)
-                csales = db.load_csv(md.SALES_FILE)
-                
-                valid = True
-                for item in st.session_state.sales_cart:
-                    for r in cinv:
-                        if (r['Brand'] == item['Brand'] and r['Color'] == item['Color'] and 
-                            r['Size'] == item['Size'] and r['Type'] == item['Type']):
-                            if int(r['Quantity']) < item['Quantity']:
-                                st.error(f"Stock error: {item['Brand']} {item['Color']}! (Only {r['Quantity']} left)")
-                                valid = False
-                            break
+                try:
+                    sale_ids, errors = db.checkout(st.session_state.sales_cart, status)
+                except db.ConflictError as e:
+                    # Nothing was written; the cart stays for another try.
+                    sale_ids, errors = [], [(0, f"Not saved: {e}. Other sales kept changing this stock; reload and retry.")]
+                for _, msg in errors: st.error(msg)
                 
-                if valid:
-                    for item in st.session_state.sales_cart:
-                        for r in cinv:
-                            if (r['Brand'] == item['Brand'] and r['Color'] == item['Color'] and 
-                                r['Size'] == item['Size'] and r['Type'] == item['Type']):
-                                r['Quantity'] = str(int(r['Quantity']) - int(item['Quantity']))
-                                break
-                        profit = float(item['Total']) - (float(item['Quantity']) * float(item['Cost']))
-                        
-                        sale_date = date.today().strftime("%m/%d/%Y") if status == "Completed" else ""
-                        
-                        csales.append({
-                            "ID": db.get_next_sale_id(), 
-                            "Date": sale_date,
-                            "Brand": item['Brand'], "Type": item['Type'], "Color": item['Color'], 
-                            "Size": item['Size'], "Sale_Price": str(item['Total']), 
-                            "Profit": str(round(profit, 2)), "WAC_Group": item['WAC_Group'],
-                            "Status": status
-                        })
-                    
-                    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, cinv)
-                    db.save_csv(md.SALES_FILE, md.SALES_COLUMNS, csales)
-                    
+                if not errors:
                     if status == "Completed":
-                        db.update_cash_on_hand(tot)
                         st.success("Sale Recorded & Cash Added!")
                     else:
                         st.warning("Sale Recorded as Pending (No Cash Added).")
@@ -588,9 +561,9 @@ elif main_menu == "Log Sale":
         
         st.divider()
         st.subheader("🕒 Recently Logged Sales")
-        recent_sales = db.load_csv(md.SALES_FILE)
-        if recent_sales:
-            st.dataframe(pd.DataFrame(recent_sales).tail(5).iloc[::-1])
+        recent_sales = load_frame(md.SALES_FILE)
+        if not recent_sales.empty:
+            st.dataframe(recent_sales.tail(5).iloc[::-1])
 
     # --- TAB 2: LEGACY IMPORT ---
     with tab_import:
@@ -609,11 +582,12 @@ elif main_menu == "Log Sale":
                 st.dataframe(imp_df.head())
                 
                 if st.button("Process Import"):
-                    sales = db.load_csv(md.SALES_FILE)
+                    sales = []
                     inv_data = db.load_csv(md.INVENTORY_FILE)
                     wac_map = {}
                     for r in inv_data: wac_map[r['WAC_Group']] = float(r['WAC_Cost'])
                     count = 0
+                    sale_ids = iter(db.allocate_ids("sale", len(imp_df)))
                     
                     for _, row in imp_df.iterrows():
                         try:
@@ -631,7 +605,7 @@ elif main_menu == "Log Sale":
                             profit = price - cost
                             
                             sales.append({
-                                "ID": db.get_next_sale_id(), "Date": date_val,
+                                "ID": next(sale_ids), "Date": date_val,
                                 "Brand": brand, "Type": type_raw, "Color": color, "Size": size,
                                 "Sale_Price": str(price), "Profit": str(round(profit, 2)), 
                                 "WAC_Group": wac_grp, "Status": status_val
@@ -639,7 +613,7 @@ elif main_menu == "Log Sale":
                             count += 1
                         except Exception as e: st.error(f"Skipped row: {e}")
                             
-                    db.save_csv(md.SALES_FILE, md.SALES_COLUMNS, sales)
+                    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, sales)
                     st.success(f"Imported {count} records!")
                     
             except Exception as e: st.error(f"Error: {e}")
@@ -647,11 +621,9 @@ elif main_menu == "Log Sale":
     # --- TAB 3: SALES HISTORY ---
     with tab_manage:
         st.subheader("📜 Sales History")
-        sales_data = db.load_csv(md.SALES_FILE)
-        if sales_data:
-            s_df = pd.DataFrame(sales_data)
+        s_df = load_frame(md.SALES_FILE, typed=True)
+        if not s_df.empty:
             s_df = s_df[s_df['Status'] == 'Completed']
-            s_df['Date_Obj'] = pd.to_datetime(s_df['Date'], errors='coerce')
             s_df = s_df.sort_values(by='Date_Obj', ascending=False)
             
             min_d = s_df['Date_Obj'].min().date() if not s_df.empty else date.today()
@@ -661,25 +633,28 @@ elif main_menu == "Log Sale":
                 s_df = s_df[(s_df['Date_Obj'].dt.date >= d_range[0]) & (s_df['Date_Obj'].dt.date <= d_range[1])]
 
             display_df = s_df.drop(columns=['Date_Obj'])
-            edited_sales = st.data_editor(display_df, num_rows="dynamic", use_container_width=True, key="history_edit")
+            st.data_editor(display_df, num_rows="dynamic", use_container_width=True, key="history_edit")
             
             if st.button("💾 Save Sales Log Changes", type="primary"):
                 inv_data = db.load_csv(md.INVENTORY_FILE)
                 wac_map = {}
                 for r in inv_data: wac_map[r['WAC_Group']] = float(r['WAC_Cost'])
                 
-                records = edited_sales.to_dict('records')
-                for r in records:
-                    new_price = float(r['Sale_Price'])
-                    grp = r.get('WAC_Group', 'UNKNOWN')
+                updated, deleted, added = editor_changes("history_edit", display_df)
+                new_ids = iter(db.allocate_ids("sale", len(added))) if added else iter(())
+                for r in added:
+                    r['ID'] = str(next(new_ids))
+                    r['Status'] = r.get('Status') or 'Completed'
+                for r in [new for _, new in updated] + added:
+                    new_price = float(r.get('Sale_Price') or 0)
+                    grp = r.get('WAC_Group') or 'UNKNOWN'
                     cost = wac_map.get(grp, 0.0) 
                     r['Profit'] = str(new_price - cost)
                     r['Sale_Price'] = str(new_price)
                 
-                all_sales = db.load_csv(md.SALES_FILE)
-                pending_sales = [x for x in all_sales if x['Status'] != 'Completed']
-                db.save_csv(md.SALES_FILE, md.SALES_COLUMNS, records + pending_sales)
-                st.success("Sales History Saved!"); st.rerun()
+                missing = apply_editor_changes(md.SALES_FILE, md.SALES_COLUMNS, updated, deleted, added)
+                if missing: st.warning(f"{missing} edited sales no longer exist (changed elsewhere) and were skipped.")
+                elif missing is not None: st.success("Sales History Saved!"); st.rerun()
 
     # --- TAB 4: PENDING SALES ---
     with tab_pending:
@@ -690,24 +665,27 @@ elif main_menu == "Log Sale":
         if not pending_sales: st.info("No pending sales.")
         else:
             p_df = pd.DataFrame(pending_sales)
-            edited_pending = st.data_editor(p_df, num_rows="dynamic", key="pending_edit")
+            st.data_editor(p_df, num_rows="dynamic", key="pending_edit")
             col1, col2 = st.columns(2)
             with col1: selected_id = st.selectbox("Select Sale ID to Complete", p_df['ID'].tolist())
             with col2:
                 if st.button("Mark as Completed"):
-                    for r in all_sales:
-                        if r['ID'] == selected_id:
-                            r['Status'] = 'Completed'
-                            r['Date'] = date.today().strftime("%m/%d/%Y")
-                            db.update_cash_on_hand(float(r['Sale_Price']))
-                            break
-                    db.save_csv(md.SALES_FILE, md.SALES_COLUMNS, all_sales)
+                    with db.commit_group():
+                        # Re-read inside the group so two sessions cannot both book the cash.
+                        sale = next((r for r in db.load_csv(md.SALES_FILE) if r['ID'] == selected_id), None)
+                        if sale and sale.get('Status') != 'Completed':
+                            done = dict(sale, Status='Completed', Date=date.today().strftime("%m/%d/%Y"))
+                            db.apply_row_changes(md.SALES_FILE, md.SALES_COLUMNS, updated=[(sale, done)])
+                            db.update_cash_on_hand(float(sale['Sale_Price']), "Pending Sale Completed", selected_id)
                     st.success("Marked as Completed!"); st.rerun()
             if st.button("💾 Save Pending Changes"):
-                 new_pending = edited_pending.to_dict('records')
-                 completed = [x for x in all_sales if x.get('Status') == 'Completed']
-                 db.save_csv(md.SALES_FILE, md.SALES_COLUMNS, completed + new_pending)
-                 st.success("Saved!")
+                 updated, deleted, added = editor_changes("pending_edit", p_df)
+                 new_ids = iter(db.allocate_ids("sale", len(added))) if added else iter(())
+                 for r in added:
+                     r['ID'] = str(next(new_ids))
+                     r['Status'] = r.get('Status') or 'Pending'
+                 if apply_editor_changes(md.SALES_FILE, md.SALES_COLUMNS, updated, deleted, added) is not None:
+                     st.success("Saved!")
 
 # ==============================================================================
 # 5. PURCHASING (MANAGE ORDERS)
@@ -729,12 +707,11 @@ elif main_menu == "Purchasing":
         
         wac_group = md.find_wac_group(brand, type_)
         if wac_group == "UNKNOWN": wac_group = f"{brand}_{type_}"
-        inv = db.load_csv(md.INVENTORY_FILE)
-        if inv:
-            idf = pd.DataFrame(inv)
+        idf = load_frame(md.INVENTORY_FILE, typed=True)
+        if not idf.empty:
             grp = idf[idf['WAC_Group'] == wac_group]
             if not grp.empty:
-                curr = pd.to_numeric(grp['WAC_Cost']).mean()
+                curr = grp['WAC_Cost'].mean()
                 if (cost/qty if qty>0 else 0) > curr * 1.1: c6.warning(f"High! Avg: ${curr:.2f}")
 
         if st.button("Add Line"):
@@ -752,16 +729,14 @@ elif main_menu == "Purchasing":
             
             if st.button("💾 SAVE ORDER", type="primary"):
                 new_id = db.get_next_order_id()
-                orders = db.load_csv(md.ORDERS_FILE)
-                for i in st.session_state.purchase_cart:
-                    orders.append({
-                        "Order_ID": new_id, "Date": order_date.strftime("%m/%d/%Y"),
-                        "WAC_Group": i['WAC_Group'], "Supplier": supplier, 
-                        "Total_Pieces": str(i['Total_Pieces']), "Total_Cost": str(i['Total_Cost']),
-                        "Unit_Cost": str(i['Unit_Cost']), "Amount_Paid": "0", "Payment_Status": "Unpaid", 
-                        "Status": "Ordered", "Delivery_Date": "N/A"
-                    })
-                db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, orders)
+                lines = [{
+                    "Order_ID": new_id, "Date": order_date.strftime("%m/%d/%Y"),
+                    "WAC_Group": i['WAC_Group'], "Supplier": supplier, 
+                    "Total_Pieces": str(i['Total_Pieces']), "Total_Cost": str(i['Total_Cost']),
+                    "Unit_Cost": str(i['Unit_Cost']), "Amount_Paid": "0", "Payment_Status": "Unpaid", 
+                    "Status": "Ordered", "Delivery_Date": "N/A"
+                } for i in st.session_state.purchase_cart]
+                db.append_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, lines)
                 st.session_state.purchase_cart = []; st.success(f"Order #{new_id} Saved"); st.rerun()
 
     with tab2: st.info("Use 'Manage Orders' to verify receipts.")
@@ -787,23 +762,29 @@ elif main_menu == "Purchasing":
             })
         
         st.write("### Order Lines (Edit or Delete Lines)")
-        edited_order = st.data_editor(pd.DataFrame(display_data), num_rows="dynamic", key="manage_edit")
+        st.data_editor(pd.DataFrame(display_data), num_rows="dynamic", key="manage_edit")
         
         if st.button("💾 Save Line Changes"):
-            new_master_list = [o for o in orders if o['Order_ID'] != sel_oid]
-            for _, row in edited_order.iterrows():
-                orig = next((x for x in target_rows if x['WAC_Group'] == row['WAC Group']), target_rows[0])
-                new_line = {
+            # Editor rows are positional over target_rows, so old lines come from there.
+            state = st.session_state.get("manage_edit") or {}
+            deleted_pos = {int(i) for i in state.get('deleted_rows', [])}
+            def to_line(row, orig):
+                pieces, cost, paid = float(row.get('Pieces') or 0), float(row.get('Cost') or 0), float(row.get('Paid') or 0)
+                return {
                     "Order_ID": sel_oid, "Date": orig['Date'], "Supplier": orig['Supplier'],
-                    "WAC_Group": row['WAC Group'], "Total_Pieces": str(row['Pieces']),
-                    "Total_Cost": str(row['Cost']), "Unit_Cost": str(row['Cost']/row['Pieces'] if row['Pieces']>0 else 0),
-                    "Amount_Paid": str(row['Paid']), 
-                    "Payment_Status": 'Paid' if row['Paid'] >= row['Cost'] else 'Partial',
-                    "Status": row['Status'], "Delivery_Date": row['Delivery']
+                    "WAC_Group": row.get('WAC Group') or orig['WAC_Group'], "Total_Pieces": str(row.get('Pieces')),
+                    "Total_Cost": str(cost), "Unit_Cost": str(cost/pieces if pieces>0 else 0),
+                    "Amount_Paid": str(paid), 
+                    "Payment_Status": 'Paid' if paid >= cost else 'Partial',
+                    "Status": row.get('Status') or orig['Status'], "Delivery_Date": row.get('Delivery') or "N/A"
                 }
-                new_master_list.append(new_line)
-            db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, new_master_list)
-            st.success("Order Updated!"); st.rerun()
+            updated = [(target_rows[int(i)], to_line(dict(display_data[int(i)], **chg), target_rows[int(i)]))
+                       for i, chg in state.get('edited_rows', {}).items() if int(i) not in deleted_pos]
+            deleted = [target_rows[i] for i in sorted(deleted_pos)]
+            added = [to_line(r, target_rows[0]) for r in state.get('added_rows', [])]
+            missing = apply_editor_changes(md.ORDERS_FILE, md.ORDER_COLUMNS, updated, deleted, added)
+            if missing: st.warning(f"{missing} order lines changed elsewhere and were skipped.")
+            elif missing is not None: st.success("Order Updated!"); st.rerun()
 
         st.divider()
         c_pay, c_del = st.columns(2)
@@ -811,38 +792,49 @@ elif main_menu == "Purchasing":
             curr_paid = sum(float(r['Amount_Paid']) for r in target_rows)
             new_paid_total = st.number_input("Total Amount Paid", value=curr_paid)
             if st.button("Update Payment"):
-                diff = new_paid_total - curr_paid
-                if diff != 0: db.update_cash_on_hand(-diff)
-                
-                fresh_orders = db.load_csv(md.ORDERS_FILE)
-                for r in fresh_orders:
-                    if r['Order_ID'] == sel_oid:
-                        share = float(r['Total_Cost']) / tot_cost if tot_cost > 0 else 0
+                def distribute_payment():
+                    # Orders are re-read first: cash moves by the change from what is paid *now*.
+                    fresh_orders, version = db.load_versioned(md.ORDERS_FILE)
+                    lines = [r for r in fresh_orders if r['Order_ID'] == sel_oid]
+                    fresh_cost = sum(float(r['Total_Cost']) for r in lines)
+                    diff = new_paid_total - sum(float(r['Amount_Paid']) for r in lines)
+                    for r in lines:
+                        share = float(r['Total_Cost']) / fresh_cost if fresh_cost > 0 else 0
                         r['Amount_Paid'] = str(round(new_paid_total * share, 2))
                         r['Payment_Status'] = 'Paid' if float(r['Amount_Paid']) >= float(r['Total_Cost']) else 'Partial'
-                db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, fresh_orders)
-                st.success("Payment Distributed & Cash Updated"); st.rerun()
+                    with db.commit_group():
+                        db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, fresh_orders, version)
+                        if diff != 0: db.update_cash_on_hand(-diff, "Order Payment", sel_oid)
+                saved, _ = retry_or_report(distribute_payment)
+                if saved: st.success("Payment Distributed & Cash Updated"); st.rerun()
                 
         with c_del:
              if st.button("DELETE ENTIRE ORDER", type="primary"):
-                 if curr_paid > 0:
-                     db.update_cash_on_hand(curr_paid)
-                     st.warning(f"Refunded ${curr_paid} to cash.")
-                 final_list = [o for o in orders if o['Order_ID'] != sel_oid]
-                 db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, final_list)
-                 st.success("Deleted"); st.rerun()
+                 def delete_order():
+                     fresh_orders, version = db.load_versioned(md.ORDERS_FILE)
+                     paid = sum(float(o['Amount_Paid']) for o in fresh_orders if o['Order_ID'] == sel_oid)
+                     with db.commit_group():
+                         db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS,
+                                     [o for o in fresh_orders if o['Order_ID'] != sel_oid], version)
+                         if paid > 0: db.update_cash_on_hand(paid, "Order Deleted", sel_oid)
+                     return paid
+                 saved, refunded = retry_or_report(delete_order)
+                 if saved:
+                     if refunded > 0: st.warning(f"Refunded ${refunded} to cash.")
+                     st.success("Deleted"); st.rerun()
 
 # ==============================================================================
 # 6. ANALYTICS & TOOLS
 # ==============================================================================
 elif main_menu == "Analytics":
     st.title("📈 Performance")
-    sales_data = db.load_csv(md.SALES_FILE)
-    if sales_data:
-        sdf = pd.DataFrame(sales_data)
-        sdf['Profit'] = pd.to_numeric(sdf['Profit'])
-        sdf['Sale_Price'] = pd.to_numeric(sdf['Sale_Price'])
-        st.subheader("Brand Performance")
+    st.subheader("Brand Performance")
+    a_range = st.date_input("Date Range (empty = all time)", value=[], key="analytics_range")
+    a_start = a_range[0] if len(a_range) > 0 else None
+    a_end = a_range[1] if len(a_range) > 1 else None
+    sdf = load_columns(md.SALES_FILE, ['Brand', 'Sale_Price', 'Profit'], a_start, a_end)
+    if sdf.empty: st.info("No sales in this range.")
+    else:
         bstats = sdf.groupby('Brand')[['Sale_Price', 'Profit']].sum().reset_index()
         bstats['Margin %'] = (bstats['Profit'] / bstats['Sale_Price']) * 100
         st.dataframe(bstats.style.format({'Sale_Price': "${:,.2f}", 'Profit': "${:,.2f}", 'Margin %': "{:.2f}%"}))
@@ -860,18 +852,46 @@ elif main_menu == "Admin Tools":
         new_wac_val = st.number_input("Correct WAC Value ($)", min_value=0.01)
         
     if st.button("⚠️ Force Update WAC for Group"):
-        inv = db.load_csv(md.INVENTORY_FILE)
-        count = 0
-        for row in inv:
-            if row.get('WAC_Group') == target_group:
-                row['WAC_Cost'] = str(new_wac_val)
-                count += 1
-        db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, inv)
-        st.success(f"Updated {count} items in {target_group} to ${new_wac_val}")
+        def force_group_cost():
+            inv = db.load_inventory_index()
+            count = inv.set_group_cost(target_group, new_wac_val)
+            db.save_inventory(inv)
+            return count
+        saved, count = retry_or_report(force_group_cost)
+        if saved: st.success(f"Updated {count} items in {target_group} to ${new_wac_val}")
+
+    if st.button("Verify WAC Totals"):
+        mismatches = db.verify_wac_totals()
+        if not mismatches: st.success("Running WAC totals match a full recompute.")
+        for g, (tracked, actual) in mismatches.items():
+            st.error(f"{g}: tracked {tracked[0]} pcs / ${tracked[1]:,.2f}, actual {actual[0]} pcs / ${actual[1]:,.2f}")
         
     st.divider()
     if st.button("Clean Inventory"):
-        inv = db.load_csv(md.INVENTORY_FILE)
-        cln = [r for r in inv if r.get('Color') and str(r['Color']).strip() != ""]
-        db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, cln)
-        st.success("Done")
\ No newline at end of file
+        def clean_inventory():
+            inv, version = db.load_versioned(md.INVENTORY_FILE)
+            cln = [r for r in inv if r.get('Color') and str(r['Color']).strip() != ""]
+            db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, cln, version)
+        saved, _ = retry_or_report(clean_inventory)
+        if saved: st.success("Done")
+
+    st.divider()
+    st.subheader("⏪ Point-in-Time Restore")
+    oldest = db.oldest_backup()
+    if oldest is None:
+        st.info("No backups yet.")
+    else:
+        st.caption(f"Oldest backup: {oldest[:19].replace('T', ' ')}. "
+                   "The current state is backed up first, so a restore can be undone.")
+        col1, col2 = st.columns(2)
+        with col1: restore_day = st.date_input("Restore as of date", value=date.today())
+        with col2: restore_time = st.time_input("Time", value=datetime.now().time().replace(microsecond=0))
+        confirmed = st.checkbox("Replace inventory, sales, orders and cash with this point in time")
+        if st.button("⏪ Restore", disabled=not confirmed):
+            try:
+                backup_id, replayed = db.restore_as_of(datetime.combine(restore_day, restore_time))
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.cache_data.clear()
+                st.success(f"Restored from backup {backup_id} plus {replayed} logged change(s).")
\ No newline at end of file
@@ -0,0 +1,112 @@
+# thredvault_system/catalog.py
+# Display orderings for the product catalog, compiled once at import into rank
+# lookups (and pandas Categorical dtypes when pandas is available) so pages
+# sort and group inventory in one vectorized pass instead of per-row lambdas.
+from functools import lru_cache
+import models as md
+
+try:
+    import pandas as pd
+except ImportError:  # The CLI only needs the scalar lookups.
+    pd = None
+
+# --- ORDERINGS ---
+ESSENTIALS_ORDER = ["B22", "L/O", "D/O", "1977 IRON", "1977 D/O", "BLACK", "WHITE"]
+DENIM_TEARS_ORDER = ["BLACK", "GREY"]
+SP5DER_ORDER = ["PINK", "BLUE", "BLACK"]
+ERIC_EMANUEL_ORDER = ["BLACK", "NAVY", "GREY", "LIGHT BLUE", "RED", "WHITE"]
+YZY_ORDER = ["BONE", "ONYX"]
+
+COLOR_ORDERS = {
+    "ESSENTIALS": ESSENTIALS_ORDER, "DENIM TEARS": DENIM_TEARS_ORDER, "SP5DER": SP5DER_ORDER,
+    "ERIC EMANUEL": ERIC_EMANUEL_ORDER, "YZY": YZY_ORDER, "ADIDAS": YZY_ORDER
+}
+
+TYPE_ORDER = ["HOODIE", "PANT", "TEE", "SHORTS", "SLIDES"]
+
+# Specific WAC Group Order for Summary Table
+WAC_GROUP_ORDER = [
+    "Ess_HoodiePant", "Ess_TeeShort", "Den_HoodiePant",
+    "Spdr_HoodiePant", "Eric_EmanShorts", "YZY_Slides"
+]
+
+ESSENTIALS_SWEATS = "ESSENTIALS (Sweats)"
+ESSENTIALS_TEES = "ESSENTIALS (Tees/Shorts)"
+DISPLAY_GROUP_ORDER = [ESSENTIALS_SWEATS, ESSENTIALS_TEES, "DENIM TEARS", "SP5DER", "ERIC EMANUEL", "YZY"]
+
+UNRANKED = 99
+
+# --- LOOKUPS ---
+BRAND_RANK = {b: i for i, b in enumerate(md.BRAND_PRIORITY)}
+SIZE_ORDER = sorted(md.SIZE_SORT_ORDER, key=md.SIZE_SORT_ORDER.get)
+
+@lru_cache(maxsize=None)
+def color_rank(brand, color):
+    """Position of a color in its brand's order; partial names match by substring."""
+    c = str(color).upper()
+    order_list = COLOR_ORDERS.get(str(brand).upper(), [])
+    if c in order_list: return order_list.index(c)
+    for i, val in enumerate(order_list):
+        if val in c: return i
+    return UNRANKED
+
+def brand_rank(brand):
+    return BRAND_RANK.get(str(brand).upper(), UNRANKED)
+
+@lru_cache(maxsize=None)
+def display_group_rank(group_name):
+    for i, name in enumerate(DISPLAY_GROUP_ORDER):
+        if name in group_name: return i
+    return UNRANKED
+
+# --- VECTORIZED (pandas) ---
+if pd is not None:
+    TYPE_DTYPE = pd.CategoricalDtype(TYPE_ORDER, ordered=True)
+    SIZE_DTYPE = pd.CategoricalDtype(SIZE_ORDER, ordered=True)
+    WAC_GROUP_DTYPE = pd.CategoricalDtype(WAC_GROUP_ORDER, ordered=True)
+    WAC_GROUP_TABLE = pd.DataFrame([(b, t, g) for (b, t), g in md.WAC_GROUP_LOOKUP.items()],
+                                   columns=['_Brand', '_Type', 'WAC_Group'])
+
+def _codes(values, dtype):
+    """Rank of each value in an ordered Categorical; unknown values get UNRANKED."""
+    codes = pd.Series(pd.Categorical(values, dtype=dtype).codes, index=values.index)
+    return codes.where(codes >= 0, UNRANKED)
+
+def _mapped(values, rank):
+    """Applies `rank` once per distinct value and maps the result onto the column."""
+    return values.map({v: rank(v) for v in values.unique()})
+
+def wac_group_ranks(wac_groups):
+    return _codes(wac_groups, WAC_GROUP_DTYPE)
+
+def wac_groups(df, brand_col='Brand', type_col='Type'):
+    """md.find_wac_group for every row of `df`, as one merge against the lookup table."""
+    keys = pd.DataFrame({'_Brand': df[brand_col].astype(str).str.upper().to_numpy(),
+                         '_Type': df[type_col].astype(str).str.upper().to_numpy()})
+    found = keys.merge(WAC_GROUP_TABLE, how='left', on=['_Brand', '_Type'])['WAC_Group']
+    return pd.Series(found.fillna("UNKNOWN").to_numpy(), index=df.index)
+
+def fill_wac_groups(df):
+    """Backfills blank/'None' WAC_Group labels from Brand/Type."""
+    if 'WAC_Group' not in df.columns: df['WAC_Group'] = ''
+    blank = df['WAC_Group'].isna() | df['WAC_Group'].astype(str).isin(['', 'None'])
+    if blank.any(): df.loc[blank, 'WAC_Group'] = wac_groups(df.loc[blank])
+    return df
+
+def add_sort_keys(df):
+    """Adds Display_Group and the Display/Type/Color/Size rank columns to an inventory frame."""
+    brand = df['Brand'].astype(str).str.upper()
+    type_ = df['Type'].astype(str).str.upper()
+    sweats = type_.isin(["HOODIE", "PANT"])
+    df['Display_Group'] = brand.where(brand != "ESSENTIALS", sweats.map({True: ESSENTIALS_SWEATS, False: ESSENTIALS_TEES}))
+    df['Display_Rank'] = _mapped(df['Display_Group'], display_group_rank)
+    df['Type_Rank'] = _codes(type_, TYPE_DTYPE)
+    pairs = brand + "\x00" + df['Color'].astype(str)
+    df['Color_Rank'] = _mapped(pairs, lambda p: color_rank(*p.split("\x00", 1)))
+    df['Size_Rank'] = _codes(df['Size'], SIZE_DTYPE)
+    return df
+
+def sort_inventory(df):
+    """Inventory in display order: group, type, color, size (one stable sort)."""
+    df = add_sort_keys(df)
+    return df.sort_values(['Display_Rank', 'Display_Group', 'Type_Rank', 'Type', 'Color_Rank', 'Size_Rank'], kind='stable')
@@ -1,111 +1,2478 @@
+import base64
+import bisect
 import csv
+import gzip
+import hashlib
+import io
+import json
+import lzma
 import os
+import random
 import shutil
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
 import models as md
+import migrate_to_sql as ms
+import records as rc
+
+try:
+    import numpy as np
+except ImportError:  # The CLI runs without NumPy; the KPI engine falls back to lists.
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    from pyarrow.dataset import dataset as pq_dataset
+except ImportError:  # Columnar copies are optional; reports read the records instead.
+    pa = None
+
+_schema_ready = False
 
 # --- SQL DATABASE CONNECTION (The Missing Piece) ---
 def get_db_connection():
     """Establishes connection to the SQLite database."""
-    conn = sqlite3.connect('thredvault.db')
+    global _schema_ready
+    conn = sqlite3.connect(md.DB_FILE, timeout=30)
     conn.row_factory = sqlite3.Row
+    if not _schema_ready:
+        ms.create_schema(conn)
+        _schema_ready = True
     return conn
 
+@contextmanager
+def _sql_session():
+    """Connection that commits on success, rolls back on error and always closes."""
+    conn = get_db_connection()
+    try:
+        with conn: yield conn
+    finally:
+        conn.close()
+
+def _use_sql(filename=None):
+    """True when `filename` (or financials, if None) lives in SQLite."""
+    if md.STORAGE_BACKEND != 'sqlite': return False
+    return filename is None or filename in md.SQL_TABLES
+
+# --- READ CACHE ---
+# Parsed rows are kept per file and reused while the file is unchanged: the key
+# is this process's write version for the file plus the size/mtime of
+# everything it is read from (the CSV and its journal, or the SQLite file), so
+# writes from other processes are picked up too. Callers mutate the rows they
+# get back, so every hit hands out fresh dict copies. Typed records
+# (load_records) are cached separately under the same key, so a process that
+# only reads reports never keeps the dict rows.
+_cache = {}
+_records = {}
+_write_versions = {}
+_cache_stats = {"hits": 0, "misses": 0}
+_cache_lock = threading.Lock()
+
+def _source_paths(filename):
+    if _use_sql(filename): return (md.DB_FILE,)
+    if filename in md.JOURNALED_FILES: return (filename, journal_path(filename))
+    return (filename,)
+
+def _cache_key(filename):
+    key = [_write_versions.get(filename, 0)]
+    for path in _source_paths(filename):
+        try:
+            st = os.stat(path)
+            key.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            key.append(None)
+    return tuple(key)
+
+def _invalidate(filename):
+    with _cache_lock:
+        _write_versions[filename] = _write_versions.get(filename, 0) + 1
+        _cache.pop(filename, None)
+        _records.pop(filename, None)
+        return _write_versions[filename]
+
+def _prime_cache(filename, version, rows, derived):
+    """Seeds the cache with rows we just wrote, unless another write followed."""
+    key = _cache_key(filename)
+    with _cache_lock:
+        if key[0] == version == _write_versions.get(filename, 0):
+            _cache[filename] = (key, [dict(r) for r in rows], derived)
+
+def data_version(filename):
+    """Token that changes whenever `filename`'s contents may have changed."""
+    return _cache_key(filename)
+
+def cache_stats():
+    """Hit/miss counters of the load_csv read cache."""
+    with _cache_lock:
+        return dict(_cache_stats, entries=len(_cache))
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+        _records.clear()
+        _cache_stats.update(hits=0, misses=0)
+
+def _cached_entry(filename):
+    """(key, rows, derived) for the current version of a file, parsing on a miss."""
+    key = _cache_key(filename)
+    with _cache_lock:
+        entry = _cache.get(filename)
+        if entry and entry[0] == key:
+            _cache_stats["hits"] += 1
+            return entry
+        _cache_stats["misses"] += 1
+    entry = (key, _read_rows(filename), {})
+    with _cache_lock:
+        # Only publish if nothing was written while we were reading.
+        if key[0] == _write_versions.get(filename, 0):
+            _cache[filename] = entry
+    return entry
+
+def _derived(entry, name, build):
+    """Caches build(rows) alongside a cache entry. `build` must not mutate rows."""
+    derived = entry[2]
+    if name not in derived:
+        derived[name] = build(entry[1])
+    return derived[name]
+
 # --- CSV HANDLERS (Used by App) ---
 def load_csv(filename):
     """Reads a CSV file and returns a list of dictionaries."""
+    return [dict(r) for r in _cached_entry(filename)[1]]
+
+def load_records(filename):
+    """Typed records (records.py) of an inventory/sales/orders file, parsed once
+    per file version and shared between callers: read them, never mutate them."""
+    key = _cache_key(filename)
+    with _cache_lock:
+        found, entry = _records.get(filename), _cache.get(filename)
+    if found and found[0] == key: return found[1]
+    # Reuse rows already parsed for load_csv; otherwise parse without keeping them.
+    records = rc.from_rows(filename, entry[1] if entry and entry[0] == key else _read_rows(filename))
+    with _cache_lock:
+        if key[0] == _write_versions.get(filename, 0): _records[filename] = (key, records)
+    return records
+
+def _read_rows(filename):
+    table = _store_table(filename)
+    if table is not None: return table["rows"]
+    if _use_sql(filename): return _sql_load(filename)
     if not os.path.exists(filename): return []
     with open(filename, mode='r', encoding='utf-8-sig') as file:
-        return list(csv.DictReader(file))
+        rows = list(csv.DictReader(file))
+    if filename in md.JOURNALED_FILES:
+        rows = _replay_journal(filename, rows)
+    return rows
+
+def save_csv(filename, columns, data, expected_version=None):
+    """Writes a list of dictionaries to a CSV file. Returns the file's new write version.
+    With `expected_version` (from file_version) the write is refused with
+    ConflictError if the file has changed since."""
+    with _rollup_write(filename, rebuild=data):
+        return _save_csv(filename, columns, data, expected_version)
+
+def _save_csv(filename, columns, data, expected_version=None):
+    if _store_table(filename) is not None: return _store_save(filename, columns, data, expected_version)
+    if _use_sql(filename):
+        version = _invalidate(filename)
+        _sql_replace(filename, columns, data, expected_version)
+        return version
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(data)
+    with commit_group():
+        _check_version(filename, expected_version)
+        version = _invalidate(filename)
+        write_file(filename, buf.getvalue().encode('utf-8'))
+        # A full rewrite already contains every journaled edit.
+        if filename in md.JOURNALED_FILES: delete_file(journal_path(filename))
+        _bump_version(filename)
+    return version
+
+def append_csv(filename, columns, data):
+    """Appends rows to the end of a CSV file in a single write."""
+    with _rollup_write(filename, added=data):
+        return _append_csv(filename, columns, data)
+
+def _append_csv(filename, columns, data):
+    if _store_table(filename) is not None: return _store_append(filename, columns, data)
+    _invalidate(filename)
+    if _use_sql(filename): return _sql_insert(filename, columns, data)
+    header = _read_header(filename)
+    if header is None:
+        save_csv(filename, columns, data)
+        return
+    if header != list(columns):
+        # Old layout on disk: rewrite once so the new columns are kept.
+        save_csv(filename, columns, load_csv(filename) + list(data))
+        return
+    buf = io.StringIO()
+    if not _ends_with_newline(filename): buf.write('\r\n')
+    csv.DictWriter(buf, fieldnames=columns).writerows(data)
+    with commit_group():
+        append_file(filename, buf.getvalue().encode('utf-8'))
+        _bump_version(filename)
+
+def _read_header(filename):
+    """Returns the header row of a CSV file, or None if it is missing/empty."""
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0: return None
+    with open(filename, mode='r', encoding='utf-8-sig') as file:
+        return next(csv.reader(file), None)
+
+def _ends_with_newline(filename):
+    with open(filename, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) in (b'\n', b'\r')
+
+# --- SALES JOURNAL ---
+# Edits and deletes on a journaled file are appended to "<file>.journal" as
+# (Op, row) records instead of rewriting the whole file. load_csv replays them
+# on top of the base file and compact_journal folds them back in.
+def journal_path(filename):
+    return filename + md.JOURNAL_SUFFIX
+
+def journal_update(filename, columns, rows):
+    """Logs replacement rows (matched on the file's key column)."""
+    key_col = md.JOURNALED_FILES[filename]
+    with _rollup_write(filename, added=rows, removed_keys=[r[key_col] for r in rows]):
+        _invalidate(filename)
+        if _use_sql(filename): return _sql_update(filename, columns, rows)
+        _append_journal(filename, columns, [dict(r, Op='U') for r in rows])
+
+def journal_delete(filename, columns, keys):
+    """Logs deletion of the rows whose key column matches one of `keys`."""
+    key_col = md.JOURNALED_FILES[filename]
+    with _rollup_write(filename, removed_keys=keys):
+        _invalidate(filename)
+        if _use_sql(filename): return _sql_delete(filename, key_col, keys)
+        _append_journal(filename, columns, [{'Op': 'D', key_col: str(k)} for k in keys])
+
+def _append_journal(filename, columns, entries):
+    if _store_table(filename) is not None: return _store_journal(filename, columns, entries)
+    path = journal_path(filename)
+    fields = ['Op'] + list(columns)
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields, extrasaction='ignore')
+    if _read_header(path) is None: writer.writeheader()
+    writer.writerows(entries)
+    with commit_group():
+        append_file(path, buf.getvalue().encode('utf-8'))
+        _bump_version(filename)
+    if journal_length(filename) >= md.JOURNAL_COMPACT_THRESHOLD:
+        compact_journal(filename, columns)
+
+def journal_length(filename):
+    """Number of pending journal entries for a file."""
+    path = journal_path(filename)
+    if not os.path.exists(path): return 0
+    with open(path, mode='r', encoding='utf-8') as file:
+        return max(sum(1 for _ in csv.reader(file)) - 1, 0)
+
+def _replay_journal(filename, rows):
+    path = journal_path(filename)
+    if not os.path.exists(path): return rows
+    key_col = md.JOURNALED_FILES[filename]
+    position = {r.get(key_col): i for i, r in enumerate(rows)}
+    deleted = set()
+    with open(path, mode='r', encoding='utf-8') as file:
+        for entry in csv.DictReader(file):
+            op = entry.pop('Op', '')
+            key = entry.get(key_col)
+            if op == 'D':
+                if key in position: deleted.add(position[key])
+            elif op == 'U' and key in position:
+                idx = position[key]
+                rows[idx] = {k: (v if v is not None else '') for k, v in entry.items()}
+                deleted.discard(idx)
+    if deleted:
+        rows = [r for i, r in enumerate(rows) if i not in deleted]
+    return rows
+
+def compact_journal(filename, columns):
+    """Merges pending journal entries back into a clean base file."""
+    if _use_sql(filename): return
+    if not os.path.exists(journal_path(filename)): return
+    save_csv(filename, columns, load_csv(filename))
+
+# --- SQLITE BACKEND ---
+# Row-level equivalents of the CSV handlers: appends are INSERTs, journal
+# edits are targeted UPDATE/DELETEs keyed on the file's key column and a full
+# save only writes the rows that changed.
+def _sql_load(filename):
+    cols = md.FILE_COLUMNS[filename]
+    with _sql_session() as conn:
+        cur = conn.execute(f"SELECT {', '.join(cols)} FROM {md.SQL_TABLES[filename]} ORDER BY rowid")
+        # The CSV path hands out strings; keep the SQLite path identical.
+        return [{c: ms.from_sql_value(c, v) for c, v in zip(cols, r)} for r in cur]
+
+def _sql_insert(filename, columns, data, conn=None):
+    cols = md.FILE_COLUMNS[filename]
+    query = f"INSERT INTO {md.SQL_TABLES[filename]} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+    params = [[ms.to_sql_value(c, r.get(c)) for c in cols] for r in data]
+    if conn is not None:
+        conn.executemany(query, params)
+        return
+    with _sql_session() as conn:
+        _sql_bump_version(conn, filename)
+        conn.executemany(query, params)
+
+def _sql_replace(filename, columns, data, expected_version=None):
+    """save_csv on SQLite: only rows that differ are written. Stored rows are
+    matched to `data` on md.ROW_KEYS (in order within a key); changed ones are
+    UPDATEd in place, unmatched ones DELETEd and new ones INSERTed at the end,
+    so rows keep their position but a reordered `data` is not reordered."""
+    table, cols = md.SQL_TABLES[filename], md.FILE_COLUMNS[filename]
+    keys = [cols.index(c) for c in md.ROW_KEYS[filename]]
+    with _sql_session() as conn:
+        _sql_bump_version(conn, filename, expected_version)
+        stored = {}
+        for r in conn.execute(f"SELECT rowid, {', '.join(cols)} FROM {table} ORDER BY rowid"):
+            values = tuple(r)[1:]
+            stored.setdefault(tuple(values[i] for i in keys), []).append((r[0], values))
+        updates, added = [], []
+        for row in data:
+            values = tuple(_sql_stored(c, row.get(c)) for c in cols)
+            olds = stored.get(tuple(values[i] for i in keys))
+            if not olds:
+                added.append(row)
+                continue
+            rowid, old = olds.pop(0)
+            if old != values: updates.append(values + (rowid,))
+        conn.executemany(f"DELETE FROM {table} WHERE rowid = ?", [(rowid,) for olds in stored.values() for rowid, _ in olds])
+        conn.executemany(f"UPDATE {table} SET {', '.join(c + ' = ?' for c in cols)} WHERE rowid = ?", updates)
+        _sql_insert(filename, columns, added, conn)
+
+def _sql_stored(col, value):
+    """The value SQLite keeps for a CSV string (numbers by column affinity)."""
+    value = ms.to_sql_value(col, value)
+    kind = ms.COLUMN_TYPES.get(col)
+    if kind is None or value == '': return value
+    try: number = float(value)
+    except ValueError: return value
+    return int(number) if number.is_integer() else number
+
+def _sql_update(filename, columns, rows):
+    key_col = md.JOURNALED_FILES[filename]
+    cols = [c for c in md.FILE_COLUMNS[filename] if c != key_col]
+    query = f"UPDATE {md.SQL_TABLES[filename]} SET {', '.join(c + ' = ?' for c in cols)} WHERE {key_col} = ?"
+    with _sql_session() as conn:
+        _sql_bump_version(conn, filename)
+        conn.executemany(query, [[ms.to_sql_value(c, r.get(c)) for c in cols] + [ms.to_sql_value(key_col, r[key_col])]
+                                 for r in rows])
+
+def _sql_delete(filename, key_col, keys):
+    with _sql_session() as conn:
+        _sql_bump_version(conn, filename)
+        conn.executemany(f"DELETE FROM {md.SQL_TABLES[filename]} WHERE {key_col} = ?", [(ms.to_sql_value(key_col, k),) for k in keys])
+
+def _sql_max_id(filename, key_col, conn):
+    row = conn.execute(
+        f"SELECT MAX({key_col}) FROM {md.SQL_TABLES[filename]} WHERE typeof({key_col}) = 'integer'"
+    ).fetchone()
+    return row[0] or 0
+
+# --- COLUMNAR COPIES ---
+# With COLUMNAR_FORMAT = 'parquet' (and pyarrow installed) sales and orders
+# also live as Parquet datasets (COLUMNAR_DIRS): typed columns, dictionary-
+# encoded SKU/status fields and the rows sorted by Date, so every row group's
+# Date min/max statistics let a date-range read skip the rest. The CSV (or
+# SQLite) table stays the source of truth for writes; the dataset is brought up
+# to date on read, keyed on file_version(). Rows appended since the last read
+# (the common case) are parsed from their byte offset and written as one more
+# part; anything else (an edit, the journal, a restore) rebuilds it. Reports
+# call scan_columns() and get only the columns and dates they ask for, from
+# the dataset when it is enabled or from load_records() otherwise.
+#
+# The dataset also converts back to the CSV layout byte for byte: each row
+# keeps its position in the file (_Row), and where a typed value does not
+# render back to the text it came from ("42" read as 42.0, a blank Status
+# read as Completed, a date that does not parse) that text is kept in a
+# _Text_<column> column, which is null for every other row.
+_COLUMNAR_STATE = '_state.json'
+_COLUMNAR_ROW = '_Row'
+_COLUMNAR_TEXT = '_Text_'
+
+def scan_columns(filename, columns, start=None, end=None):
+    """{column: values} for the sales/orders rows dated start..end (inclusive,
+    None is open-ended). Values are typed as in records.py ('Date' gives dates);
+    'Group' is the row's resolved WAC group."""
+    if _columnar(filename):
+        table = _columnar_table(filename, columns, start, end)
+        if 'Group' not in columns: return table.to_pydict()
+        data = table.to_pydict()
+        groups = {}
+        data['Group'] = [groups.get(k) or groups.setdefault(k, rc.group_of(*k))
+                         for k in zip(data['Brand'], data['Type'], data['WAC_Group'])]
+        return {c: data[c] for c in columns}
+    records = load_records(filename)
+    if start is not None or end is not None:
+        lo, hi = _as_day(start), _as_day(end)
+        records = [r for r in records if r.Day is not None and (lo is None or r.Day >= lo) and (hi is None or r.Day <= hi)]
+    return {c: [r.Day if c == 'Date' else getattr(r, c) for r in records] for c in columns}
+
+def export_columnar(filename):
+    """Rewrites the Parquet dataset of `filename` from its current rows."""
+    with file_lock(md.COLUMNAR_DIRS[filename]):
+        _columnar_rebuild(filename, file_version(filename))
+
+def import_columnar(filename):
+    """Replaces `filename` with the rows of its Parquet dataset (CSV layout).
+    ConflictError if `filename` was written after the dataset was last brought
+    up to date: importing it would drop those writes."""
+    path = md.COLUMNAR_DIRS[filename]
+    with file_lock(path):
+        state, version = _columnar_state(path), file_version(filename)
+        if state is None or state["version"] != version or "rows" not in state:
+            raise ConflictError(f"{path} is older than {filename} (version {state and state['version']}, "
+                                f"now {version}): export it again first")
+        return _import_columnar(filename, path, version)
+
+def _import_columnar(filename, path, version):
+    columns = md.FILE_COLUMNS[filename]
+    texts = [_COLUMNAR_TEXT + c for c in columns]
+    # The dataset is in date order; the CSV layout is in the file's order.
+    table = pq_dataset(path, format='parquet').to_table(columns=columns + texts + [_COLUMNAR_ROW])
+    rows = [{c: _csv_text(c, row[c]) if row[t] is None else row[t] for c, t in zip(columns, texts)}
+            for row in table.sort_by(_COLUMNAR_ROW).to_pylist()]
+    save_csv(filename, columns, rows, expected_version=version)
+    return len(rows)
+
+def _csv_text(col, value):
+    """A typed dataset value as it is written in the CSV layout."""
+    if value is None: return ''
+    if col == 'Date': return value.strftime("%m/%d/%Y")
+    return str(value)
+
+def _columnar(filename):
+    return (md.COLUMNAR_FORMAT == 'parquet' and pa is not None and filename in md.COLUMNAR_DIRS
+            and _store_table(filename) is None)
+
+def _columnar_table(filename, columns, start, end):
+    path = md.COLUMNAR_DIRS[filename]
+    # The dataset's lock also holds the commit lock: the source cannot change mid-refresh.
+    with file_lock(path):
+        _columnar_refresh(filename)
+    read = list(dict.fromkeys(c for c in columns if c != 'Group'))
+    if 'Group' in columns: read += [c for c in ('Brand', 'Type', 'WAC_Group') if c not in read]
+    date_field = pc.field('Date')
+    where = None
+    if start is not None: where = date_field >= _as_day(start)
+    if end is not None:
+        upto = date_field <= _as_day(end)
+        where = upto if where is None else where & upto
+    return pq_dataset(path, format='parquet').to_table(columns=read, filter=where)
+
+def _columnar_refresh(filename):
+    path = md.COLUMNAR_DIRS[filename]
+    version = file_version(filename)
+    state = _columnar_state(path)
+    if state and state["version"] == version and "rows" in state: return
+    if state and "rows" in state and not _use_sql(filename) and state["parts"] < md.COLUMNAR_MAX_PARTS:
+        st = os.stat(filename)
+        if (st.st_ino == state["ino"] and st.st_size >= state["offset"]
+                and _journal_stamp(filename) == state["journal"]):
+            # Only rows were appended: convert just the new bytes.
+            with open(filename, 'rb') as f:
+                f.seek(state["offset"])
+                tail = f.read(st.st_size - state["offset"])
+            rows = list(csv.DictReader(io.StringIO(tail.decode('utf-8')), fieldnames=state["header"]))
+            if rows: _write_part(filename, path, state["parts"], state["rows"], rows)
+            _save_columnar_state(path, dict(state, version=version, offset=st.st_size,
+                                            parts=state["parts"] + bool(rows), rows=state["rows"] + len(rows)))
+            return
+    _columnar_rebuild(filename, version)
+
+def _columnar_rebuild(filename, version):
+    path = md.COLUMNAR_DIRS[filename]
+    os.makedirs(path, exist_ok=True)
+    with _disk_access():
+        rows = _read_rows(filename)
+    state = {"version": version, "parts": 1, "rows": len(rows), "header": md.FILE_COLUMNS[filename]}
+    if not _use_sql(filename) and os.path.exists(filename):
+        st = os.stat(filename)
+        state.update(ino=st.st_ino, offset=st.st_size, journal=_journal_stamp(filename),
+                     header=_read_header(filename) or md.FILE_COLUMNS[filename])
+    for entry in os.listdir(path):
+        if entry.endswith('.parquet'): os.remove(os.path.join(path, entry))
+    _write_part(filename, path, 0, 0, rows)
+    _save_columnar_state(path, state)
+
+def _write_part(filename, path, number, first, rows):
+    """Writes `rows` (CSV dicts, the first at file position `first`) as part `number`."""
+    schema = _columnar_schema(filename)
+    records = rc.from_rows(filename, rows)
+    data = {_COLUMNAR_ROW: list(range(first, first + len(rows)))}
+    for c in md.FILE_COLUMNS[filename]:
+        values = data[c] = [r.Day if c == 'Date' else getattr(r, c) for r in records]
+        texts = ('' if row.get(c) is None else row[c] for row in rows)
+        data[_COLUMNAR_TEXT + c] = [None if _csv_text(c, v) == t else t for v, t in zip(values, texts)]
+    table = pa.Table.from_pydict(data, schema=schema).sort_by([('Date', 'ascending')])
+    pq.write_table(table, os.path.join(path, f"part-{number:05d}.parquet"),
+                   row_group_size=md.COLUMNAR_ROW_GROUP, write_statistics=True)
+
+def _columnar_schema(filename):
+    """Typed Parquet schema: dates as date32, money as float64, counts as int64
+    and the repeated text fields dictionary-encoded, then the _Text_ columns
+    and _Row."""
+    fields = []
+    for c in md.FILE_COLUMNS[filename]:
+        if c == 'Date': t = pa.date32()
+        elif c in ('Quantity', 'Total_Pieces'): t = pa.int64()
+        elif c in ms.MONEY_COLUMNS: t = pa.float64()
+        elif c in md.COLUMNAR_DICTIONARY_COLUMNS: t = pa.dictionary(pa.int32(), pa.string())
+        else: t = pa.string()
+        fields.append(pa.field(c, t))
+    fields += [pa.field(_COLUMNAR_TEXT + c, pa.string()) for c in md.FILE_COLUMNS[filename]]
+    return pa.schema(fields + [pa.field(_COLUMNAR_ROW, pa.int64())])
+
+def _journal_stamp(filename):
+    if filename not in md.JOURNALED_FILES or not os.path.exists(journal_path(filename)): return None
+    st = os.stat(journal_path(filename))
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+def _columnar_state(path):
+    try:
+        with open(os.path.join(path, _COLUMNAR_STATE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_columnar_state(path, state):
+    tmp = os.path.join(path, _COLUMNAR_STATE + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp, os.path.join(path, _COLUMNAR_STATE))
+
+# --- ROW CHANGES ---
+# Applies an editor's change set (edited, deleted and added rows) instead of
+# rewriting a table from the editor's contents. Rows are matched on the file's
+# md.ROW_KEYS using their values before the edit; with duplicate keys the
+# first remaining match is taken (sales IDs never repeat once unique_ids()
+# has run: the journal refuses a file where they do). Journaled files (sales) log only the changed
+# rows and SQLite runs one statement per change. Inventory and orders on CSV
+# are not journaled: an edit or delete there still rewrites the whole file
+# (patched in memory, written once, and the cache primed so the rerun skips
+# parsing). Only the commit log is spared, as it records just the changed
+# byte range. A change set that only adds rows is appended.
+#
+# Only the fields the editor changed are written, on top of the row as it is
+# now, so another session's edits to other fields survive. If another session
+# changed one of the same fields since the editor loaded it, ConflictError is
+# raised and nothing is written.
+def row_key(filename, row):
+    return tuple(str(row.get(c, '')) for c in md.ROW_KEYS[filename])
+
+def _same_value(a, b):
+    """Equality across the editor's typed values and the stored strings."""
+    a, b = ('' if v is None or str(v) in ('nan', 'None', '<NA>') else str(v).strip() for v in (a, b))
+    if a == b: return True
+    try: return float(a) == float(b)
+    except ValueError: return False
+
+def _merge_row(filename, columns, stored, old, new):
+    """`stored` with the fields that differ between `old` and `new` set to `new`'s."""
+    merged = {c: stored.get(c, '') for c in columns}
+    for c in columns:
+        if _same_value(new.get(c), old.get(c)): continue
+        if not (_same_value(stored.get(c), old.get(c)) or _same_value(stored.get(c), new.get(c))):
+            raise ConflictError(f"{filename}: {c} of {' '.join(row_key(filename, old))} was changed by another session")
+        merged[c] = new.get(c, '')
+    return merged
+
+def apply_row_changes(filename, columns, updated=(), deleted=(), added=()):
+    """`updated` is [(old_row, new_row)], `deleted` [old_row], `added` [new_row].
+    Returns the number of rows that could not be found."""
+    updated, deleted, added = list(updated), list(deleted), list(added)
+    if not (updated or deleted or added): return 0
+    if filename in md.JOURNALED_FILES:
+        with file_lock(filename): return _journal_row_changes(filename, columns, updated, deleted, added)
+    if _use_sql(filename): return _sql_row_changes(filename, columns, updated, deleted, added)
+    if not (updated or deleted):
+        append_csv(filename, columns, [{c: r.get(c, '') for c in columns} for r in added])
+        return 0
+    with file_lock(filename):
+        rows = load_csv(filename)
+        positions = {}
+        for i, r in enumerate(rows): positions.setdefault(row_key(filename, r), []).append(i)
+        missing = 0
+        removed = set()
+        for old, new in updated + [(old, None) for old in deleted]:
+            found = positions.get(row_key(filename, old))
+            if not found:
+                missing += 1
+                continue
+            i = found.pop(0)
+            if new is None: removed.add(i)
+            else: rows[i] = _merge_row(filename, columns, rows[i], old, new)
+        if removed: rows = [r for i, r in enumerate(rows) if i not in removed]
+        rows.extend({c: r.get(c, '') for c in columns} for r in added)
+        version = save_csv(filename, columns, rows)
+        _prime_cache(filename, version, rows, {})
+    return missing
+
+def _journal_row_changes(filename, columns, updated, deleted, added):
+    key_col = md.JOURNALED_FILES[filename]
+    entry = _cached_entry(filename)
+    current = _derived(entry, 'by_key', lambda rows: {r.get(key_col): r for r in rows})
+    if len(current) < len(entry[1]):
+        # The journal cannot tell rows with the same ID apart.
+        raise ConflictError(f"{filename} has repeated {key_col}s: run unique_ids() and reload")
+    missing = sum(1 for old, _ in updated if str(old.get(key_col)) not in current)
+    missing += sum(1 for old in deleted if str(old.get(key_col)) not in current)
+    updated = [(old, _merge_row(filename, columns, current[str(old.get(key_col))], old, new))
+               for old, new in updated if str(old.get(key_col)) in current]
+    # A row whose key was edited is re-keyed: delete the old one, append the new one.
+    rekeyed = [(old, new) for old, new in updated if str(new.get(key_col)) != str(old.get(key_col))]
+    gone = [old[key_col] for old in deleted if str(old.get(key_col)) in current] + [old[key_col] for old, _ in rekeyed]
+    edits = [new for old, new in updated if str(new.get(key_col)) == str(old.get(key_col))]
+    with commit_group():
+        if edits: journal_update(filename, columns, edits)
+        if gone: journal_delete(filename, columns, gone)
+        added = [new for _, new in rekeyed] + added
+        if added: append_csv(filename, columns, added)
+    return missing
 
-def save_csv(filename, columns, data):
-    """Writes a list of dictionaries to a CSV file."""
-    with open(filename, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=columns)
-        writer.writeheader()
-        writer.writerows(data)
+def _sql_row_changes(filename, columns, updated, deleted, added):
+    table = md.SQL_TABLES[filename]
+    keys = md.ROW_KEYS[filename]
+    cols = md.FILE_COLUMNS[filename]
+    query = f"SELECT rowid, {', '.join(cols)} FROM {table} WHERE {' AND '.join(k + ' = ?' for k in keys)} ORDER BY rowid"
+    touched = set()
+    def locate(conn, row):
+        for found in conn.execute(query, [ms.to_sql_value(k, row.get(k)) for k in keys]):
+            if found[0] not in touched:
+                touched.add(found[0])
+                return found[0], {c: ms.from_sql_value(c, v) for c, v in zip(cols, found[1:])}
+        return None, None
+    missing = 0
+    _invalidate(filename)
+    with _sql_session() as conn:
+        _sql_bump_version(conn, filename)
+        for old, new in updated + [(old, None) for old in deleted]:
+            rowid, stored = locate(conn, old)
+            if rowid is None: missing += 1
+            elif new is None: conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (rowid,))
+            else:
+                new = _merge_row(filename, cols, stored, old, new)
+                conn.execute(f"UPDATE {table} SET {', '.join(c + ' = ?' for c in cols)} WHERE rowid = ?",
+                             [ms.to_sql_value(c, new.get(c)) for c in cols] + [rowid])
+        if added: _sql_insert(filename, columns, added, conn)
+    return missing
+
+# --- DAILY SALES ROLLUP ---
+# Revenue, profit and units per (day, status). The rollup is
+# built in one pass per sales version and carried across this process's own
+# sales writes by applying the written rows as deltas, so a date-range KPI
+# adds up at most a few thousand day buckets instead of re-parsing every sale.
+# Rows whose date cannot be parsed are kept under the day None, which only
+# unbounded queries include.
+_rollup = None  # (cache key, {day: {status: [revenue, profit, units]}}, sorted days)
+
+def _as_day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+def _rollup_add(days, order, day, key, revenue, profit, units):
+    buckets = days.get(day)
+    if buckets is None:
+        buckets = days[day] = {}
+        if day is not None: bisect.insort(order, day)
+    bucket = buckets.setdefault(key, [0.0, 0.0, 0])
+    bucket[0] += revenue
+    bucket[1] += profit
+    bucket[2] += units
+
+def _rollup_row(days, order, sale, sign=1):
+    """Adds (sign=1) or removes (sign=-1) one rc.SaleRecord."""
+    _rollup_add(days, order, sale.Day, sale.Status, sign * sale.Sale_Price, sign * sale.Profit, sign)
+
+def _build_rollup(sales):
+    days, order = {}, []
+    for sale in sales: _rollup_row(days, order, sale)
+    return days, order
+
+def _sql_build_rollup():
+    days, order = {}, []
+    with _sql_session() as conn:
+        cur = conn.execute(
+            f"SELECT Date, Status, TOTAL(Sale_Price), TOTAL(Profit), COUNT(*) "
+            f"FROM {md.SQL_TABLES[md.SALES_FILE]} GROUP BY Date, Status")
+        for day, status, revenue, profit, units in cur:
+            _rollup_add(days, order, rc.parse_date(day), status or 'Completed', revenue, profit, units)
+    return days, order
+
+def _columnar_build_rollup():
+    days, order = {}, []
+    keys = ['Date', 'Status']
+    table = _columnar_table(md.SALES_FILE, keys + ['Sale_Price', 'Profit'], None, None)
+    totals = table.group_by(keys).aggregate([('Sale_Price', 'sum'), ('Profit', 'sum'), ('Sale_Price', 'count')])
+    for row in totals.to_pylist():
+        _rollup_add(days, order, row['Date'], row['Status'] or 'Completed',
+                    row['Sale_Price_sum'], row['Profit_sum'], row['Sale_Price_count'])
+    return days, order
+
+def _current_rollup():
+    """(days, sorted days) for the current sales version, rebuilding if stale."""
+    global _rollup
+    key = _cache_key(md.SALES_FILE)
+    with _cache_lock:
+        state = _rollup
+    if state and state[0] == key: return state[1], state[2]
+    if _use_sql(md.SALES_FILE): days, order = _sql_build_rollup()
+    elif _columnar(md.SALES_FILE): days, order = _columnar_build_rollup()
+    else: days, order = _build_rollup(load_records(md.SALES_FILE))
+    with _cache_lock:
+        if key[0] == _write_versions.get(md.SALES_FILE, 0): _rollup = (key, days, order)
+    return days, order
+
+@contextmanager
+def _rollup_write(filename, added=(), removed_keys=(), rebuild=None):
+    """Carries the rollup across one sales write: subtracts the rows being
+    replaced/removed, adds the new ones and re-keys it to the new version."""
+    global _rollup
+    if filename != md.SALES_FILE:
+        yield
+        return
+    before = _cache_key(filename)
+    with _cache_lock:
+        state = _rollup if _rollup and _rollup[0] == before else None
+    removed = []
+    if state and removed_keys:
+        key_col = md.JOURNALED_FILES[filename]
+        entry = _cached_entry(filename)
+        by_key = _derived(entry, 'by_key', lambda rows: {r.get(key_col): r for r in rows})
+        removed = [by_key[str(k)] for k in removed_keys if str(k) in by_key]
+    yield
+    if rebuild is not None:
+        days, order = _build_rollup(rc.from_rows(filename, rebuild))
+    elif state:
+        # Deltas are applied to copies: readers may still hold the old buckets.
+        days = {d: {k: list(b) for k, b in buckets.items()} for d, buckets in state[1].items()}
+        order = list(state[2])
+        for row in removed: _rollup_row(days, order, rc.SaleRecord(row), -1)
+        for row in added: _rollup_row(days, order, rc.SaleRecord(row))
+    else:
+        return
+    after = _cache_key(filename)
+    with _cache_lock:
+        # Only if ours was the single write since `before`.
+        if after[0] == before[0] + 1 == _write_versions.get(filename, 0): _rollup = (after, days, order)
+
+# --- KPI ENGINE ---
+# Completed sales as date-sorted cumulative revenue/profit/unit arrays, built
+# from the rollup once per sales version. Any [start, end] range is then two
+# binary searches and a subtraction; horizon_metrics() does several ranges in
+# one vectorized search.
+_kpi = None  # (rollup days, ordinals, cum revenue, cum profit, cum units, undated totals)
+
+def _kpi_arrays():
+    global _kpi
+    days, order = _current_rollup()
+    with _cache_lock:
+        kpi = _kpi
+    if kpi and kpi[0] is days: return kpi
+    per_day = []
+    for day in [None] + order:
+        totals = [0.0, 0.0, 0]
+        bucket = days.get(day, {}).get('Completed')
+        if bucket: totals = list(bucket)
+        per_day.append(totals)
+    undated, per_day = per_day[0], per_day[1:]
+    ordinals = [d.toordinal() for d in order]
+    if np is not None:
+        table = np.zeros((len(per_day) + 1, 3))
+        if per_day: table[1:] = np.cumsum(np.array(per_day, dtype=float), axis=0)
+        kpi = (days, np.array(ordinals, dtype=np.int64), table[:, 0], table[:, 1], table[:, 2], undated)
+    else:
+        cums = [[0.0], [0.0], [0]]
+        for totals in per_day:
+            for i in range(3): cums[i].append(cums[i][-1] + totals[i])
+        kpi = (days, ordinals, *cums, undated)
+    with _cache_lock:
+        _kpi = kpi
+    return kpi
+
+def _bounds(ordinals, values, side):
+    if np is not None: return np.searchsorted(ordinals, values, side=side)
+    search = bisect.bisect_left if side == 'left' else bisect.bisect_right
+    return [search(ordinals, v) for v in values]
+
+def period_metrics(start=None, end=None):
+    """Revenue, profit and units of completed sales dated start..end (inclusive;
+    None is open-ended, and both None also counts undated sales)."""
+    return horizon_metrics({None: (start, end)})[None]
+
+def horizon_metrics(horizons):
+    """{label: (start, end)} -> {label: period_metrics(start, end)}."""
+    _, ordinals, revenue, profit, units, undated = _kpi_arrays()
+    labels = list(horizons)
+    first, last = -(1 << 62), 1 << 62
+    starts = [first if horizons[l][0] is None else _as_day(horizons[l][0]).toordinal() for l in labels]
+    ends = [last if horizons[l][1] is None else _as_day(horizons[l][1]).toordinal() for l in labels]
+    lo = _bounds(ordinals, starts, 'left')
+    hi = _bounds(ordinals, ends, 'right')
+    result = {}
+    for i, label in enumerate(labels):
+        a, b = lo[i], max(hi[i], lo[i])
+        metrics = {"Revenue": float(revenue[b] - revenue[a]), "Profit": float(profit[b] - profit[a]),
+                   "Units": int(units[b] - units[a])}
+        if starts[i] == first and ends[i] == last:
+            metrics = {"Revenue": metrics["Revenue"] + undated[0], "Profit": metrics["Profit"] + undated[1],
+                       "Units": metrics["Units"] + undated[2]}
+        result[label] = metrics
+    return result
+
+# --- SKU INDEX & WAC ENGINE ---
+# Inventory rows are looked up by their SKU (Brand, Type, Color, Size). The
+# position maps are built once per inventory version and shared through the
+# read cache; each InventoryIndex wraps its own copy of the rows.
+#
+# The index also keeps running (total quantity, total value) per WAC group.
+# Every change made through update()/upsert() adjusts those totals in O(1),
+# so a group's weighted average cost is available without a pass over the
+# inventory. save_inventory() carries the totals over to the next load.
+def sku_of(row):
+    return (row['Brand'], row['Type'], row['Color'], row['Size'])
+
+def row_group(row):
+    """A row's WAC group: the stored label, or inferred from Brand/Type."""
+    return row.get('WAC_Group') or md.find_wac_group(row['Brand'], row['Type'])
+
+def _row_value(row):
+    try: qty = int(row.get('Quantity') or 0)
+    except ValueError: qty = 0
+    try: cost = float(row.get('WAC_Cost') or 0)
+    except ValueError: cost = 0.0
+    return qty, qty * cost
+
+def _build_sku_positions(rows):
+    positions = {}
+    variants = {}
+    groups = {}
+    for i, row in enumerate(rows):
+        positions.setdefault(sku_of(row), i)
+        variants.setdefault(sku_of(row)[:3], []).append(i)
+        groups.setdefault(row_group(row), []).append(i)
+    return positions, variants, groups
+
+def _build_wac_totals(rows):
+    totals = {}
+    for row in rows:
+        qty, value = _row_value(row)
+        t = totals.setdefault(row_group(row), [0, 0.0])
+        t[0] += qty
+        t[1] += value
+    return {g: tuple(t) for g, t in totals.items()}
+
+class InventoryIndex:
+    """Inventory rows plus O(1) lookup/upsert by SKU and per-group WAC totals."""
+
+    def __init__(self, rows, positions=None, wac_totals=None, version=None):
+        self.rows = rows
+        self.version = version  # file_version the rows were read at (None: unchecked)
+        self._positions, self._variants, self._groups = positions or _build_sku_positions(rows)
+        self._added = {}
+        self._regrouped = {}
+        if wac_totals is None: wac_totals = _build_wac_totals(rows)
+        self.wac_totals = {g: list(t) for g, t in wac_totals.items()}
+
+    def get(self, brand, type_, color, size):
+        """The row for a SKU, or None."""
+        sku = (brand, type_, color, size)
+        pos = self._positions.get(sku)
+        return self.rows[pos] if pos is not None else self._added.get(sku)
+
+    def variants(self, brand, type_, color):
+        """All rows (every size) for a Brand/Type/Color."""
+        found = [self.rows[i] for i in self._variants.get((brand, type_, color), [])]
+        return found + [r for sku, r in self._added.items() if sku[:3] == (brand, type_, color)]
+
+    def group_rows(self, group):
+        """All rows currently in a WAC group."""
+        found = [self.rows[i] for i in self._groups.get(group, []) if row_group(self.rows[i]) == group]
+        seen = {id(r) for r in found}
+        return found + [r for r in self._regrouped.values() if id(r) not in seen and row_group(r) == group]
+
+    def update(self, row, **changes):
+        """Applies field changes to a row and adjusts the WAC totals."""
+        old_group = row_group(row)
+        self._add_total(old_group, *(-v for v in _row_value(row)))
+        row.update(changes)
+        new_group = row_group(row)
+        self._add_total(new_group, *_row_value(row))
+        if new_group != old_group: self._regrouped[id(row)] = row
+        return row
+
+    def upsert(self, row):
+        """Updates the row with the same SKU in place, or appends it. Returns the stored row."""
+        existing = self.get(*sku_of(row))
+        if existing is not None:
+            return self.update(existing, **row)
+        self.rows.append(row)
+        self._added[sku_of(row)] = row
+        self._regrouped[id(row)] = row
+        self._add_total(row_group(row), *_row_value(row))
+        return row
+
+    def _add_total(self, group, qty, value):
+        t = self.wac_totals.setdefault(group, [0, 0.0])
+        t[0] += qty
+        t[1] += value
+
+    def group_wac(self, group):
+        """Weighted average cost of a group from the running totals (None if no stock)."""
+        qty, value = self.wac_totals.get(group, (0, 0.0))
+        return value / qty if qty else None
+
+    def apply_group_wac(self, group):
+        """Sets every row in `group` to the group's WAC. Returns the new cost or None."""
+        wac = self.group_wac(group)
+        if wac is None: return None
+        new_wac = round(wac, 2)
+        for row in self.group_rows(group):
+            self.update(row, WAC_Cost=str(new_wac), WAC_Group=group)
+        return new_wac
+
+    def set_group_cost(self, group, cost):
+        """Forces one cost onto every row in `group`. Returns the number of rows changed."""
+        rows = self.group_rows(group)
+        for row in rows:
+            self.update(row, WAC_Cost=str(cost))
+        return len(rows)
+
+    def verify_wac(self, tolerance=0.01):
+        """Checks the running totals against a full recompute.
+
+        Returns {group: (tracked, actual)} for every group that disagrees.
+        """
+        actual = _build_wac_totals(self.rows)
+        mismatches = {}
+        for group in set(actual) | set(self.wac_totals):
+            tracked = tuple(self.wac_totals.get(group, (0, 0.0)))
+            real = actual.get(group, (0, 0.0))
+            if tracked[0] != real[0] or abs(tracked[1] - real[1]) > tolerance:
+                mismatches[group] = (tracked, real)
+        return mismatches
+
+def load_inventory_index():
+    """Loads inventory as an InventoryIndex (save with save_inventory)."""
+    version = file_version(md.INVENTORY_FILE)
+    entry = _cached_entry(md.INVENTORY_FILE)
+    positions = _derived(entry, "sku_positions", _build_sku_positions)
+    totals = _derived(entry, "wac_totals", _build_wac_totals)
+    return InventoryIndex([dict(r) for r in entry[1]], positions, totals, version)
+
+def save_inventory(index):
+    """Saves an InventoryIndex; ConflictError if inventory changed since it was loaded."""
+    version = save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, index.rows, index.version)
+    if index.version is not None: index.version += 1
+    _prime_cache(md.INVENTORY_FILE, version, index.rows,
+                 {"wac_totals": {g: tuple(t) for g, t in index.wac_totals.items()}})
+
+def verify_wac_totals():
+    """Compares the carried-forward WAC totals with a full recompute of inventory."""
+    return load_inventory_index().verify_wac()
+
+# --- FILE LOCKS ---
+# Serializes read-modify-write cycles across threads (Streamlit sessions) and
+# processes (CLI + app) using an O_EXCL lock file next to the target.
+#
+# Every file lock is taken inside the commit lock (COMMIT_LOG_FILE), so all
+# writers in a data directory run one at a time, whatever files they touch:
+# the commit log is one file whose tail a failed group truncates, so two groups
+# must never be open at once. A per-file lock therefore adds no parallelism; it
+# marks what a block reads and writes. Readers take no lock, and the file
+# versions (see FILE VERSIONS) are what lets sessions edit concurrently: they
+# catch a save based on rows another session has changed since, not a
+# simultaneous write.
+#
+# A lock file is broken only when it is stale: the process named in it has
+# exited, or its mtime is older than STALE_LOCK_AGE. Holders renew that mtime
+# from a background thread for as long as they hold the lock, so a slow
+# backup, restore or compaction keeps its lock; only a holder that is gone
+# (or a pid that was reused after a crash) stops renewing.
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+LOCK_TIMEOUT = 10.0
+STALE_LOCK_AGE = 30.0
+LOCK_RENEW_INTERVAL = STALE_LOCK_AGE / 3
+
+_held_locks = threading.local()
+_leases = set()  # lock files this process holds
+_leases_guard = threading.Lock()
+_lease_renewer = None
+
+@contextmanager
+def file_lock(path):
+    """Holds the lock for `path` (and the commit lock before it), re-entrant per thread."""
+    held = _held_locks.__dict__.setdefault("paths", set())
+    if path in held:  # re-entered by the thread that already holds it
+        yield
+        return
+    if path != md.COMMIT_LOG_FILE and md.COMMIT_LOG_FILE not in held:
+        # Lock order: the commit lock always comes first (see COMMIT LOG).
+        with file_lock(md.COMMIT_LOG_FILE), file_lock(path):
+            yield
+        return
+    with _thread_locks_guard:
+        tlock = _thread_locks.setdefault(path, threading.Lock())
+    with tlock:
+        lock_path = path + '.lock'
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                break
+            except FileExistsError:
+                try:
+                    if _lock_is_stale(lock_path):
+                        os.remove(lock_path)  # left behind by a crashed process
+                        continue
+                except FileNotFoundError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Could not lock {path}")
+                time.sleep(0.01)
+        held.add(path)
+        _renew_lease(lock_path, True)
+        try:
+            yield
+        finally:
+            _renew_lease(lock_path, False)
+            held.discard(path)
+            os.close(fd)
+            os.remove(lock_path)
+
+def _lock_is_stale(lock_path):
+    return (time.time() - os.path.getmtime(lock_path) > STALE_LOCK_AGE
+            or not _lock_owner_alive(lock_path))
+
+def _lock_owner_alive(lock_path):
+    """False only when the lock names a process that has exited."""
+    try:
+        with open(lock_path) as f:
+            pid = int(f.read() or 0)
+    except (OSError, ValueError):
+        return True
+    if pid <= 0 or pid == os.getpid() or os.name == 'nt': return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+def _renew_lease(lock_path, holding):
+    """Adds/removes a held lock file; the renewer thread touches them all."""
+    global _lease_renewer
+    with _leases_guard:
+        if not holding:
+            _leases.discard(lock_path)
+            return
+        _leases.add(lock_path)
+        if _lease_renewer is None or not _lease_renewer.is_alive():
+            _lease_renewer = threading.Thread(target=_lease_worker, name="thredvault-locks", daemon=True)
+            _lease_renewer.start()
+
+def _lease_worker():
+    while True:
+        time.sleep(LOCK_RENEW_INTERVAL)
+        with _leases_guard:
+            for lock_path in _leases:
+                try: os.utime(lock_path)
+                except OSError: pass
+
+# --- COMMIT LOG ---
+# Every write to a data file belongs to a commit group. Writes are applied as
+# they happen, so later reads in the same action see them, but before a file
+# is first touched its undo information (its size plus a hard link to the
+# current file) is logged to COMMIT_LOG_FILE. At commit the group's redo
+# record is appended to the log and fsynced: one sync per group however many
+# files it touched. Groups are serialized by the commit lock, which
+# file_lock() always takes first.
+#
+# The redo record holds only what changed: the appended bytes of an append,
+# and for a rewrite the one byte range that differs from the old contents (a
+# "splice", with digests of the contents before and after). Bytes are logged
+# as UTF-8 text when they are text, else base64. Only a file that did not
+# exist yet is logged whole.
+#
+# recover() undoes a group that never committed and replays committed groups
+# whose files no longer match what they wrote (e.g. lost in a power cut). A
+# splice is applied only to the contents it was made from, so replay picks up
+# from whichever logged state the file was left in; the checkpointed state
+# the log starts from is on disk. A checkpoint fsyncs the files named in the
+# log, archives its committed groups to the change history (see
+# POINT-IN-TIME RESTORE) and empties it.
+_groups = threading.local()
+
+@contextmanager
+def commit_group():
+    """Makes every data-file write inside the block one atomic, durable unit.
+    Nested groups join the outermost one."""
+    if getattr(_groups, "current", None) is not None:
+        yield _groups.current
+        return
+    with file_lock(md.COMMIT_LOG_FILE):
+        group = {"id": f"{time.time_ns()}-{os.getpid()}", "undo": {}, "redo": [],
+                 "log_start": os.path.getsize(md.COMMIT_LOG_FILE) if os.path.exists(md.COMMIT_LOG_FILE) else 0,
+                 "store": _store_snapshot()}
+        _groups.current = group
+        try:
+            yield group
+        except BaseException:
+            _groups.current = None
+            _store_restore(group["store"])
+            _rollback_group(group["undo"].values())
+            _truncate(md.COMMIT_LOG_FILE, group["log_start"])
+            raise
+        _groups.current = None
+        _commit_group(group)
+
+def write_file(path, data):
+    """Replaces `path` with `data` (bytes) via a temp file and rename."""
+    with commit_group() as group:
+        _touch(group, path)
+        old = _read_bytes(path)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        group["redo"].append(_splice_op(path, old, data))
+
+def append_file(path, data):
+    """Appends `data` (bytes) to `path`, creating it if needed."""
+    with commit_group() as group:
+        _touch(group, path)
+        with open(path, 'ab') as f:
+            at = f.tell()
+            f.write(data)
+        group["redo"].append({"op": "append", "path": path, "at": at, **_op_data(data)})
+
+def delete_file(path):
+    with commit_group() as group:
+        if not os.path.exists(path): return
+        _touch(group, path)
+        os.remove(path)
+        group["redo"].append({"op": "delete", "path": path})
+
+def _touch(group, path):
+    """Logs how to undo changes to `path`, before its first change in the group."""
+    if path in group["undo"]: return
+    undo = {"path": path, "pre": None, "size": None}
+    if os.path.exists(path):
+        undo["pre"] = f"{path}.{group['id']}.pre"
+        try: os.link(path, undo["pre"])
+        except OSError: shutil.copyfile(path, undo["pre"])
+        undo["size"] = os.path.getsize(path)
+    _log_records([{"gid": group["id"], "undo": undo}])
+    group["undo"][path] = undo
+
+def _splice_op(path, old, new):
+    """Redo op turning `old` (None: no file) into `new`: the differing range only."""
+    if old is None: return {"op": "replace", "path": path, **_op_data(new)}
+    limit = min(len(old), len(new))
+    start = _common_run(old, new, limit)
+    end = _common_run(old, new, limit - start, tail=True)
+    # Cut on character boundaries so the range stays valid UTF-8.
+    while start and start < len(new) and new[start] & 0xC0 == 0x80: start -= 1
+    while end and new[len(new) - end] & 0xC0 == 0x80: end -= 1
+    return {"op": "splice", "path": path, "at": start, "cut": len(old) - start - end,
+            "pre": _digest(old), "post": _digest(new), **_op_data(new[start:len(new) - end])}
+
+def _common_run(a, b, limit, tail=False):
+    """Length (at most `limit`) of the common prefix, or suffix, of two byte strings."""
+    if tail: part = lambda s, i, j: s[len(s) - j:len(s) - i]
+    else: part = lambda s, i, j: s[i:j]
+    n, step = 0, 1 << 16
+    while n + step <= limit and part(a, n, n + step) == part(b, n, n + step): n += step
+    lo, hi = n, min(n + step, limit)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if part(a, n, mid) == part(b, n, mid): lo = mid
+        else: hi = mid - 1
+    return lo
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _op_data(data):
+    try: return {"text": data.decode('utf-8')}
+    except UnicodeDecodeError: return {"b64": base64.b64encode(data).decode('ascii')}
+
+def _op_bytes(op):
+    if "text" in op: return op["text"].encode('utf-8')
+    if "b64" in op: return base64.b64decode(op["b64"])
+    return op.get("data", "").encode('latin-1')  # logged before splices
+
+def _apply_op(data, op):
+    """File contents (None: no file) after redo `op`. A splice made from other
+    contents is skipped: the file is already past it."""
+    if op["op"] == "replace": return _op_bytes(op)
+    if op["op"] == "append": return (data or b"")[:op["at"]] + _op_bytes(op)
+    if op["op"] == "delete": return None
+    if op["op"] == "splice" and data is not None and _digest(data) == op["pre"]:
+        return data[:op["at"]] + _op_bytes(op) + data[op["at"] + op["cut"]:]
+    return data
+
+def _read_bytes(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _commit_group(group):
+    if group["redo"]:
+        for path in group["undo"]:
+            st = os.stat(path) if os.path.exists(path) else None
+            group["redo"].append({"op": "stat", "path": path, "stat": st and [st.st_size, st.st_mtime_ns]})
+        _log_records([{"gid": group["id"], "ts": datetime.now().isoformat(timespec='microseconds'), "commit": group["redo"]}], sync=True)
+        _note_write()
+    else:
+        _truncate(md.COMMIT_LOG_FILE, group["log_start"])
+    for undo in group["undo"].values():
+        if undo["pre"] and os.path.exists(undo["pre"]): os.remove(undo["pre"])
+    if os.path.exists(md.COMMIT_LOG_FILE) and os.path.getsize(md.COMMIT_LOG_FILE) > md.COMMIT_LOG_CHECKPOINT_BYTES:
+        _checkpoint()
+
+def _log_records(records, sync=False):
+    with open(md.COMMIT_LOG_FILE, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+
+def _truncate(path, size):
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+
+def _rollback_group(undos):
+    global _ledger_state
+    for undo in reversed(list(undos)):
+        path = undo["path"]
+        if path == md.VERSIONS_FILE:
+            # Versions only move forward: a reader may have seen the undone write.
+            if undo["pre"] and os.path.exists(undo["pre"]): os.remove(undo["pre"])
+            continue
+        if undo["pre"] is None:
+            if os.path.exists(path): os.remove(path)
+        elif os.path.exists(undo["pre"]):
+            # Appends went through the hard link too; renaming a link over
+            # itself is a no-op, so drop the extra name instead.
+            if os.path.exists(path) and os.path.samefile(undo["pre"], path): os.remove(undo["pre"])
+            else: os.replace(undo["pre"], path)
+            _truncate(path, undo["size"])
+        _invalidate(path)
+    with _ledger_lock:
+        _ledger_state = None
+
+def _replay_path(path, ops):
+    """Brings `path` to the end of its logged `ops`, from whatever state it is in."""
+    before = data = _read_bytes(path)
+    for op in ops: data = _apply_op(data, op)
+    if ops and ops[-1]["op"] == "splice" and (data is None or _digest(data) != ops[-1]["post"]):
+        raise RuntimeError(f"{path} matches none of its logged states: restore it from a backup")
+    if data == before: return
+    if data is None:
+        os.remove(path)
+        return
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+def _read_commit_log():
+    """{group id: {"undo": [...], "redo": [...] or None, "ts": commit time}} in log order."""
+    groups = {}
+    if not os.path.exists(md.COMMIT_LOG_FILE): return groups
+    with open(md.COMMIT_LOG_FILE, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            try: record = json.loads(line)
+            except ValueError: break  # torn tail of a crashed write
+            group = groups.setdefault(record["gid"], {"undo": [], "redo": None, "ts": ""})
+            if "undo" in record: group["undo"].append(record["undo"])
+            else: group["redo"], group["ts"] = record["commit"], record.get("ts", "")
+    return groups
+
+def recover():
+    """Repairs data files after a crash. Returns (groups replayed, groups rolled back)."""
+    global _ledger_state
+    if not os.path.exists(md.COMMIT_LOG_FILE) or os.path.getsize(md.COMMIT_LOG_FILE) == 0: return 0, 0
+    with file_lock(md.COMMIT_LOG_FILE):
+        groups = _read_commit_log()
+        rolled_back = [g for g in groups.values() if g["redo"] is None]
+        for group in reversed(rolled_back): _rollback_group(group["undo"])
+        # A file is replayed only if it no longer matches what the last commit
+        # left and has not been modified since (an older or missing file).
+        final = {}
+        for group in groups.values():
+            for op in group["redo"] or []:
+                if op["op"] == "stat": final[op["path"]] = op["stat"]
+        stale = set()
+        for path, stat in final.items():
+            st = os.stat(path) if os.path.exists(path) else None
+            current = st and [st.st_size, st.st_mtime_ns]
+            if current != stat and (current is None or stat is None or current[1] <= stat[1]): stale.add(path)
+        replayed = set()
+        for path in stale:
+            ops = [(gid, op) for gid, group in groups.items() for op in group["redo"] or []
+                   if op["path"] == path and op["op"] != "stat"]
+            _replay_path(path, [op for _, op in ops])
+            replayed.update(gid for gid, _ in ops)
+        for group in groups.values():
+            for undo in group["undo"]:
+                if undo["pre"] and os.path.exists(undo["pre"]): os.remove(undo["pre"])
+        for path in stale: _invalidate(path)
+        if stale:
+            with _ledger_lock:
+                _ledger_state = None
+        _checkpoint()
+    return len(replayed), len(rolled_back)
+
+def checkpoint():
+    """Syncs every file the commit log names and empties the log."""
+    with file_lock(md.COMMIT_LOG_FILE):
+        _checkpoint()
+
+def _checkpoint():
+    groups = _read_commit_log()
+    paths = set()
+    for group in groups.values():
+        paths.update(op["path"] for op in group["redo"] or [])
+    for path in paths:
+        if not os.path.exists(path): continue
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+    _archive_groups(groups)
+    if os.path.exists(md.COMMIT_LOG_FILE):
+        with open(md.COMMIT_LOG_FILE, 'w'):
+            pass
+
+# --- FILE VERSIONS ---
+# Optimistic concurrency: every data file has a counter that each write bumps
+# (VERSIONS_FILE in the writer's commit group, or the versions table in the
+# writer's SQLite transaction). A session keeps the version it read and hands
+# it back as `expected_version`; if anyone wrote the file in between the save
+# is refused with ConflictError rather than overwriting their change.
+# Nothing is locked while a user is looking at the data, only for the write.
+#
+# CSV writers bump after writing and readers take the version before reading,
+# so a version never vouches for rows older than it.
+class ConflictError(Exception):
+    """A file (or row) changed since the version a write was based on."""
+
+class StockConflict(ConflictError):
+    """Another session's sales left too little stock for a write-behind flush."""
+
+_versions = (None, {})
+
+def file_version(filename):
+    """The number of writes `filename` has had."""
+    table = _store_table(filename)
+    if table is not None: return table["mem_version"]
+    if _use_sql(filename):
+        with _sql_session() as conn:
+            row = conn.execute("SELECT value FROM versions WHERE name = ?", (filename,)).fetchone()
+        return row[0] if row else 0
+    return _load_versions().get(filename, 0)
+
+def load_versioned(filename):
+    """(rows, version) for a compare-and-swap save_csv."""
+    version = file_version(filename)
+    return load_csv(filename), version
+
+def retry_on_conflict(operation, attempts=md.CONFLICT_RETRIES):
+    """Calls `operation` until it finishes without a ConflictError. Only for
+    changes that commute (stock movements, appends): `operation` must re-read
+    what it changes on every call."""
+    for attempt in range(attempts):
+        try:
+            return operation()
+        except ConflictError:
+            if attempt == attempts - 1: raise
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+def _load_versions(fresh=False):
+    # Readers may get a cached, older version (their save then conflicts);
+    # writers read it fresh under the commit lock.
+    global _versions
+    try:
+        st = os.stat(md.VERSIONS_FILE)
+    except FileNotFoundError:
+        return {}
+    key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached_key, versions = _versions
+    if fresh or cached_key != key:
+        with open(md.VERSIONS_FILE, 'r', newline='') as f:
+            versions = {row[0]: int(row[1]) for row in csv.reader(f) if len(row) >= 2}
+        _versions = (key, versions)
+    return versions
+
+def _check_version(filename, expected):
+    # Called under the commit lock, which every CSV writer holds.
+    if expected is None: return
+    current = _load_versions(fresh=True).get(filename, 0)
+    if current != expected:
+        raise ConflictError(f"{filename} was changed by another session (version {expected}, now {current})")
+
+def _bump_version(filename):
+    versions = dict(_load_versions(fresh=True))
+    versions[filename] = versions.get(filename, 0) + 1
+    buf = io.StringIO()
+    csv.writer(buf).writerows(versions.items())
+    write_file(md.VERSIONS_FILE, buf.getvalue().encode('utf-8'))
+
+def _sql_bump_version(conn, filename, expected=None):
+    """Bumps the version as the transaction's first write, so concurrent writers
+    queue on it; raises ConflictError if it was not `expected`."""
+    conn.execute("INSERT OR IGNORE INTO versions (name, value) VALUES (?, 0)", (filename,))
+    conn.execute("UPDATE versions SET value = value + 1 WHERE name = ?", (filename,))
+    _note_write()
+    current = conn.execute("SELECT value FROM versions WHERE name = ?", (filename,)).fetchone()[0] - 1
+    if expected is not None and current != expected:
+        raise ConflictError(f"{filename} was changed by another session (version {expected}, now {current})")
+
+# --- WRITE-BEHIND STORE ---
+# A long CLI session can open_store(): the CSV tables and the ledger balances
+# are loaded once and from then on every read is served from memory and every
+# write only changes memory (the hooks are in _read_rows, _save_csv,
+# _append_csv, _append_journal, file_version and _append_ledger, so the rest of
+# this module runs unchanged on top). flush_store() writes the difference
+# between what was loaded and what is in memory, plus the buffered cash
+# entries, as one commit group, so what is on disk is always a complete
+# checkpoint. A background thread flushes every WRITE_BEHIND_INTERVAL seconds
+# and close_store() flushes on exit; a crash loses at most one interval.
+#
+# The difference is applied with apply_row_changes, so another session's
+# changes to other rows and fields survive. Stock counts (COUNTER_COLUMNS) are
+# applied as deltas, so sales made elsewhere are not undone. A delta that would
+# take a count below zero is left out: everything else is flushed, the row
+# reloads with the count on disk and flush_store() then raises StockConflict
+# (a ConflictError) naming what was not saved. checkout() does not
+# wait for a flush at all: with the store open it writes through to disk
+# under the inventory compare-and-swap, as it does without one.
+_store = None
+_store_bypass = threading.local()
+
+@contextmanager
+def _disk_access():
+    """Reads and writes in this block go to the files, not the store."""
+    previous = getattr(_store_bypass, "active", False)
+    _store_bypass.active = True
+    try:
+        yield
+    finally:
+        _store_bypass.active = previous
+
+def open_store(background=True):
+    """Starts serving the CSV tables from memory. No-op on the SQLite backend,
+    which has transactions of its own."""
+    global _store
+    if _store is not None or _use_sql(): return
+    store = {"tables": {}, "ledger": [], "lock": threading.RLock(), "error": None,
+             "stop": threading.Event(), "thread": None}
+    with store["lock"]:
+        _store = store
+        for filename in md.FILE_COLUMNS:
+            _store_reload(filename)
+    if background:
+        store["thread"] = threading.Thread(target=_store_flusher, args=(store,), daemon=True)
+        store["thread"].start()
+
+def close_store(discard=False):
+    """Flushes (unless `discard`) and goes back to reading and writing the files."""
+    global _store
+    store = _store
+    if store is None: return
+    rejected = None
+    if not discard:
+        # On a conflict the store stays open, except a StockConflict: by then
+        # everything else is on disk.
+        try: flush_store()
+        except StockConflict as e: rejected = e
+    store["stop"].set()
+    if store["thread"] is not None: store["thread"].join()
+    with store["lock"]:
+        _store = None
+        for filename in store["tables"]: _invalidate(filename)
+    if rejected is not None: raise rejected
+
+def store_error():
+    """The error that stopped the last background flush (cleared when read)."""
+    if _store is None: return None
+    error, _store["error"] = _store["error"], None
+    return error
+
+def flush_store():
+    """Writes everything changed in memory to disk. Returns the files written;
+    StockConflict (after writing the rest) if a stock change was left out."""
+    store = _store
+    if store is None: return []
+    rejected = []
+    # Commit lock before store lock, the order every writer takes them in.
+    with commit_group(), store["lock"]:
+        dirty = [f for f, t in store["tables"].items() if t["rows"] is not t["base"]]
+        pending = list(store["ledger"])
+        with _disk_access():
+            for filename in dirty:
+                _invalidate(filename)
+                rejected += _flush_table(filename, store["tables"][filename])
+            if pending:
+                with file_lock(md.LEDGER_FILE):
+                    _append_ledger([entry[1:] for entry in pending], [entry[0] for entry in pending])
+            # Reload what was written, and anything another session changed.
+            stale = [f for f, t in store["tables"].items() if f in dirty or file_version(f) != t["version"]]
+        store["ledger"] = store["ledger"][len(pending):]
+        for filename in stale: _store_reload(filename)
+    if rejected: raise StockConflict("; ".join(rejected))
+    return dirty + ([md.LEDGER_FILE] if pending else [])
+
+def _store_flusher(store):
+    while not store["stop"].wait(md.WRITE_BEHIND_INTERVAL):
+        try:
+            flush_store()
+        except Exception as e:  # kept in memory; the CLI reports it
+            store["error"] = e
+
+def _store_snapshot():
+    # Rows are copy-on-write, so copying each table's references is a snapshot
+    # (a flush inside the group may replace `base` and `version` too).
+    if _store is None: return None
+    with _store["lock"]:
+        return {f: dict(t) for f, t in _store["tables"].items()}, list(_store["ledger"])
+
+def _store_restore(snapshot):
+    """Undoes memory writes (and flushes) made by a commit group that failed."""
+    if snapshot is None or _store is None: return
+    tables, ledger = snapshot
+    with _store["lock"]:
+        for filename, saved in tables.items():
+            table = _store["tables"].get(filename)
+            if table is None or all(table[k] is saved[k] for k in ("rows", "base", "version")): continue
+            # Versions handed out during the group must not match again.
+            _store["tables"][filename] = dict(saved, mem_version=table["mem_version"] + 1)
+            _invalidate(filename)
+        _store["ledger"] = ledger
+
+def _store_table(filename):
+    if _store is None or getattr(_store_bypass, "active", False): return None
+    return _store["tables"].get(filename)
+
+def _store_reload(filename):
+    with _disk_access():
+        version = file_version(filename)
+        rows = _read_rows(filename)
+    _store["tables"][filename] = {"base": rows, "rows": rows, "version": version, "mem_version": version}
+    _invalidate(filename)
+
+def _store_set(filename, rows):
+    # Rows are replaced, never edited in place: readers and `base` share them.
+    table = _store["tables"][filename]
+    table["rows"] = rows
+    table["mem_version"] += 1
+    return _invalidate(filename)
+
+def _store_row(columns, row):
+    """A row as it would read back from the CSV."""
+    return {c: '' if row.get(c) is None else str(row.get(c)) for c in columns}
+
+def _store_save(filename, columns, data, expected_version):
+    with _store["lock"]:
+        table = _store["tables"][filename]
+        if expected_version is not None and expected_version != table["mem_version"]:
+            raise ConflictError(f"{filename} was changed (version {expected_version}, now {table['mem_version']})")
+        return _store_set(filename, [_store_row(columns, r) for r in data])
+
+def _store_append(filename, columns, data):
+    with _store["lock"]:
+        _store_set(filename, _store["tables"][filename]["rows"] + [_store_row(columns, r) for r in data])
+
+def _store_journal(filename, columns, entries):
+    key_col = md.JOURNALED_FILES[filename]
+    with _store["lock"]:
+        rows = list(_store["tables"][filename]["rows"])
+        position = {r.get(key_col): i for i, r in enumerate(rows)}
+        for entry in entries:
+            i = position.get(str(entry.get(key_col)))
+            if i is None: continue
+            rows[i] = None if entry['Op'] == 'D' else _store_row(columns, entry)
+        _store_set(filename, [r for r in rows if r is not None])
+
+def _store_ledger(entries):
+    with _store["lock"]:
+        stamp = _now_stamp()
+        _store["ledger"].extend((stamp,) + tuple(entry) for entry in entries)
+        return _store_balances()
+
+def _store_balances():
+    """Ledger balances plus the cash entries still buffered in the store."""
+    balances = dict(_current_ledger_state()["balances"])
+    for _, account, delta, _, _ in (_store["ledger"] if _store is not None else []):
+        balances[account] = balances.get(account, 0.0) + round(float(delta), 2)
+    return balances
+
+def _diff_rows(filename, before, after):
+    """(updated, deleted, added) that turn `before` into `after`, matching on ROW_KEYS."""
+    pending = {}
+    for r in before: pending.setdefault(row_key(filename, r), []).append(r)
+    updated, added = [], []
+    for r in after:
+        olds = pending.get(row_key(filename, r))
+        if not olds:
+            added.append(r)
+            continue
+        old = olds.pop(0)
+        if old != r: updated.append((old, r))
+    deleted = [r for olds in pending.values() for r in olds]
+    return updated, deleted, added
+
+def _flush_table(filename, table):
+    """Writes one table's changes. Returns the stock changes that were left out."""
+    updated, deleted, added = _diff_rows(filename, table["base"], table["rows"])
+    counters = [c for c in md.COUNTER_COLUMNS.get(filename, ()) if any(old[c] != new[c] for old, new in updated)]
+    rejected = []
+    if counters and file_version(filename) != table["version"]:
+        # Someone else wrote since we loaded: add our change to their count,
+        # unless their sales already took the stock ours needs (then their
+        # count stays and the rest of the row is still written).
+        current = {}
+        for r in load_csv(filename): current.setdefault(row_key(filename, r), r)
+        for i, (old, new) in enumerate(updated):
+            now = current.get(row_key(filename, old))
+            if now is None: continue
+            for c in counters:
+                delta = _as_int(new[c]) - _as_int(old[c])
+                count = _as_int(now[c]) + delta
+                if delta < 0 and count < 0:
+                    rejected.append(f"{filename}: {' '.join(row_key(filename, old))} has {now[c]} {c} "
+                                    f"on disk, this session took {-delta}")
+                    count = now[c]
+                old, new = dict(old, **{c: now[c]}), dict(new, **{c: str(count)})
+            updated[i] = (old, new)
+    apply_row_changes(filename, md.FILE_COLUMNS[filename], updated, deleted, added)
+    return rejected
+
+def _as_int(value):
+    try: return int(float(value or 0))
+    except ValueError: return 0
+
+# --- BACKUPS ---
+# Content-addressed: each distinct file content is stored once, as
+# BACKUP_DIR/objects/<sha256>(.gz|.xz), and a backup is a small JSON manifest in
+# BACKUP_DIR/manifests mapping every data file to its object. A file whose
+# size, mtime and inode still match the previous manifest is not even re-read,
+# so backing up an unchanged tree costs a few stats and one manifest.
+#
+# Only stats and hard links are taken under the commit lock (so a backup never
+# captures half a commit group and writers wait for metadata calls at most);
+# reading, hashing and compressing happen after it is released. Replacements
+# give a file a new inode and appends only add bytes past the recorded size,
+# so the linked prefix stays what it was at the snapshot.
+_BACKUP_OBJECTS = os.path.join(md.BACKUP_DIR, 'objects')
+_BACKUP_MANIFESTS = os.path.join(md.BACKUP_DIR, 'manifests')
+_BACKUP_STAGING = os.path.join(md.BACKUP_DIR, 'staging')
+_COMPRESSORS = {'.gz': (lambda d: gzip.compress(d, mtime=0), gzip.decompress),
+                '.xz': (lzma.compress, lzma.decompress), '': (bytes, bytes)}
+_COMPRESSION_SUFFIX = {'gzip': '.gz', 'lzma': '.xz', None: ''}
+BACKUP_GC_GRACE = 3600.0
+_backup_lock = threading.Lock()
+
+def create_backup(skip_unchanged=False):
+    """Backs up every data file that exists. Returns the new backup's id, or
+    None when `skip_unchanged` and nothing changed since the last backup."""
+    for d in (_BACKUP_OBJECTS, _BACKUP_MANIFESTS, _BACKUP_STAGING): os.makedirs(d, exist_ok=True)
+    with _backup_lock:
+        _import_legacy_backups()
+        ids = list_backups()
+        previous = load_backup(ids[-1])["files"] if ids else {}
+        names = [n for n in md.BACKUP_FILES if os.path.exists(n)]
+        files, staged = {}, {}
+        try:
+            with file_lock(md.COMMIT_LOG_FILE):
+                taken, history = datetime.now(), _history_position()
+                for name in names:
+                    stamp = _stat_stamp(name)
+                    old = previous.get(name)
+                    if old and old["stat"] == stamp and _object_path(old["sha256"]):
+                        files[name] = old
+                    elif name != md.DB_FILE:
+                        staged[name] = (_stage(name), stamp)
+            for name, (path, stamp) in staged.items():
+                with open(path, 'rb') as f:
+                    files[name] = _put_object(f.read(stamp[0]), stamp)
+            if md.DB_FILE in names and md.DB_FILE not in files:
+                # SQLite writers never take the commit lock; its backup API gives a consistent copy.
+                files[md.DB_FILE] = _put_object(_sqlite_snapshot(), _stat_stamp(md.DB_FILE))
+        finally:
+            for path, _ in staged.values():
+                if os.path.exists(path): os.remove(path)
+        if skip_unchanged and files == previous: return None
+        return _write_manifest(taken, files, history)
+
+def list_backups():
+    """Backup ids, oldest first."""
+    if not os.path.isdir(_BACKUP_MANIFESTS): return []
+    return sorted(f[:-5] for f in os.listdir(_BACKUP_MANIFESTS) if f.endswith('.json'))
+
+def load_backup(backup_id):
+    """The manifest: {"id", "created", "files": {name: {"sha256", "size", "stat"}},
+    "history": [segment, offset]} (no "history" for imported .bak copies)."""
+    with open(os.path.join(_BACKUP_MANIFESTS, backup_id + '.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def oldest_backup():
+    """Creation time (ISO string) of the oldest backup, or None."""
+    for backup_id in list_backups():
+        try: return load_backup(backup_id)["created"]
+        except FileNotFoundError: continue  # pruned meanwhile
+    return None
+
+def backup_contents(backup_id, name):
+    """The bytes `name` held in a backup (None if it was not backed up)."""
+    entry = load_backup(backup_id)["files"].get(name)
+    return entry and read_object(entry["sha256"])
+
+def read_object(digest):
+    path = _object_path(digest)
+    if path is None: raise FileNotFoundError(f"Backup object {digest} is missing")
+    with open(path, 'rb') as f:
+        data = f.read()
+    return _COMPRESSORS[os.path.splitext(path)[1]][1](data)
+
+def _object_path(digest):
+    """Where an object is stored (in whichever compression), or None."""
+    for suffix in _COMPRESSORS:
+        path = os.path.join(_BACKUP_OBJECTS, digest + suffix)
+        if os.path.exists(path): return path
+    return None
+
+def _put_object(data, stamp):
+    digest = hashlib.sha256(data).hexdigest()
+    path = _object_path(digest)
+    if path:
+        os.utime(path)  # referenced again: keep it out of the next collection
+    else:
+        suffix = _COMPRESSION_SUFFIX[md.BACKUP_COMPRESSION]
+        _write_synced(os.path.join(_BACKUP_OBJECTS, digest + suffix), _COMPRESSORS[suffix][0](data))
+    return {"sha256": digest, "size": len(data), "stat": stamp}
+
+def _stat_stamp(name):
+    st = os.stat(name)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+def _stage(name):
+    path = os.path.join(_BACKUP_STAGING, f"{name}.{os.getpid()}.{threading.get_ident()}")
+    if os.path.exists(path): os.remove(path)
+    try: os.link(name, path)
+    except OSError: shutil.copyfile(name, path)
+    return path
+
+def _write_manifest(created, files, history=None):
+    backup_id = created.strftime("%Y%m%d_%H%M%S_%f")
+    manifest = {"id": backup_id, "created": created.isoformat(timespec='microseconds'), "files": files}
+    if history: manifest["history"] = history
+    _write_synced(os.path.join(_BACKUP_MANIFESTS, backup_id + '.json'),
+                  json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+    return backup_id
+
+def _write_synced(path, data):
+    """Temp file, fsync, rename: a crash never leaves a partial object or manifest."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _sqlite_snapshot():
+    tmp = os.path.join(_BACKUP_STAGING, f"snapshot.{os.getpid()}.db")
+    if os.path.exists(tmp): os.remove(tmp)
+    try:
+        with closing(sqlite3.connect(md.DB_FILE, timeout=30)) as src, closing(sqlite3.connect(tmp)) as dst:
+            src.backup(dst)
+        with open(tmp, 'rb') as f:
+            return f.read()
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+
+def _import_legacy_backups():
+    """Folds old "<file>_<YYYYmmdd_HHMMSS>.bak" copies into the object store,
+    one manifest per timestamp, then removes them."""
+    legacy = {}
+    for entry in os.listdir(md.BACKUP_DIR):
+        if not entry.endswith('.bak'): continue
+        name, _, stamp = entry[:-4].rpartition('_')
+        name, _, day = name.rpartition('_')
+        try: created = datetime.strptime(f"{day}_{stamp}", "%Y%m%d_%H%M%S")
+        except ValueError: continue
+        legacy.setdefault(created, {})[name] = os.path.join(md.BACKUP_DIR, entry)
+    for created, paths in sorted(legacy.items()):
+        files = {}
+        for name, path in paths.items():
+            with open(path, 'rb') as f:
+                files[name] = _put_object(f.read(), None)
+        _write_manifest(created, files)
+        for path in paths.values(): os.remove(path)
+
+# --- BACKUP SCHEDULE & RETENTION ---
+# start_backups() runs create_backup() on a daemon thread: once at start (to
+# catch up on the previous session), then every BACKUP_INTERVAL seconds and
+# whenever BACKUP_EVERY_WRITES commit groups / SQLite writes have landed.
+# Writers only bump a counter and set an event, so no save ever waits on
+# backup I/O. After each backup prune_backups() keeps the newest backup of
+# each of the last BACKUP_RETENTION hours / days / weeks (and always the
+# latest), then deletes objects no kept manifest uses.
+_backups = None
+
+def start_backups(interval=md.BACKUP_INTERVAL, every_writes=md.BACKUP_EVERY_WRITES):
+    global _backups
+    if _backups is not None: return
+    state = {"interval": interval, "every_writes": every_writes, "writes": 0,
+             "wake": threading.Event(), "stop": threading.Event(), "error": None}
+    state["thread"] = threading.Thread(target=_backup_worker, args=(state,), daemon=True)
+    _backups = state
+    state["thread"].start()
+
+def stop_backups():
+    """Stops the schedule without waiting for a backup in progress."""
+    global _backups
+    state, _backups = _backups, None
+    if state is None: return
+    state["stop"].set()
+    state["wake"].set()
+
+def request_backup():
+    """Asks the background thread for a backup now (returns immediately)."""
+    if _backups is not None: _backups["wake"].set()
+
+def backup_error():
+    """The last background backup failure, if any (cleared by a success)."""
+    return _backups and _backups["error"]
+
+def _note_write():
+    state = _backups
+    if state is None: return
+    state["writes"] += 1
+    if state["writes"] >= state["every_writes"]: state["wake"].set()
+
+def _backup_worker(state):
+    while not state["stop"].is_set():
+        state["writes"] = 0
+        try:
+            if create_backup(skip_unchanged=True): prune_backups()
+            state["error"] = None
+        except Exception as e:  # reported through backup_error(), never raised into a save
+            state["error"] = e
+        state["wake"].wait(state["interval"])
+        state["wake"].clear()
+
+def prune_backups(keep=md.BACKUP_RETENTION, now=None):
+    """Applies the retention policy. Returns the ids of the deleted backups."""
+    with _backup_lock:
+        ids = list_backups()
+        if not ids: return []
+        created = {i: datetime.fromisoformat(load_backup(i)["created"]) for i in ids}
+        kept = {ids[-1]}
+        for tier, count in keep.items():
+            last = None
+            for i in reversed(ids):
+                if count <= 0: break
+                bucket = _retention_bucket(tier, created[i])
+                if bucket != last:
+                    kept.add(i)
+                    last = bucket
+                    count -= 1
+        removed = [i for i in ids if i not in kept]
+        for i in removed: os.remove(os.path.join(_BACKUP_MANIFESTS, i + '.json'))
+        _collect_objects(kept, now or time.time())
+        _prune_history(load_backup(min(kept)).get("history"))
+    return removed
+
+def _retention_bucket(tier, when):
+    if tier == "hourly": return when.strftime("%Y%m%d%H")
+    if tier == "daily": return when.date()
+    if tier == "weekly": return when.isocalendar()[:2]
+    raise ValueError(f"Unknown retention tier {tier!r}")
+
+def _collect_objects(kept, now):
+    """Deletes objects no kept manifest names. Recently written ones are spared:
+    another process may be about to write the manifest that uses them."""
+    used = set()
+    for i in kept:
+        used.update(e["sha256"] for e in load_backup(i)["files"].values())
+    for entry in os.listdir(_BACKUP_OBJECTS):
+        path = os.path.join(_BACKUP_OBJECTS, entry)
+        digest = entry.split('.', 1)[0]
+        if digest not in used and now - os.path.getmtime(path) > BACKUP_GC_GRACE:
+            os.remove(path)
+
+# --- POINT-IN-TIME RESTORE ---
+# Checkpoints archive every committed group (its redo ops and commit time) to
+# the change history: append-only segments in HISTORY_DIR, a new one started
+# once the current one passes HISTORY_SEGMENT_BYTES. Each backup manifest
+# records the history position at its snapshot, so restore_as_of() loads the
+# newest backup taken at or before the target time, seeks straight to that
+# position and replays only the groups committed after the snapshot and up to
+# the target (then any still in COMMIT_LOG_FILE). Replay happens in memory and
+# the result is written back as one commit group, which is itself logged: a
+# restore can be undone by restoring to a time just before it.
+def restore_as_of(when):
+    """Rebuilds the data files as they were at `when` (a datetime). A backup
+    of the current state is taken first. Returns (backup id used, groups replayed)."""
+    if _use_sql(): return _sql_restore_as_of(when)
+    create_backup()
+    with commit_group():
+        manifest = _restore_base(when, md.RESTORE_FILES)
+        files = {name: read_object(e["sha256"]) for name, e in manifest["files"].items() if name in md.RESTORE_FILES}
+        replayed = 0
+        for ts, ops in _history_groups(manifest.get("history")):
+            if ts and ts <= manifest["created"]: continue
+            if ts > when.isoformat(timespec='microseconds'): break
+            for op in ops:
+                if op["path"] not in md.RESTORE_FILES or op["op"] == "stat": continue
+                files[op["path"]] = _apply_op(files.get(op["path"]), op)
+                if files[op["path"]] is None: del files[op["path"]]
+            replayed += 1
+        for name in md.RESTORE_FILES:
+            if name in files: write_file(name, files[name])
+            else: delete_file(name)
+        for name in md.FILE_COLUMNS: _bump_version(name)
+        _after_restore()
+    return manifest["id"], replayed
+
+def _restore_base(when, names):
+    """Manifest of the newest backup at or before `when` holding any of `names`."""
+    for backup_id in reversed(list_backups()):
+        try: manifest = load_backup(backup_id)
+        except FileNotFoundError: continue  # pruned meanwhile
+        if manifest["created"] <= when.isoformat(timespec='microseconds') and any(n in manifest["files"] for n in names):
+            return manifest
+    raise ValueError(f"No backup was taken at or before {when:%Y-%m-%d %H:%M:%S}")
+
+def _after_restore():
+    global _ledger_state
+    for name in md.RESTORE_FILES: _invalidate(name)
+    with _ledger_lock:
+        _ledger_state = None
+    if _store is not None:
+        with _store["lock"]:
+            for filename in md.FILE_COLUMNS: _store_reload(filename)
+    unique_ids()  # an old snapshot may predate the renumbering
+
+def _sql_restore_as_of(when):
+    """SQLite keeps no change history of its own: restores the nearest snapshot.
+    Versions only move forward, so open sessions' saves still conflict."""
+    manifest = _restore_base(when, [md.DB_FILE])
+    create_backup()
+    tmp = os.path.join(_BACKUP_STAGING, f"restore.{os.getpid()}.db")
+    os.makedirs(_BACKUP_STAGING, exist_ok=True)
+    _write_synced(tmp, read_object(manifest["files"][md.DB_FILE]["sha256"]))
+    try:
+        with _sql_session() as conn:
+            versions = dict(conn.execute("SELECT name, value FROM versions").fetchall())
+        with closing(sqlite3.connect(tmp)) as src, closing(get_db_connection()) as dst:
+            src.backup(dst)
+        with _sql_session() as conn:
+            for name in set(versions) | set(md.FILE_COLUMNS):
+                conn.execute("INSERT OR REPLACE INTO versions (name, value) VALUES (?, ?)", (name, versions.get(name, 0) + 1))
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+    _after_restore()
+    return manifest["id"], 0
+
+def _history_segments():
+    if not os.path.isdir(md.HISTORY_DIR): return []
+    return sorted(f for f in os.listdir(md.HISTORY_DIR) if f.endswith('.log'))
+
+def _history_position():
+    """[segment, offset] where the next archived group will be written."""
+    segments = _history_segments()
+    if not segments: return None
+    return [segments[-1], os.path.getsize(os.path.join(md.HISTORY_DIR, segments[-1]))]
+
+def _archive_groups(groups):
+    committed = [{"gid": gid, "ts": g["ts"], "commit": [op for op in g["redo"] if op["op"] != "stat"]}
+                 for gid, g in groups.items() if g["redo"]]
+    if not committed: return
+    os.makedirs(md.HISTORY_DIR, exist_ok=True)
+    position = _history_position()
+    if position is None or position[1] >= md.HISTORY_SEGMENT_BYTES:
+        position = [datetime.now().strftime("%Y%m%d_%H%M%S_%f") + '.log', 0]
+    with open(os.path.join(md.HISTORY_DIR, position[0]), 'a', encoding='utf-8') as f:
+        for record in committed:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def _history_groups(start):
+    """(commit time, ops) of every archived and logged group from `start` on."""
+    segments = _history_segments()
+    if start and start[0] in segments:
+        segments = segments[segments.index(start[0]):]
+    for i, segment in enumerate(segments):
+        with open(os.path.join(md.HISTORY_DIR, segment), 'r', encoding='utf-8', errors='replace') as f:
+            if i == 0 and start and start[0] == segment: f.seek(start[1])
+            for line in f:
+                try: record = json.loads(line)
+                except ValueError: break  # torn tail of a crashed archive
+                yield record["ts"], record["commit"]
+    for group in _read_commit_log().values():
+        if group["redo"]: yield group["ts"], group["redo"]
+
+def _prune_history(oldest):
+    """Drops whole segments no kept backup can replay from."""
+    if not oldest: return
+    for segment in _history_segments():
+        if segment >= oldest[0]: break
+        os.remove(os.path.join(md.HISTORY_DIR, segment))
 
 # --- ID GENERATORS ---
+# IDs come from persistent counters in SEQUENCES_FILE (or the sequences table)
+# instead of rescanning the data file. A counter is seeded once from the
+# highest existing ID; after that each call costs O(1) per ID and, being
+# reserved under a lock, two sessions checking out at once never share an ID.
+ID_SEQUENCES = {"sale": (md.SALES_FILE, "ID"), "order": (md.ORDERS_FILE, "Order_ID")}
+
+def allocate_ids(name, count=1):
+    """Reserves `count` consecutive IDs from sequence `name` ('sale'/'order')."""
+    if count <= 0: return []
+    if _use_sql(ID_SEQUENCES[name][0]): return _sql_allocate_ids(name, count)
+    with file_lock(md.SEQUENCES_FILE):
+        seqs = _load_sequences()
+        last = seqs.get(name)
+        if last is None: last = _max_existing_id(*ID_SEQUENCES[name])
+        seqs[name] = last + count
+        _save_sequences(seqs)
+    return [str(i) for i in range(last + 1, last + count + 1)]
+
 def get_next_order_id():
-    orders = load_csv(md.ORDERS_FILE)
-    if not orders: return "1"
-    max_id = 0
-    for row in orders:
-        try:
-            cid = int(row['Order_ID'])
-            if cid > max_id: max_id = cid
-        except: continue
-    return str(max_id + 1)
+    return allocate_ids("order")[0]
 
 def get_next_sale_id():
-    sales = load_csv(md.SALES_FILE)
-    if not sales: return "1"
+    return allocate_ids("sale")[0]
+
+def _max_existing_id(filename, key_col):
     max_id = 0
-    for row in sales:
+    for row in load_csv(filename):
         try:
-            cid = int(row.get('ID', 0))
+            cid = int(row.get(key_col, 0))
             if cid > max_id: max_id = cid
         except: continue
-    return str(max_id + 1)
+    return max_id
+
+def unique_ids():
+    """Gives every repeat of an ID in a journaled file (legacy sales.csv has
+    some) a fresh ID from its sequence, keeping the first row with each ID.
+    The journal matches rows on ID, so this has to run before anything is
+    edited: main.py and app.py call it at startup and restore_as_of after
+    bringing back old files. Returns the number of rows renumbered."""
+    renumbered = 0
+    for name, (filename, key_col) in ID_SEQUENCES.items():
+        if filename not in md.JOURNALED_FILES: continue
+        with file_lock(filename):
+            if _use_sql(filename):
+                renumbered += _sql_unique_ids(name, filename, key_col)
+                continue
+            rows, version = load_versioned(filename)
+            seen, repeats = set(), []
+            for r in rows:
+                if r.get(key_col) and r[key_col] not in seen: seen.add(r[key_col])
+                else: repeats.append(r)
+            if not repeats: continue
+            for r, new_id in zip(repeats, allocate_ids(name, len(repeats))): r[key_col] = new_id
+            save_csv(filename, md.FILE_COLUMNS[filename], rows, expected_version=version)
+            renumbered += len(repeats)
+    return renumbered
+
+def _sql_unique_ids(name, filename, key_col):
+    _invalidate(filename)
+    with _sql_session() as conn:
+        renumbered = ms.renumber_repeats(conn, md.SQL_TABLES[filename])
+        if renumbered:
+            _sql_bump_version(conn, filename)
+            ms.create_indexes(conn)  # the unique index could not be built before
+    return renumbered
+
+def _load_sequences():
+    if not os.path.exists(md.SEQUENCES_FILE): return {}
+    with open(md.SEQUENCES_FILE, 'r', newline='') as f:
+        return {row[0]: int(row[1]) for row in csv.reader(f) if len(row) >= 2}
+
+def _save_sequences(seqs):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(seqs.items())
+    write_file(md.SEQUENCES_FILE, buf.getvalue().encode('utf-8'))
+
+def _sql_allocate_ids(name, count):
+    conn = get_db_connection()
+    try:
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        ids = _sql_reserve_ids(conn, name, count)
+        conn.execute("COMMIT")
+    except:
+        if conn.in_transaction: conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return ids
+
+def _sql_reserve_ids(conn, name, count):
+    filename, key_col = ID_SEQUENCES[name]
+    row = conn.execute("SELECT value FROM sequences WHERE name = ?", (name,)).fetchone()
+    last = row[0] if row else _sql_max_id(filename, key_col, conn)
+    conn.execute("INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)", (name, last + count))
+    return [str(i) for i in range(last + 1, last + count + 1)]
 
 # --- FINANCIALS ---
+# Cash and payables are an append-only ledger (LEDGER_FILE): every change is a
+# (Timestamp, Account, Delta, Reason, Ref_ID) row written under a lock, so
+# concurrent updates cannot lose each other and every movement has a history.
+# Balances are kept in memory and advanced by replaying only the entries added
+# since the last read; every LEDGER_CHECKPOINT_EVERY entries a checkpoint
+# (byte offset + balances) is written so startup and "balance as of" queries
+# replay at most one checkpoint interval. FINANCIALS_FILE is kept as a
+# plain-CSV mirror of the current balances.
+#
+# Entries flushed from the write-behind store keep the time they were made, so
+# the file is only roughly in time order: an entry is never stamped more than
+# LEDGER_BACKDATE_LIMIT before it was written. A checkpoint is stamped with
+# the time it was written, so every entry it covers is at or before its
+# stamp, and a replay up to `until` may stop at the first entry past
+# until + LEDGER_BACKDATE_LIMIT.
+_ledger_state = None
+_ledger_lock = threading.Lock()
+LEDGER_EPOCH = "0001-01-01T00:00:00"
+
 def load_financials():
     defaults = {"Cash_On_Hand": 0.0, "Outstanding_Payables": 0.0}
-    if not os.path.exists(md.FINANCIALS_FILE): return defaults
+    if _use_sql():
+        with _sql_session() as conn:
+            data = {r['key_name']: float(r['value']) for r in conn.execute("SELECT key_name, value FROM financials")}
+        return {**defaults, **data}
+    return _store_balances()
+
+def save_financials(cash, payables, reason="Manual Adjustment"):
+    """Sets both balances, recording the differences in the ledger."""
+    if _use_sql():
+        with _sql_session() as conn:
+            current = {r['key_name']: float(r['value']) for r in conn.execute("SELECT key_name, value FROM financials")}
+            for account, value in (("Cash_On_Hand", cash), ("Outstanding_Payables", payables)):
+                delta = float(value) - current.get(account, 0.0)
+                if delta: _sql_ledger_insert(conn, account, delta, reason, "")
+            conn.executemany("INSERT OR REPLACE INTO financials (key_name, value) VALUES (?, ?)",
+                             [("Cash_On_Hand", cash), ("Outstanding_Payables", payables)])
+        return
+    with file_lock(md.LEDGER_FILE):
+        fin = _store_balances()
+        entries = [(account, float(value) - fin[account], reason, "")
+                   for account, value in (("Cash_On_Hand", cash), ("Outstanding_Payables", payables))
+                   if float(value) != fin[account]]
+        _append_ledger(entries)
+
+def update_cash_on_hand(amount_change, reason="", ref_id=""):
+    """Adds `amount_change` to cash. Returns the new cash balance."""
+    if _use_sql():
+        with _sql_session() as conn:
+            conn.execute("INSERT OR IGNORE INTO financials (key_name, value) VALUES ('Cash_On_Hand', 0.0)")
+            conn.execute("UPDATE financials SET value = value + ? WHERE key_name = 'Cash_On_Hand'", (amount_change,))
+            _sql_ledger_insert(conn, "Cash_On_Hand", amount_change, reason, ref_id)
+            return float(conn.execute("SELECT value FROM financials WHERE key_name = 'Cash_On_Hand'").fetchone()[0])
+    with file_lock(md.LEDGER_FILE):
+        return _append_ledger([("Cash_On_Hand", amount_change, reason, ref_id)])["Cash_On_Hand"]
+
+def balance_as_of(when):
+    """Balances at the end of `when` (a date or datetime)."""
+    if not isinstance(when, datetime): when = datetime.combine(when, datetime.max.time())
+    stamp = when.isoformat(timespec='seconds')
+    if _use_sql(): return _sql_balance_as_of(stamp)
+    _current_ledger_state()  # make sure the ledger exists
+    checkpoints = _load_checkpoints()
+    stamps = [cp["Timestamp"] for cp in checkpoints]
+    start = checkpoints[max(bisect.bisect_right(stamps, stamp) - 1, 0)]
+    state = _replay_ledger(start, until=stamp)
+    balances = dict(state["balances"])
+    for entry_stamp, account, delta, _, _ in (_store["ledger"] if _store is not None else []):
+        if entry_stamp <= stamp: balances[account] = balances.get(account, 0.0) + round(float(delta), 2)
+    return balances
+
+def _now_stamp():
+    return datetime.now().isoformat(timespec='seconds')
+
+def _checkpoint_state(cp):
+    return {
+        "offset": int(cp["Offset"]), "entries": int(cp["Entries"]), "checkpointed": int(cp["Entries"]),
+        "balances": {a: float(cp[a]) for a in md.FINANCIAL_ACCOUNTS},
+    }
+
+def _load_checkpoints():
+    with open(md.LEDGER_CHECKPOINTS_FILE, 'r', newline='', encoding='utf-8') as f:
+        return [_checkpoint_state(cp) | {"Timestamp": cp["Timestamp"]} for cp in csv.DictReader(f)]
+
+def _current_ledger_state():
+    """Balances at the end of the ledger, replaying only entries not yet seen."""
+    global _ledger_state
+    if not os.path.exists(md.LEDGER_FILE): _start_ledger()
+    size = os.path.getsize(md.LEDGER_FILE)
+    with _ledger_lock:
+        state = _ledger_state
+        if state is None or state["offset"] > size:
+            state = _load_checkpoints()[-1]
+        if state["offset"] < size:
+            state = _replay_ledger(state)
+        _ledger_state = state
+        return state
+
+def _replay_ledger(state, until=None):
+    """Applies ledger entries after state's offset (only those stamped up to
+    `until`, when given: the offset and count returned are then meaningless)."""
+    balances = dict(state["balances"])
+    offset, entries = state["offset"], state["entries"]
+    if until is not None:
+        horizon = (datetime.fromisoformat(until) + timedelta(seconds=md.LEDGER_BACKDATE_LIMIT)).isoformat(timespec='seconds')
+    with open(md.LEDGER_FILE, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'): break  # half-written entry
+            ts, account, delta = next(csv.reader([line.decode('utf-8')]))[:3]
+            if until is not None and ts > until:
+                if ts > horizon: break  # nothing after this can be stamped <= until
+                continue
+            balances[account] = balances.get(account, 0.0) + float(delta)
+            offset += len(line)
+            entries += 1
+    return {"offset": offset, "entries": entries, "checkpointed": state["checkpointed"], "balances": balances}
+
+def _start_ledger():
+    """Creates the ledger, opening it with the balances in FINANCIALS_FILE."""
+    with file_lock(md.LEDGER_FILE):
+        if os.path.exists(md.LEDGER_FILE): return
+        opening = {}
+        if os.path.exists(md.FINANCIALS_FILE):
+            try:
+                with open(md.FINANCIALS_FILE, 'r') as f:
+                    opening = {row[0]: float(row[1]) for row in csv.reader(f) if len(row) >= 2}
+            except ValueError: pass
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator='\n')
+        writer.writerow(md.LEDGER_COLUMNS)
+        header_size = len(buf.getvalue().encode('utf-8'))
+        for account in md.FINANCIAL_ACCOUNTS:
+            writer.writerow([LEDGER_EPOCH, account, opening.get(account, 0.0), "Opening Balance", ""])
+        checkpoints = io.StringIO()
+        writer = csv.writer(checkpoints)
+        writer.writerow(md.LEDGER_CHECKPOINT_COLUMNS)
+        writer.writerow([LEDGER_EPOCH, header_size, 0] + [0.0] * len(md.FINANCIAL_ACCOUNTS))
+        with commit_group():
+            write_file(md.LEDGER_CHECKPOINTS_FILE, checkpoints.getvalue().encode('utf-8'))
+            # Publish the ledger last so readers never see it without a checkpoint.
+            write_file(md.LEDGER_FILE, buf.getvalue().encode('utf-8'))
+
+def _append_ledger(entries, stamps=None):
+    """Appends (account, delta, reason, ref_id) entries, stamped now or with
+    `stamps` (one per entry, see LEDGER_BACKDATE_LIMIT). Caller holds the ledger lock."""
+    global _ledger_state
+    if _store is not None and not getattr(_store_bypass, "active", False): return _store_ledger(entries)
+    with commit_group():
+        state = _current_ledger_state()
+        if entries:
+            stamp = _now_stamp()
+            oldest = (datetime.now() - timedelta(seconds=md.LEDGER_BACKDATE_LIMIT)).isoformat(timespec='seconds')
+            buf = io.StringIO()
+            writer = csv.writer(buf, lineterminator='\n')
+            for i, (account, delta, reason, ref_id) in enumerate(entries):
+                made = max(stamps[i], oldest) if stamps else stamp
+                writer.writerow([made, account, round(float(delta), 2), str(reason).replace('\n', ' '), ref_id])
+            append_file(md.LEDGER_FILE, buf.getvalue().encode('utf-8'))
+            state = _current_ledger_state()
+            if state["entries"] - state["checkpointed"] >= md.LEDGER_CHECKPOINT_EVERY:
+                buf = io.StringIO()
+                csv.writer(buf).writerow([stamp, state["offset"], state["entries"]] +
+                                         [state["balances"].get(a, 0.0) for a in md.FINANCIAL_ACCOUNTS])
+                append_file(md.LEDGER_CHECKPOINTS_FILE, buf.getvalue().encode('utf-8'))
+                with _ledger_lock:
+                    _ledger_state = state = dict(state, checkpointed=state["entries"])
+        _write_financials_mirror(state["balances"])
+    return state["balances"]
+
+def _write_financials_mirror(balances):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for account in md.FINANCIAL_ACCOUNTS:
+        writer.writerow([account, round(balances.get(account, 0.0), 2)])
+    write_file(md.FINANCIALS_FILE, buf.getvalue().encode('utf-8'))
+
+def _sql_ledger_insert(conn, account, delta, reason, ref_id):
+    conn.execute("INSERT INTO ledger (ts, account, delta, reason, ref_id) VALUES (?, ?, ?, ?, ?)",
+                 (_now_stamp(), account, delta, reason, str(ref_id)))
+    _note_write()
+
+def _sql_balance_as_of(stamp):
+    # Whatever the ledger does not explain (balances imported by migration)
+    # is treated as the opening balance.
+    with _sql_session() as conn:
+        current = {r['key_name']: float(r['value']) for r in conn.execute("SELECT key_name, value FROM financials")}
+        result = {}
+        for account in md.FINANCIAL_ACCOUNTS:
+            total, upto = conn.execute(
+                "SELECT COALESCE(SUM(delta), 0), COALESCE(SUM(CASE WHEN ts <= ? THEN delta END), 0) "
+                "FROM ledger WHERE account = ?", (stamp, account)).fetchone()
+            result[account] = current.get(account, 0.0) - total + upto
+    return result
+
+# --- CHECKOUT ---
+# A sales cart is committed as one unit: stock is validated and decremented,
+# IDs are allocated, the sales appended and cash adjusted, with each file
+# written once. On SQLite all of it is a single transaction. With CSV files
+# stock is checked without holding a lock and the writes are one commit group
+# whose inventory save is a compare-and-swap: if another checkout got there
+# first the group rolls back and the cart is re-checked against fresh stock.
+def checkout(cart, status="Completed"):
+    """Sells every cart line (Brand/Type/Color/Size, Quantity, Total, Cost,
+    WAC_Group) as `status`. Returns (sale_ids, errors), where errors is a list
+    of (line number, message); nothing is written when there are errors."""
+    if not cart: return [], []
+    if _use_sql(md.SALES_FILE): return _sql_checkout(cart, status)
+    if _store is not None: return _store_checkout(cart, status)
+    return retry_on_conflict(lambda: _csv_checkout(cart, status))
+
+def _store_checkout(cart, status):
+    """checkout() with the write-behind store open: pending changes are flushed
+    first, then the cart is checked and written against the files."""
+    store = _store
+    with file_lock(md.COMMIT_LOG_FILE), store["lock"]:
+        try: flush_store()
+        except StockConflict as e: store["error"] = e  # the rest was flushed; the CLI reports it
+        with _disk_access():
+            _invalidate(md.INVENTORY_FILE)
+            _invalidate(md.SALES_FILE)
+            result = retry_on_conflict(lambda: _csv_checkout(cart, status))
+        for filename in (md.INVENTORY_FILE, md.SALES_FILE): _store_reload(filename)
+    return result
+
+def _csv_checkout(cart, status):
+    index = load_inventory_index()
+    rows, errors = _checkout_lines(index.get, cart)
+    if errors: return [], errors
+    taken = {}  # lines selling the same SKU share one stock row
+    for item, row in zip(cart, rows): taken.setdefault(id(row), [row, 0])[1] += int(item['Quantity'])
+    for row, qty in taken.values(): index.update(row, Quantity=str(int(row['Quantity']) - qty))
+    with commit_group():
+        save_inventory(index)
+        sale_ids = allocate_ids("sale", len(cart))
+        append_csv(md.SALES_FILE, md.SALES_COLUMNS, _checkout_sales(cart, sale_ids, status))
+        if status == "Completed": update_cash_on_hand(_cart_total(cart), "Sale", ", ".join(sale_ids))
+    return sale_ids, []
+
+def _checkout_lines(lookup, cart):
+    """Stock row for each cart line, checking demand summed per SKU."""
+    rows, errors, demand = [], [], {}
+    for n, item in enumerate(cart, 1):
+        sku = (item['Brand'], item['Type'], item['Color'], item['Size'])
+        desc = " ".join(str(part) for part in sku)
+        row = lookup(*sku)
+        qty = int(item.get('Quantity') or 0)
+        demand[sku] = demand.get(sku, 0) + qty
+        if qty <= 0: errors.append((n, f"Line {n}: quantity must be > 0 ({desc})"))
+        elif row is None: errors.append((n, f"Line {n}: {desc} is not in inventory"))
+        elif int(row['Quantity'] or 0) < demand[sku]:
+            errors.append((n, f"Stock error: {desc}! (Only {row['Quantity']} left)"))
+        rows.append(row)
+    return rows, errors
+
+def _checkout_sales(cart, sale_ids, status):
+    sale_date = datetime.now().strftime("%m/%d/%Y") if status == "Completed" else ""
+    sales = []
+    for item, sale_id in zip(cart, sale_ids):
+        profit = float(item['Total']) - (float(item['Quantity']) * float(item['Cost']))
+        sales.append({
+            "ID": sale_id, "Date": sale_date,
+            "Brand": item['Brand'], "Type": item['Type'], "Color": item['Color'], "Size": item['Size'],
+            "Sale_Price": str(item['Total']), "Profit": str(round(profit, 2)),
+            "WAC_Group": item.get('WAC_Group') or md.find_wac_group(item['Brand'], item['Type']),
+            "Status": status
+        })
+    return sales
+
+def _cart_total(cart):
+    return sum(float(item['Total']) for item in cart)
+
+def _sql_checkout(cart, status):
+    conn = get_db_connection()
     try:
-        with open(md.FINANCIALS_FILE, 'r') as f:
-            reader = csv.reader(f)
-            data = {row[0]: float(row[1]) for row in reader}
-        return data
-    except: return defaults
-
-def save_financials(cash, payables):
-    with open(md.FINANCIALS_FILE, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(["Cash_On_Hand", cash])
-        writer.writerow(["Outstanding_Payables", payables])
-
-def update_cash_on_hand(amount_change):
-    fin = load_financials()
-    new_cash = fin['Cash_On_Hand'] + amount_change
-    save_financials(new_cash, fin['Outstanding_Payables'])
-    return new_cash
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        def lookup(*sku):
+            row = conn.execute("SELECT rowid, Quantity FROM inventory WHERE Brand = ? AND Type = ? AND Color = ? AND Size = ? "
+                               "ORDER BY rowid LIMIT 1", sku).fetchone()
+            return {"rowid": row[0], "Quantity": row[1]} if row else None
+        rows, errors = _checkout_lines(lookup, cart)
+        if errors:
+            conn.execute("ROLLBACK")
+            return [], errors
+        sale_ids = _sql_reserve_ids(conn, "sale", len(cart))
+        sales = _checkout_sales(cart, sale_ids, status)
+        with _rollup_write(md.SALES_FILE, added=sales):
+            _invalidate(md.INVENTORY_FILE)
+            _invalidate(md.SALES_FILE)
+            _sql_bump_version(conn, md.INVENTORY_FILE)
+            _sql_bump_version(conn, md.SALES_FILE)
+            conn.executemany("UPDATE inventory SET Quantity = Quantity - ? WHERE rowid = ?",
+                             [(int(item['Quantity']), row["rowid"]) for item, row in zip(cart, rows)])
+            _sql_insert(md.SALES_FILE, md.SALES_COLUMNS, sales, conn)
+            if status == "Completed":
+                conn.execute("INSERT OR IGNORE INTO financials (key_name, value) VALUES ('Cash_On_Hand', 0.0)")
+                conn.execute("UPDATE financials SET value = value + ? WHERE key_name = 'Cash_On_Hand'", (_cart_total(cart),))
+                _sql_ledger_insert(conn, "Cash_On_Hand", _cart_total(cart), "Sale", ", ".join(sale_ids))
+            conn.execute("COMMIT")
+    except:
+        if conn.in_transaction: conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return sale_ids, []
 
 # --- WAC CALCULATIONS ---
-def recalculate_global_wac(target_group):
-    """Recalculates WAC for a group based on current inventory."""
+def recalculate_global_wac(target_group, index=None):
+    """Recalculates WAC for a group from the running totals.
+
+    With `index` the change is applied to that InventoryIndex and left for the
+    caller to save; otherwise inventory is loaded and saved here.
+    """
     if target_group == "UNKNOWN": return
-    
-    inventory = load_csv(md.INVENTORY_FILE)
-    total_qty = 0
-    total_value = 0.0
-    
-    # 1. Calculate Totals
-    for row in inventory:
-        # Check explicit group or find it
-        row_group = row.get('WAC_Group')
-        if not row_group: 
-            row_group = md.find_wac_group(row['Brand'], row['Type'])
-            
-        if row_group == target_group:
-            q = int(row['Quantity'])
-            c = float(row['WAC_Cost'])
-            total_qty += q
-            total_value += (q * c)
-    
-    if total_qty == 0: return
-
-    # 2. Update All Items in Group
-    new_wac = round(total_value / total_qty, 2)
-    
-    for row in inventory:
-        row_group = row.get('WAC_Group')
-        if not row_group: 
-            row_group = md.find_wac_group(row['Brand'], row['Type'])
-            
-        if row_group == target_group:
-            row['WAC_Cost'] = str(new_wac)
-            row['WAC_Group'] = target_group
-            
-    save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, inventory)
\ No newline at end of file
+    if index is not None: return index.apply_group_wac(target_group)
+    if _use_sql(md.INVENTORY_FILE):
+        _invalidate(md.INVENTORY_FILE)
+        return _sql_recalculate_wac(target_group)
+
+    inventory = load_inventory_index()
+    new_wac = inventory.apply_group_wac(target_group)
+    if new_wac is not None: save_inventory(inventory)
+    return new_wac
+
+def _sql_recalculate_wac(target_group):
+    with _sql_session() as conn:
+        _sql_bump_version(conn, md.INVENTORY_FILE)
+        # Rows saved without a group are matched by Brand/Type, as in the CSV path.
+        unlabeled = conn.execute("SELECT rowid, Brand, Type FROM inventory WHERE COALESCE(WAC_Group, '') = ''").fetchall()
+        conn.executemany("UPDATE inventory SET WAC_Group = ? WHERE rowid = ?",
+                         [(target_group, r['rowid']) for r in unlabeled
+                          if md.find_wac_group(r['Brand'], r['Type']) == target_group])
+        total_qty, total_value = conn.execute(
+            "SELECT SUM(Quantity), SUM(Quantity * WAC_Cost) "
+            "FROM inventory WHERE WAC_Group = ?", (target_group,)
+        ).fetchone()
+        if not total_qty:
+            conn.rollback()
+            return
+        new_wac = round(total_value / total_qty, 2)
+        conn.execute("UPDATE inventory SET WAC_Cost = ? WHERE WAC_Group = ?", (new_wac, target_group))
+    return new_wac
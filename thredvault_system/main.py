@@ -4,6 +4,7 @@ from datetime import datetime, date
 import database as db
 import utils as ut
 import models as md
+import catalog as ct
 
 # --- CORE FEATURES ---
 
@@ -80,7 +81,7 @@ def create_purchase_order():
         print(f"[!] Remaining Balance to Pay: ${remaining_balance:,.2f}")
 
     if ut.confirm_action(f"Save Order #{new_order_id} with {len(cart)} items?") == "SAVE":
-        existing_orders = db.load_csv(md.ORDERS_FILE)
+        new_lines = []
         
         for item in cart:
             if grand_total_cost > 0:
@@ -106,14 +107,15 @@ def create_purchase_order():
                 "Payment_Status": line_status,
                 "Status": "Ordered"
             }
-            existing_orders.append(new_row)
+            new_lines.append(new_row)
         
-        db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, existing_orders)
-        
-        # --- FINANCIAL UPDATE ---
-        if total_paid > 0:
-            new_cash = db.update_cash_on_hand(-total_paid)
-            print(f"[FINANCE] Cash updated: -${total_paid:.2f} (Bal: ${new_cash:.2f})")
+        with db.commit_group():
+            db.append_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, new_lines)
+            
+            # --- FINANCIAL UPDATE ---
+            if total_paid > 0:
+                new_cash = db.update_cash_on_hand(-total_paid, "Order Payment", new_order_id)
+                print(f"[FINANCE] Cash updated: -${total_paid:.2f} (Bal: ${new_cash:.2f})")
             
         print(f"Order #{new_order_id} Saved Successfully!")
 
@@ -195,22 +197,20 @@ def receive_stock():
                 if q > 0: staged.append((size, int(q)))
             
             if staged:
-                inventory = db.load_csv(md.INVENTORY_FILE)
-                for size, qty in staged:
-                    found = False
-                    for row in inventory:
-                        if (row['Brand'] == brand and row['Type'] == type_ and 
-                            row['Color'] == color and row['Size'] == size):
-                            row['Quantity'] = str(int(row['Quantity']) + qty)
-                            row['WAC_Group'] = wac_group
-                            found = True
-                    if not found:
-                        inventory.append({
-                            "Brand": brand, "Type": type_, "Color": color, "Size": size,
-                            "Quantity": str(qty), "WAC_Cost": str(unit_cost), "WAC_Group": wac_group
-                        })
-                db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, inventory)
-                db.recalculate_global_wac(wac_group)
+                def save_batch():
+                    inventory = db.load_inventory_index()
+                    for size, qty in staged:
+                        row = inventory.get(brand, type_, color, size)
+                        if row:
+                            inventory.update(row, Quantity=str(int(row['Quantity']) + qty), WAC_Group=wac_group)
+                        else:
+                            inventory.upsert({
+                                "Brand": brand, "Type": type_, "Color": color, "Size": size,
+                                "Quantity": str(qty), "WAC_Cost": str(unit_cost), "WAC_Group": wac_group
+                            })
+                    db.recalculate_global_wac(wac_group, inventory)
+                    db.save_inventory(inventory)
+                db.retry_on_conflict(save_batch)
                 print("  Saved Batch.")
                 
             print(f"Finished {color}. Add another Color?")
@@ -223,9 +223,8 @@ def receive_stock():
         current_data = db.load_csv(md.ORDERS_FILE)
         for r in current_data:
             if r['Order_ID'] == order_id and r['WAC_Group'] == wac_group and r['Status'] != 'Received':
-                r['Status'] = "Received"
+                db.apply_row_changes(md.ORDERS_FILE, md.ORDER_COLUMNS, updated=[(r, dict(r, Status="Received"))])
                 break
-        db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, current_data)
         print("Item Closed.")
 
 def record_sale():
@@ -246,13 +245,8 @@ def record_sale():
     size = ut.get_selection("Size:", sizes, "Custom")
     if not size: return
 
-    inventory = db.load_csv(md.INVENTORY_FILE)
-    found_item = None
-    for row in inventory:
-        if (row['Brand'] == brand and row['Color'] == color and 
-            row['Size'] == size and row['Type'] == type_):
-            found_item = row
-            break
+    inventory = db.load_inventory_index()
+    found_item = inventory.get(brand, type_, color, size)
     
     if not found_item:
         print("Item not found! Try again.")
@@ -271,21 +265,15 @@ def record_sale():
     wac_grp = found_item.get('WAC_Group', 'UNKNOWN')
 
     if ut.confirm_action(f"Sell 1x for ${price:.2f} (Profit: ${profit:.2f})") == "SAVE":
-        found_item['Quantity'] = str(int(found_item['Quantity']) - 1)
-        db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, inventory)
-        
-        sales = db.load_csv(md.SALES_FILE)
-        new_sale_id = db.get_next_sale_id()
-        sales.append({
-            "ID": new_sale_id,
-            "Date": date.today().strftime("%m/%d/%Y"),
+        _, errors = db.checkout([{
             "Brand": brand, "Type": type_, "Color": color, "Size": size,
-            "Sale_Price": str(price), "Profit": str(round(profit, 2)),
-            "WAC_Group": wac_grp
-        })
-        db.save_csv(md.SALES_FILE, md.SALES_COLUMNS, sales)
+            "Quantity": 1, "Total": price, "Cost": cost, "WAC_Group": wac_grp
+        }], "Completed")
+        if errors:
+            for _, msg in errors: print(msg)
+            return
         
-        new_cash = db.update_cash_on_hand(price)
+        new_cash = db.load_financials().get('Cash_On_Hand', 0.0)
         print(f"[FINANCE] Cash added: +${price:.2f} (Bal: ${new_cash:.2f})")
         print("Sale Recorded!")
 
@@ -304,16 +292,16 @@ def manage_sales_menu():
         elif opt == '3': process_return()
 
 def view_recent_sales():
-    sales = db.load_csv(md.SALES_FILE)
+    sales = db.load_records(md.SALES_FILE)
     if not sales:
         print("No sales records.")
         return
     
     print(f"\n{'ID':<4} {'DATE':<10} {'ITEM':<35} {'PRICE':<10}")
     print("-" * 65)
-    for row in sales[-10:]:
-        desc = f"{row['Brand']} {row['Type']} {row['Color']} {row['Size']}"
-        print(f"#{row['ID']:<3} {row['Date']:<10} {desc[:35]:<35} ${ut.safe_float(row['Sale_Price']):.2f}")
+    for sale in sales[-10:]:
+        desc = f"{sale.Brand} {sale.Type} {sale.Color} {sale.Size}"
+        print(f"#{sale.ID:<3} {sale.Date:<10} {desc[:35]:<35} ${sale.Sale_Price:.2f}")
     input("\nPress Enter...")
 
 def edit_sale_price():
@@ -337,13 +325,12 @@ def edit_sale_price():
     new_price = ut.get_valid_float("Enter New Correct Price: $")
     if new_price is not None:
         diff = new_price - old_price
-        db.update_cash_on_hand(diff)
-        
-        sale['Sale_Price'] = str(new_price)
         cost = old_price - ut.safe_float(sale['Profit']) 
-        sale['Profit'] = str(new_price - cost)
+        edited = dict(sale, Sale_Price=str(new_price), Profit=str(new_price - cost))
         
-        db.save_csv(md.SALES_FILE, md.SALES_COLUMNS, sales)
+        with db.commit_group():
+            db.apply_row_changes(md.SALES_FILE, md.SALES_COLUMNS, updated=[(sale, edited)])
+            db.update_cash_on_hand(diff, "Sale Price Edit", sale_id)
         print(f"Updated. Cash adjusted by ${diff:.2f}.")
 
 def process_return():
@@ -368,44 +355,42 @@ def process_return():
     print(f"Refund Amount: ${refund_amount:.2f}")
     
     if ut.confirm_action("Confirm Return & Refund?") == "SAVE":
-        new_cash = db.update_cash_on_hand(-refund_amount)
-        print(f"[FINANCE] Refunded ${refund_amount:.2f} (Bal: ${new_cash:.2f})")
-        
-        inventory = db.load_csv(md.INVENTORY_FILE)
-        found = False
-        for row in inventory:
-            if (row['Brand'] == sale['Brand'] and row['Type'] == sale['Type'] and 
-                row['Color'] == sale['Color'] and row['Size'] == sale['Size']):
-                row['Quantity'] = str(int(row['Quantity']) + 1)
-                found = True
-                break
-        
-        if not found:
-            cost_basis = refund_amount - ut.safe_float(sale['Profit'])
-            inventory.append({
-                "Brand": sale['Brand'], "Type": sale['Type'], "Color": sale['Color'],
-                "Size": sale['Size'], "Quantity": "1", 
-                "WAC_Cost": str(cost_basis), "WAC_Group": sale['WAC_Group']
-            })
-        
-        db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, inventory)
-        print("[INVENTORY] Item restocked.")
-        
-        del sales[target_idx]
-        db.save_csv(md.SALES_FILE, md.SALES_COLUMNS, sales)
-        print("[SALES] Record removed.")
+        # Refund, restock and removal commit together or not at all.
+        with db.commit_group():
+            new_cash = db.update_cash_on_hand(-refund_amount, "Return", sale_id)
+            print(f"[FINANCE] Refunded ${refund_amount:.2f} (Bal: ${new_cash:.2f})")
+            
+            inventory = db.load_inventory_index()
+            row = inventory.get(sale['Brand'], sale['Type'], sale['Color'], sale['Size'])
+            if row:
+                inventory.update(row, Quantity=str(int(row['Quantity']) + 1))
+            else:
+                cost_basis = refund_amount - ut.safe_float(sale['Profit'])
+                inventory.upsert({
+                    "Brand": sale['Brand'], "Type": sale['Type'], "Color": sale['Color'],
+                    "Size": sale['Size'], "Quantity": "1", 
+                    "WAC_Cost": str(cost_basis), "WAC_Group": sale['WAC_Group']
+                })
+            
+            db.save_inventory(inventory)
+            print("[INVENTORY] Item restocked.")
+            
+            db.journal_delete(md.SALES_FILE, md.SALES_COLUMNS, [sale['ID']])
+            print("[SALES] Record removed.")
 
 def view_dashboard_menu():
     ut.print_header("CEO DASHBOARD")
     while True:
         print("1. Liquidity & Lifetime Totals")
         print("2. Custom Date Range Performance")
+        print("3. Cash Balance As Of Date")
         print("0. Back")
         opt = input("Select: ").strip()
         
         if opt == '0' or opt == '': return
         elif opt == '1': dashboard_liquidity()
         elif opt == '2': dashboard_period(auto=False)
+        elif opt == '3': dashboard_balance_as_of()
 
 def view_monthly_performance():
     print("\n--- CURRENT MONTH PERFORMANCE ---")
@@ -430,19 +415,10 @@ def dashboard_period(auto=False):
         print("Invalid date format.")
         return
 
-    sales = db.load_csv(md.SALES_FILE)
-    rev = 0.0
-    profit = 0.0
-    units = 0
-    
-    for row in sales:
-        try:
-            s_date = datetime.strptime(row['Date'], "%m/%d/%Y").date()
-            if start_dt <= s_date <= end_dt:
-                rev += ut.safe_float(row['Sale_Price'])
-                profit += ut.safe_float(row['Profit'])
-                units += 1
-        except: continue
+    totals = db.period_metrics(start_dt, end_dt)
+    rev = totals['Revenue']
+    profit = totals['Profit']
+    units = totals['Units']
         
     margin = (profit / rev * 100) if rev > 0 else 0.0
     
@@ -455,6 +431,21 @@ def dashboard_period(auto=False):
     print("-" * 30)
     input("\nPress Enter...")
 
+def dashboard_balance_as_of():
+    date_str = input("As of Date (mm/dd/yyyy) [Enter for Today]: ").strip()
+    try:
+        as_of = datetime.strptime(date_str, "%m/%d/%Y").date() if date_str else date.today()
+    except ValueError:
+        print("Invalid date format.")
+        return
+    bal = db.balance_as_of(as_of)
+    print("-" * 30)
+    ut.print_aligned("As of:", as_of.strftime("%m/%d/%Y"))
+    ut.print_aligned("Cash on Hand:", f"${bal.get('Cash_On_Hand', 0):,.2f}")
+    ut.print_aligned("Outstanding:", f"${bal.get('Outstanding_Payables', 0):,.2f}")
+    print("-" * 30)
+    input("\nPress Enter...")
+
 def dashboard_liquidity():
     ut.print_header("LIQUIDITY & LIFETIME")
     fin = db.load_financials()
@@ -473,30 +464,19 @@ def dashboard_liquidity():
             fin['Outstanding_Payables'] = pay
         db.save_financials(fin['Cash_On_Hand'], fin['Outstanding_Payables'])
 
-    orders = db.load_csv(md.ORDERS_FILE)
     committed_cash = 0.0
     total_bought_qty = 0
-    
-    for row in orders:
-        if row['Status'] != 'Cancelled':
-            cost = ut.safe_float(row.get('Total_Cost'))
-            paid = ut.safe_float(row.get('Amount_Paid'))
-            committed_cash += (cost - paid)
-            total_bought_qty += int(row.get('Total_Pieces', 0))
+    for order in db.load_records(md.ORDERS_FILE):
+        if order.Status != 'Cancelled':
+            committed_cash += order.remaining
+            total_bought_qty += order.Total_Pieces
 
-    inventory = db.load_csv(md.INVENTORY_FILE)
-    on_hand_val = 0.0
-    for row in inventory:
-        on_hand_val += (int(row['Quantity']) * ut.safe_float(row['WAC_Cost']))
+    on_hand_val = sum(item.value for item in db.load_records(md.INVENTORY_FILE))
 
-    sales = db.load_csv(md.SALES_FILE)
-    lifetime_rev = 0.0
-    lifetime_profit = 0.0
-    lifetime_sold = 0
-    for row in sales:
-        lifetime_rev += ut.safe_float(row['Sale_Price'])
-        lifetime_profit += ut.safe_float(row['Profit'])
-        lifetime_sold += 1
+    sales = db.load_records(md.SALES_FILE)
+    lifetime_rev = sum(sale.Sale_Price for sale in sales)
+    lifetime_profit = sum(sale.Profit for sale in sales)
+    lifetime_sold = len(sales)
 
     net_worth = fin['Cash_On_Hand'] + on_hand_val - committed_cash
     
@@ -522,23 +502,17 @@ def view_brand_performance():
     ut.print_header("BRAND PERFORMANCE")
     stats = {}
     
-    inv = db.load_csv(md.INVENTORY_FILE)
-    for row in inv:
-        g = row.get('WAC_Group', 'UNKNOWN')
+    for item in db.load_records(md.INVENTORY_FILE):
+        g = item.Group
         if g not in stats: stats[g] = {'Stock':0, 'Val':0.0, 'Rev':0.0, 'Prof':0.0}
-        q = int(row['Quantity'])
-        stats[g]['Stock'] += q
-        stats[g]['Val'] += (q * ut.safe_float(row['WAC_Cost']))
+        stats[g]['Stock'] += item.Quantity
+        stats[g]['Val'] += item.value
         
-    sales = db.load_csv(md.SALES_FILE)
-    for row in sales:
-        g = row.get('WAC_Group', 'UNKNOWN')
-        if not g or g == 'None':
-            g = md.find_wac_group(row['Brand'], row['Type'])
-            
+    sales = db.scan_columns(md.SALES_FILE, ['Group', 'Sale_Price', 'Profit'])
+    for g, price, profit in zip(sales['Group'], sales['Sale_Price'], sales['Profit']):
         if g not in stats: stats[g] = {'Stock':0, 'Val':0.0, 'Rev':0.0, 'Prof':0.0}
-        stats[g]['Rev'] += ut.safe_float(row['Sale_Price'])
-        stats[g]['Prof'] += ut.safe_float(row['Profit'])
+        stats[g]['Rev'] += price
+        stats[g]['Prof'] += profit
 
     print(f"\n{'GROUP':<15} {'STOCK':<5} {'VALUE':<10} {'REVENUE':<10} {'PROFIT'}")
     print("-" * 60)
@@ -551,43 +525,40 @@ def view_brand_performance():
 def view_todays_sales():
     ut.print_header("TODAY'S PACKING LIST")
     today_str = date.today().strftime("%m/%d/%Y")
-    sales = db.load_csv(md.SALES_FILE)
+    sales = db.load_records(md.SALES_FILE)
     
     found = False
     print(f"\n{'BRAND':<15} {'ITEM':<20} {'SIZE':<5} {'PRICE'}")
     print("-" * 50)
-    for row in sales:
-        if row['Date'] == today_str:
-            item_desc = f"{row['Type']} {row['Color']}"
-            print(f"{row['Brand']:<15} {item_desc:<20} {row['Size']:<5} ${row['Sale_Price']}")
+    for sale in sales:
+        if sale.Date == today_str:
+            item_desc = f"{sale.Type} {sale.Color}"
+            print(f"{sale.Brand:<15} {item_desc:<20} {sale.Size:<5} ${sale.Sale_Price:.2f}")
             found = True
     if not found:
         print("No sales recorded today.")
     input("\nPress Enter to return...")
 
 def view_inventory():
-    inventory = db.load_csv(md.INVENTORY_FILE)
-    
-    total_inventory_value = 0.0
-    for row in inventory:
-        total_inventory_value += int(row['Quantity']) * ut.safe_float(row['WAC_Cost'])
+    inventory = db.load_records(md.INVENTORY_FILE)
+    total_inventory_value = sum(item.value for item in inventory)
 
     data = {}
-    for row in inventory:
-        b = row['Brand']
-        t = row['Type']
-        c = row['Color']
+    for item in inventory:
+        b = item.Brand
+        t = item.Type
+        c = item.Color
         if b not in data: data[b] = {}
         if t not in data[b]: data[b][t] = {}
         if c not in data[b][t]: data[b][t][c] = []
-        data[b][t][c].append(row)
+        data[b][t][c].append(item)
 
     ut.print_header(f"CURRENT INVENTORY (Total Value: ${total_inventory_value:,.2f})")
     
     print(f"{'COLOR':<15} {'TYPE':<12} {'SIZES':<45} {'VALUE'}")
     print("=" * 85)
 
-    sorted_brands = sorted(data.keys(), key=lambda x: md.get_group_rank(x, ""))
+    sorted_brands = sorted(data.keys(), key=ct.brand_rank)
 
     final_group_order = []
     
@@ -625,13 +596,13 @@ def view_inventory():
         available_types.sort()
 
         for type_ in available_types:
-            colors = sorted(data[brand_key][type_].keys(), key=lambda c: md.get_color_rank(brand_key, c))
+            colors = sorted(data[brand_key][type_].keys(), key=lambda c: ct.color_rank(brand_key, c))
             
             for color in colors:
                 items = data[brand_key][type_][color]
                 group_val = 0.0
-                qty_map = {row['Size']: int(row['Quantity']) for row in items}
-                cost_map = {row['Size']: ut.safe_float(row['WAC_Cost']) for row in items}
+                qty_map = {item.Size: item.Quantity for item in items}
+                cost_map = {item.Size: item.WAC_Cost for item in items}
                 
                 valid_sizes = md.SIZE_MAP.get(brand_key, ["S", "M", "L"])
                 
@@ -662,15 +633,13 @@ def fix_inventory_item():
     color = ut.get_selection("Color:", md.BRAND_COLORS.get(brand, []), "Custom")
     if not color: return
     
-    inventory = db.load_csv(md.INVENTORY_FILE)
-    found_items = [] 
+    inventory = db.load_inventory_index()
+    found_items = inventory.variants(brand, type_, color)
     
     print(f"\n[STATS] Current Stock for {brand} {type_} {color}:")
     print("-" * 30)
-    for i, row in enumerate(inventory):
-        if (row['Brand'] == brand and row['Type'] == type_ and row['Color'] == color):
-            print(f"   Size {row['Size']}: {row['Quantity']} (Cost: ${row['WAC_Cost']})")
-            found_items.append((i, row['Size'], row['Quantity']))
+    for row in found_items:
+        print(f"   Size {row['Size']}: {row['Quantity']} (Cost: ${row['WAC_Cost']})")
     print("-" * 30)
 
     if not found_items:
@@ -684,12 +653,8 @@ def fix_inventory_item():
     
     if mode == '1':
         target_size = input("Enter Size to Edit: ").strip().upper()
-        target_idx = -1
-        for idx, size, qty in found_items:
-            if size == target_size:
-                target_idx = idx
-                break
-        if target_idx == -1:
+        target_row = inventory.get(brand, type_, color, target_size)
+        if target_row is None:
             print("[X] Size not found.")
             return
         
@@ -697,8 +662,8 @@ def fix_inventory_item():
         if new_qty is None: return
         
         if ut.confirm_action("Update Quantity?") == "SAVE":
-            inventory[target_idx]['Quantity'] = str(int(new_qty))
-            db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, inventory)
+            inventory.update(target_row, Quantity=str(int(new_qty)))
+            db.save_inventory(inventory)
             print("[OK] Updated.")
             
     elif mode == '2':
@@ -708,14 +673,8 @@ def fix_inventory_item():
         if new_cost is None: return
         
         if ut.confirm_action(f"Update ALL items in {wac_group} to ${new_cost}?") == "SAVE":
-            count = 0
-            for row in inventory:
-                row_group = row.get('WAC_Group')
-                if not row_group: row_group = md.find_wac_group(row['Brand'], row['Type'])
-                if row_group == wac_group:
-                    row['WAC_Cost'] = str(new_cost)
-                    count += 1
-            db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, inventory)
+            count = inventory.set_group_cost(wac_group, new_cost)
+            db.save_inventory(inventory)
             print(f"[OK] Updated cost for {count} items.")
 
 def manage_orders_menu():
@@ -801,7 +760,9 @@ def view_order_details():
     input("\nPress Enter...")
 
 def edit_order():
-    orders = db.load_csv(md.ORDERS_FILE)
+    # Saves below are checked against this version, so another session's
+    # change to orders in the meantime is reported instead of overwritten.
+    orders, version = db.load_versioned(md.ORDERS_FILE)
     active_orders = [o for o in orders if o['Status'] != 'Received']
     unique_ids = sorted(list(set(r['Order_ID'] for r in active_orders)), key=lambda x: int(x), reverse=True)
     
@@ -830,14 +791,16 @@ def edit_order():
             confirm = input(f"PERMANENTLY DELETE Order #{oid}? (yes/no): ").lower()
             if confirm == 'yes':
                 total_paid = sum(ut.safe_float(orders[i]['Amount_Paid']) for i in target_indices)
+                refund = 'n'
                 if total_paid > 0:
                     refund = input(f"Refund ${total_paid:.2f} to Cash? (y/n): ").lower()
-                    if refund == 'y':
-                        db.update_cash_on_hand(total_paid) 
-                        print("Refund processed.")
 
                 orders = [r for r in orders if r['Order_ID'] != oid]
-                db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, orders)
+                with db.commit_group():
+                    db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, orders, version)
+                    if refund == 'y':
+                        db.update_cash_on_hand(total_paid, "Order Deleted", oid)
+                        print("Refund processed.")
                 print("Order deleted successfully.")
         
         elif del_opt == '2':
@@ -851,15 +814,17 @@ def edit_order():
                 index_to_remove = target_indices[int(sel)-1]
                 
                 paid_amt = ut.safe_float(item_to_delete['Amount_Paid'])
+                refund = 'n'
                 if paid_amt > 0:
                     print(f"You have paid ${paid_amt:.2f} for this item.")
                     refund = input("Did you get a refund for this specific item? (y/n): ").lower()
-                    if refund == 'y':
-                        db.update_cash_on_hand(paid_amt)
-                        print(f"[FINANCE] refunded ${paid_amt:.2f} to cash.")
 
                 del orders[index_to_remove]
-                db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, orders)
+                with db.commit_group():
+                    db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, orders, version)
+                    if refund == 'y':
+                        db.update_cash_on_hand(paid_amt, "Order Line Deleted", oid)
+                        print(f"[FINANCE] refunded ${paid_amt:.2f} to cash.")
                 print("Item removed from order.")
 
     elif opt == '2':
@@ -873,10 +838,6 @@ def edit_order():
         new_total_paid = ut.get_valid_float("Enter NEW Total Amount Paid: $")
         if new_total_paid is not None:
             diff = new_total_paid - current_paid
-            if diff != 0:
-                db.update_cash_on_hand(-diff)
-                print(f"[FINANCE] Cash adjusted by ${-diff:.2f}")
-
             for idx in target_indices:
                 row = orders[idx]
                 cost = ut.safe_float(row['Total_Cost'])
@@ -891,11 +852,59 @@ def edit_order():
                 elif new_line_paid == 0: row['Payment_Status'] = "Unpaid"
                 else: row['Payment_Status'] = "Partial"
             
-            db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, orders)
+            with db.commit_group():
+                db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, orders, version)
+                if diff != 0:
+                    db.update_cash_on_hand(-diff, "Order Payment", oid)
+                    print(f"[FINANCE] Cash adjusted by ${-diff:.2f}")
             print("Payments updated.")
 
+def restore_point_in_time():
+    ut.print_header("RESTORE TO A POINT IN TIME")
+    oldest = db.oldest_backup()
+    if oldest is None:
+        print("[X] No backups yet.")
+        return
+    print(f"Oldest backup: {oldest[:19].replace('T', ' ')}")
+    entry = input("Restore data as of (YYYY-MM-DD HH:MM[:SS]) or CANCEL: ").strip()
+    if entry.upper() == 'CANCEL' or not entry: return
+    try:
+        when = datetime.fromisoformat(entry)
+    except ValueError:
+        print("[X] Invalid date/time.")
+        return
+    if ut.confirm_action(f"Replace inventory, sales, orders and cash with their state at {when}?") != "SAVE": return
+    # Save this session first so the restore (and its safety backup) sees it.
+    try:
+        db.close_store()
+    except db.StockConflict as e:
+        print(f"[!] Stock change(s) not saved: {e}")
+    try:
+        backup_id, replayed = db.restore_as_of(when)
+    except ValueError as e:
+        print(f"[X] {e}")
+    else:
+        print(f"[OK] Restored from backup {backup_id} plus {replayed} logged change(s).")
+        print("     The previous state was backed up first: restore to a time just before this one to undo.")
+    db.open_store()
+
 if __name__ == "__main__":
+    replayed, rolled_back = db.recover()
+    if replayed or rolled_back:
+        print(f"[RECOVERY] Replayed {replayed} and rolled back {rolled_back} interrupted write(s).")
+    renumbered = db.unique_ids()
+    if renumbered: print(f"[SALES] Gave {renumbered} sale(s) that shared an ID a new ID.")
+    # Load everything once; menus work in memory and changes are flushed in
+    # the background and on exit.
+    db.open_store()
+    db.start_backups()
     while True:
+        error = db.store_error()
+        if isinstance(error, db.StockConflict):
+            print(f"\n[!] Background save left out stock change(s) another session's sales conflict with: {error}")
+        elif error: print(f"\n[!] Background save failed (changes are kept in memory): {error}")
+        error = db.backup_error()
+        if error: print(f"\n[!] Background backup failed: {error}")
         print("\n=== THREDVAULT MANAGER ===")
         print("1. Create Purchase Order (Multi-Brand)")
         print("2. Receive Stock")
@@ -908,22 +917,38 @@ if __name__ == "__main__":
         print("9. View Today's Sales")
         print("a. Order Management")
         print("b. Sales & Returns Management")
+        print("c. Restore Data (Point in Time)")
         print("0. Exit & Save")
         
         choice = input("Select: ").strip().lower()
-        if choice == '1': create_purchase_order()
-        elif choice == '2': receive_stock()
-        elif choice == '3': record_sale()
-        elif choice == '4': view_inventory()
-        elif choice == '5': view_monthly_performance()
-        elif choice == '6': view_brand_performance()
-        elif choice == '7': view_dashboard_menu()
-        elif choice == '8': fix_inventory_item()
-        elif choice == '9': view_todays_sales()
-        elif choice == 'a': manage_orders_menu()
-        elif choice == 'b': manage_sales_menu()
-        elif choice == '0' or choice == '': 
-            db.create_backup()
-            print("Exiting...")
-            break
-        else: print("Invalid choice.")
\ No newline at end of file
+        try:
+            if choice == '1': create_purchase_order()
+            elif choice == '2': receive_stock()
+            elif choice == '3': record_sale()
+            elif choice == '4': view_inventory()
+            elif choice == '5': view_monthly_performance()
+            elif choice == '6': view_brand_performance()
+            elif choice == '7': view_dashboard_menu()
+            elif choice == '8': fix_inventory_item()
+            elif choice == '9': view_todays_sales()
+            elif choice == 'a': manage_orders_menu()
+            elif choice == 'b': manage_sales_menu()
+            elif choice == 'c': restore_point_in_time()
+            elif choice == '0' or choice == '': 
+                try:
+                    db.close_store()
+                except db.StockConflict as e:
+                    print(f"[!] Stock change(s) not saved: {e}")
+                except db.ConflictError as e:
+                    print(f"[!] Could not save: {e}")
+                    if input("Discard your unsaved changes and exit? (y/n): ").lower() != 'y': continue
+                    db.close_store(discard=True)
+                db.checkpoint()
+                # Never wait on backup I/O here: the next session's first
+                # backup picks up whatever this one changed.
+                db.stop_backups()
+                print("Exiting...")
+                break
+            else: print("Invalid choice.")
+        except db.ConflictError as e:
+            print(f"[!] Not saved: {e}. Please re-open it and try again.")
\ No newline at end of file
@@ -0,0 +1,32 @@
+# thredvault_system/migrate_to_parquet.py
+# Converts sales and orders between the CSV layout and their columnar Parquet
+# datasets (md.COLUMNAR_DIRS). Needs pyarrow. Run without arguments to write
+# the datasets, or with --to-csv to rebuild the CSV files from them.
+import sys
+import database as db
+import models as md
+
+def to_parquet():
+    for filename, path in md.COLUMNAR_DIRS.items():
+        db.export_columnar(filename)
+        print(f"  - {filename} -> {path}/")
+    print("\nSUCCESS! Set THREDVAULT_COLUMNAR=parquet to have the reports read them.")
+
+def to_csv():
+    stale = 0
+    for filename, path in md.COLUMNAR_DIRS.items():
+        try:
+            count = db.import_columnar(filename)
+        except db.ConflictError as e:
+            print(f"  [X] {filename} kept: {e}")
+            stale += 1
+            continue
+        print(f"  - {path}/ -> {filename} ({count} rows)")
+    if not stale: print("\nSUCCESS! CSV files rebuilt from the Parquet datasets.")
+
+if __name__ == "__main__":
+    if db.pa is None:
+        print("pyarrow is not installed (pip install pyarrow).")
+        sys.exit(1)
+    if "--to-csv" in sys.argv: to_csv()
+    else: to_parquet()
@@ -1,75 +1,388 @@
 # thredvault_system/migrate_to_sql.py
 import sqlite3
 import csv
+import hashlib
+import io
 import os
+import sys
+from itertools import islice
+import models as md
 
-DB_FILE = 'thredvault.db'
+DB_FILE = md.DB_FILE
 
 # Files that have standard headers (Row 1 = Column Names)
-STANDARD_FILES = {
-    'inventory': 'inventory.csv',
-    'sales': 'sales.csv',
-    'orders': 'orders.csv'
-}
+STANDARD_FILES = {table: filename for filename, table in md.SQL_TABLES.items()}
 
 # Financials is special (Key, Value pair)
-FINANCIALS_FILE = 'financials.csv'
+FINANCIALS_FILE = md.FINANCIALS_FILE
+
+# Rows per executemany() call while streaming a CSV into its table.
+BATCH_SIZE = 5000
+HASH_CHUNK = 1 << 20
+
+# --- SCHEMA ---
+# Anything not listed is TEXT. Counts and IDs are INTEGER and dates are stored
+# as ISO yyyy-mm-dd so they sort and range-filter correctly. Money is kept as
+# the text it was written as: REAL affinity would read "10" back as "10.0",
+# unlike the CSV path. SQLite still sums and multiplies it as a number.
+COLUMN_TYPES = {
+    "Quantity": "INTEGER", "Total_Pieces": "INTEGER",
+    "ID": "INTEGER", "Order_ID": "INTEGER",
+}
+MONEY_COLUMNS = {"WAC_Cost", "Sale_Price", "Profit", "Total_Cost", "Unit_Cost", "Amount_Paid"}
+DATE_COLUMNS = {"Date", "Delivery_Date"}
+
+INDEXES = {
+    "idx_inventory_sku": "inventory (Brand, Type, Color, Size)",
+    "idx_inventory_group": "inventory (WAC_Group)",
+    "idx_sales_date": "sales (Date)",
+}
+
+# Row keys, enforced as UNIQUE indexes (they also serve ID/Order_ID lookups).
+# Legacy sales files can repeat an ID: loading renumbers every repeat from
+# the 'sale' sequence first (database.unique_ids does the same for the CSV).
+# An order repeating an (Order_ID, WAC_Group) line is not renumbered, as that
+# would split the order; its table is left without the index until fixed.
+UNIQUE_INDEXES = {
+    "uq_sales_id": ("sales", "ID"),
+    "uq_orders_line": ("orders", "Order_ID, WAC_Group"),
+}
+RENUMBERED_KEYS = {"sales": ("ID", "sale")}
+
+def to_sql_value(col, value):
+    """Converts a CSV string into the value stored in the typed column."""
+    if value is None: return ''
+    value = str(value).strip()
+    if col in DATE_COLUMNS:
+        # Hand-split mm/dd/yyyy: strptime dominates the cost of a large import.
+        parts = value.split('/')
+        if len(parts) == 3 and len(parts[2]) == 4 and all(p.isdigit() for p in parts):
+            m, d = int(parts[0]), int(parts[1])
+            if 1 <= m <= 12 and 1 <= d <= 31: return f"{parts[2]}-{m:02d}-{d:02d}"
+    return value
+
+def from_sql_value(col, value):
+    """Converts a stored value back into the string the CSV layer uses."""
+    if value is None: return ''
+    if col in DATE_COLUMNS and isinstance(value, str) and len(value) == 10 and value[4] == '-':
+        return f"{value[5:7]}/{value[8:10]}/{value[:4]}"
+    return str(value)
+
+def create_schema(conn, indexes=True):
+    """Creates the tables used by the SQLite backend (no-op if they exist)."""
+    c = conn.cursor()
+    for filename, table in md.SQL_TABLES.items():
+        cols = ', '.join(f"{col} {COLUMN_TYPES.get(col, 'TEXT')}" for col in md.FILE_COLUMNS[filename])
+        c.execute(f"CREATE TABLE IF NOT EXISTS {table} ({cols})")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS financials (
+        key_name TEXT PRIMARY KEY,
+        value REAL
+    )''')
+
+    # Every change to a financials value (see database.update_cash_on_hand).
+    c.execute('''CREATE TABLE IF NOT EXISTS ledger (
+        ts TEXT, account TEXT, delta REAL, reason TEXT, ref_id TEXT
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ledger_ts ON ledger (ts)")
+
+    # Last issued ID per sequence (see database.allocate_ids).
+    c.execute('''CREATE TABLE IF NOT EXISTS sequences (
+        name TEXT PRIMARY KEY,
+        value INTEGER
+    )''')
+
+    # Per-file change counters for optimistic concurrency (see database.file_version).
+    c.execute('''CREATE TABLE IF NOT EXISTS versions (
+        name TEXT PRIMARY KEY,
+        value INTEGER
+    )''')
+
+    # Per-file watermarks for sync_db(): how far into each CSV has been applied.
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+        filename TEXT PRIMARY KEY,
+        rows INTEGER, byte_offset INTEGER, content_hash TEXT,
+        size INTEGER, mtime_ns INTEGER, header TEXT
+    )''')
+    if indexes: create_indexes(conn)
+    conn.commit()
+
+def create_indexes(conn):
+    """Builds any missing index. Returns the tables that still repeat a key
+    and so were left without their unique index."""
+    for name, target in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    repeating = []
+    for name, (table, cols) in UNIQUE_INDEXES.items():
+        try:
+            conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table} ({cols})")
+        except sqlite3.IntegrityError:
+            repeating.append(table)
+    return repeating
+
+def finish_load(conn):
+    """Renumbers repeated sales IDs and builds the indexes after a (re)load."""
+    for table in RENUMBERED_KEYS:
+        renumbered = renumber_repeats(conn, table)
+        if renumbered: print(f"  - {table}: gave {renumbered} row(s) with a repeated ID a new ID")
+    for table in create_indexes(conn):
+        print(f"  [!] {table} repeats a key: left without its unique index")
+
+def drop_unique_indexes(conn, table):
+    """Lets a table be reloaded from a CSV that may repeat keys."""
+    for name, (target, _) in UNIQUE_INDEXES.items():
+        if target == table: conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+def stream_rows(filename, columns):
+    """Yields each CSV row as a tuple of typed values, without loading the file."""
+    with open(filename, 'r', newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            yield tuple(to_sql_value(col, row.get(col)) for col in columns)
+
+def bulk_load(conn, table, filename):
+    """Streams a CSV into `table` in executemany() batches. Returns the row count."""
+    columns = md.FILE_COLUMNS[filename]
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    rows = stream_rows(filename, columns)
+    total = 0
+    while True:
+        batch = list(islice(rows, BATCH_SIZE))
+        if not batch: break
+        conn.executemany(query, batch)
+        total += len(batch)
+    return total
+
+def renumber_repeats(conn, table):
+    """Gives every row whose ID is blank or used by an earlier row the next ID
+    of its sequence (seeded from the highest ID). Returns the count."""
+    key_col, sequence = RENUMBERED_KEYS[table]
+    repeats = [r[0] for r in conn.execute(
+        f"SELECT rowid FROM {table} WHERE {key_col} IS NULL OR {key_col} = '' "
+        f"OR rowid NOT IN (SELECT MIN(rowid) FROM {table} GROUP BY {key_col}) ORDER BY rowid")]
+    if not repeats: return 0
+    row = conn.execute("SELECT value FROM sequences WHERE name = ?", (sequence,)).fetchone()
+    highest = conn.execute(f"SELECT MAX({key_col}) FROM {table} WHERE typeof({key_col}) = 'integer'").fetchone()[0]
+    last = max(row[0] if row else 0, highest or 0)
+    conn.executemany(f"UPDATE {table} SET {key_col} = ? WHERE rowid = ?", zip(range(last + 1, last + len(repeats) + 1), repeats))
+    conn.execute("INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)", (sequence, last + len(repeats)))
+    return len(repeats)
+
+def apply_journal(conn, table, filename, entries=None):
+    """Replays a journaled file's pending edits/deletes onto its table."""
+    key_col = md.JOURNALED_FILES[filename]
+    path = filename + md.JOURNAL_SUFFIX
+    if entries is None:
+        if not os.path.exists(path): return 0
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            entries = list(csv.DictReader(f))
+    cols = [c for c in md.FILE_COLUMNS[filename] if c != key_col]
+    update = f"UPDATE {table} SET {', '.join(c + ' = ?' for c in cols)} WHERE {key_col} = ?"
+    delete = f"DELETE FROM {table} WHERE {key_col} = ?"
+    count = 0
+    for entry in entries:
+        key = to_sql_value(key_col, entry.get(key_col))
+        if entry.get('Op') == 'D':
+            conn.execute(delete, (key,))
+        elif entry.get('Op') == 'U':
+            conn.execute(update, [to_sql_value(c, entry.get(c)) for c in cols] + [key])
+        count += 1
+    return count
+
+# --- INCREMENTAL SYNC ---
+# A watermark records the byte offset applied so far, the hash of everything
+# before it, the row count and the file's size/mtime. If the file is untouched
+# it is skipped without reading; if the bytes before the offset still hash the
+# same only the appended tail is parsed; anything else (a rewrite) reloads
+# that one table.
+def get_watermark(conn, path):
+    row = conn.execute("SELECT rows, byte_offset, content_hash, size, mtime_ns, header "
+                       "FROM sync_state WHERE filename = ?", (path,)).fetchone()
+    if not row: return None
+    return dict(zip(["rows", "offset", "hash", "size", "mtime", "header"], row))
+
+def set_watermark(conn, path, rows, offset, digest, header):
+    st = os.stat(path)
+    conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?, ?, ?)",
+                 (path, rows, offset, digest, st.st_size, st.st_mtime_ns, header))
+
+def clear_watermark(conn, path):
+    conn.execute("DELETE FROM sync_state WHERE filename = ?", (path,))
+
+def _hash_upto(f, h, length):
+    while length > 0:
+        chunk = f.read(min(HASH_CHUNK, length))
+        if not chunk: return False
+        h.update(chunk)
+        length -= len(chunk)
+    return True
+
+def scan_file(path, mark):
+    """Compares a CSV with its watermark.
+
+    Returns (mode, header, new_rows, offset, digest) where mode is
+    'unchanged', 'append' (new_rows holds the appended rows) or 'rebuild'.
+    """
+    st = os.stat(path)
+    if mark and (mark["size"], mark["mtime"]) == (st.st_size, st.st_mtime_ns):
+        return "unchanged", mark["header"], [], mark["offset"], mark["hash"]
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        header_line = f.readline()
+        header = header_line.decode('utf-8-sig').strip()
+        h.update(header_line)
+        if not (mark and header == mark["header"] and st.st_size >= mark["offset"]
+                and _hash_upto(f, h, mark["offset"] - len(header_line))
+                and h.hexdigest() == mark["hash"]):
+            return "rebuild", header, [], 0, None
+        tail = f.read()
+
+    # Leave a half-written last line for the next sync.
+    tail = tail[:tail.rfind(b'\n') + 1]
+    h.update(tail)
+    fieldnames = next(csv.reader([header]))
+    rows = list(csv.DictReader(io.StringIO(tail.decode('utf-8')), fieldnames=fieldnames))
+    return "append", header, rows, mark["offset"] + len(tail), h.hexdigest()
+
+def file_watermark(path):
+    """Offset/hash/header for a file that has just been loaded in full."""
+    h = hashlib.sha1()
+    offset = 0
+    with open(path, 'rb') as f:
+        header = f.readline()
+        h.update(header)
+        offset = len(header)
+        pending = b''
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            data = pending + chunk
+            cut = data.rfind(b'\n') + 1
+            h.update(data[:cut])
+            offset += cut
+            pending = data[cut:]
+    return offset, h.hexdigest(), header.decode('utf-8-sig').strip()
+
+def mark_loaded(conn, path, rows):
+    offset, digest, header = file_watermark(path)
+    set_watermark(conn, path, rows, offset, digest, header)
+
+def _insert_rows(conn, table, filename, rows):
+    columns = md.FILE_COLUMNS[filename]
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    conn.executemany(query, [tuple(to_sql_value(col, r.get(col)) for col in columns) for r in rows])
+
+def _sync_journal(conn, table, filename, base_rebuilt):
+    path = filename + md.JOURNAL_SUFFIX
+    mark = None if base_rebuilt else get_watermark(conn, path)
+    if not os.path.exists(path):
+        clear_watermark(conn, path)
+        return 0
+    mode, header, entries, offset, digest = scan_file(path, mark)
+    if mode == "unchanged": return 0
+    if mode == "rebuild":
+        # Journals only grow until compaction rewrites the base file, so a
+        # journal we cannot continue is only replayed in full if it is new
+        # or the table was just rebuilt.
+        if mark is not None: return None
+        count = apply_journal(conn, table, filename)
+        mark_loaded(conn, path, count)
+        return count
+    count = apply_journal(conn, table, filename, entries)
+    set_watermark(conn, path, mark["rows"] + count, offset, digest, header)
+    return count
+
+def _reload_table(conn, table, filename):
+    drop_unique_indexes(conn, table)
+    conn.execute(f"DELETE FROM {table}")
+    count = bulk_load(conn, table, filename)
+    mark_loaded(conn, filename, count)
+    return count
+
+def sync_db():
+    """Brings thredvault.db up to date with the CSVs, applying only what changed."""
+    conn = sqlite3.connect(DB_FILE)
+    create_schema(conn)
+    c = conn.cursor()
+    reloaded = set()
+    for table, filename in STANDARD_FILES.items():
+        if not os.path.exists(filename):
+            print(f"Skipping {filename} (Not found)")
+            continue
+        mark = get_watermark(conn, filename)
+        mode, header, rows, offset, digest = scan_file(filename, mark)
+        if mode == "append":
+            try:
+                _insert_rows(conn, table, filename, rows)
+                set_watermark(conn, filename, mark["rows"] + len(rows), offset, digest, header)
+                if rows: print(f"{filename}: +{len(rows)} rows")
+            except sqlite3.IntegrityError:
+                mode = "rebuild"  # an appended row repeats a key: renumbered below
+        if mode == "rebuild":
+            reloaded.add(table)
+            print(f"{filename}: reloaded ({_reload_table(conn, table, filename)} rows)")
+
+        if filename in md.JOURNALED_FILES:
+            applied = _sync_journal(conn, table, filename, mode == "rebuild")
+            if applied is None:
+                # Journal was rewritten under an unchanged base; start over for this table.
+                reloaded.add(table)
+                count = _reload_table(conn, table, filename)
+                applied = _sync_journal(conn, table, filename, True)
+                print(f"{filename}: reloaded ({count} rows)")
+            if applied: print(f"{filename}: applied {applied} journal entries")
+    # A reloaded table lost its unique index (the CSV may repeat a key).
+    if reloaded: finish_load(conn)
+
+    if os.path.exists(FINANCIALS_FILE):
+        mode = scan_file(FINANCIALS_FILE, get_watermark(conn, FINANCIALS_FILE))[0]
+        if mode != "unchanged":
+            with open(FINANCIALS_FILE, 'r') as f:
+                for row in csv.reader(f):
+                    if len(row) >= 2:
+                        c.execute("INSERT OR REPLACE INTO financials (key_name, value) VALUES (?, ?)",
+                                  (row[0].strip(), float(row[1].strip())))
+            mark_loaded(conn, FINANCIALS_FILE, 2)
+            print("Financials updated.")
+
+    conn.commit()
+    conn.close()
 
 def init_db():
+    removed = True
     if os.path.exists(DB_FILE):
         try:
             os.remove(DB_FILE)
             print("Removed old DB to ensure clean migration.")
         except PermissionError:
+            removed = False
             print("Could not delete old DB. It might be in use. Overwriting tables instead.")
 
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
 
-    # 1. Create Tables
+    # 1. Create Tables (indexes are built after the bulk load, which is faster)
     print("Creating tables...")
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS inventory (
-        Brand TEXT, Type TEXT, Color TEXT, Size TEXT, 
-        Quantity TEXT, WAC_Cost TEXT, WAC_Group TEXT
-    )''')
+    create_schema(conn, indexes=False)
+    if not removed:
+        for table in list(STANDARD_FILES) + ['financials']:
+            drop_unique_indexes(conn, table)
+            c.execute(f"DELETE FROM {table}")
 
-    c.execute('''CREATE TABLE IF NOT EXISTS sales (
-        ID TEXT, Date TEXT, Brand TEXT, Type TEXT, Color TEXT, 
-        Size TEXT, Sale_Price TEXT, Profit TEXT, WAC_Group TEXT
-    )''')
-
-    c.execute('''CREATE TABLE IF NOT EXISTS orders (
-        Order_ID TEXT, Date TEXT, WAC_Group TEXT, Supplier TEXT, 
-        Total_Pieces TEXT, Total_Cost TEXT, Unit_Cost TEXT, 
-        Amount_Paid TEXT, Payment_Status TEXT, Status TEXT
-    )''')
-
-    c.execute('''CREATE TABLE IF NOT EXISTS financials (
-        key_name TEXT PRIMARY KEY,
-        value TEXT
-    )''')
-
-    # 2. Import Standard CSV Data (Inventory, Sales, Orders)
+    # 2. Stream Standard CSV Data (Inventory, Sales, Orders) in one transaction
     for table, filename in STANDARD_FILES.items():
         if os.path.exists(filename):
             print(f"Migrating {filename} -> Table: {table}...")
             try:
-                with open(filename, 'r') as f:
-                    reader = csv.DictReader(f)
-                    rows = list(reader)
-                    if not rows: 
-                        print(f"  - {filename} is empty. Skipping.")
-                        continue
-                    
-                    # Dynamic insert based on columns found in CSV
-                    cols = rows[0].keys()
-                    placeholders = ', '.join(['?'] * len(cols))
-                    col_names = ', '.join(cols)
-                    query = f"INSERT INTO {table} ({col_names}) VALUES ({placeholders})"
-                    
-                    for row in rows:
-                        c.execute(query, list(row.values()))
+                count = bulk_load(conn, table, filename)
+                mark_loaded(conn, filename, count)
+                if not count:
+                    print(f"  - {filename} is empty. Skipping.")
+                    continue
+                print(f"  - {count} rows")
+                if filename in md.JOURNALED_FILES:
+                    applied = apply_journal(conn, table, filename)
+                    if os.path.exists(filename + md.JOURNAL_SUFFIX):
+                        print(f"  - Applied {applied} journal entries")
+                        mark_loaded(conn, filename + md.JOURNAL_SUFFIX, applied)
             except Exception as e:
                 print(f"  - Error reading {filename}: {e}")
         else:
@@ -85,19 +398,25 @@ def init_db():
                     if len(row) >= 2:
                         # Ensure we don't insert garbage
                         key = row[0].strip()
-                        val = row[1].strip()
+                        val = float(row[1].strip())
                         c.execute("INSERT OR REPLACE INTO financials (key_name, value) VALUES (?, ?)", (key, val))
+            mark_loaded(conn, FINANCIALS_FILE, 2)
         except Exception as e:
             print(f"  - Error reading financials: {e}")
     else:
         # Set defaults if file missing
         print("Financials file not found. Setting defaults.")
-        c.execute("INSERT OR IGNORE INTO financials (key_name, value) VALUES ('Cash_On_Hand', '0.0')")
-        c.execute("INSERT OR IGNORE INTO financials (key_name, value) VALUES ('Outstanding_Payables', '0.0')")
+        c.execute("INSERT OR IGNORE INTO financials (key_name, value) VALUES ('Cash_On_Hand', 0.0)")
+        c.execute("INSERT OR IGNORE INTO financials (key_name, value) VALUES ('Outstanding_Payables', 0.0)")
 
+    print("Building indexes...")
+    finish_load(conn)
     conn.commit()
     conn.close()
     print("\nSUCCESS! 'thredvault.db' has been created.")
 
 if __name__ == "__main__":
-    init_db()
\ No newline at end of file
+    if "--sync" in sys.argv and os.path.exists(DB_FILE):
+        sync_db()
+    else:
+        init_db()
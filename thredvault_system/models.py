@@ -1,13 +1,36 @@
 # thredvault_system/models.py
 import os
+from types import MappingProxyType
 
 # --- FILE CONFIGURATION ---
 INVENTORY_FILE = 'inventory.csv'
 SALES_FILE = 'sales.csv'
 ORDERS_FILE = 'orders.csv'
 FINANCIALS_FILE = 'financials.csv'
+SEQUENCES_FILE = 'sequences.csv'
+LEDGER_FILE = 'ledger.csv'
+LEDGER_CHECKPOINTS_FILE = 'ledger_checkpoints.csv'
+COMMIT_LOG_FILE = 'commit.log'
+VERSIONS_FILE = 'versions.csv'
 BACKUP_DIR = 'backups'
 
+# --- JOURNAL CONFIGURATION ---
+# Journaled files take new rows as plain appends; edits and deletes are logged
+# to a sidecar journal and merged back into the file by compaction.
+JOURNALED_FILES = {SALES_FILE: "ID"}
+# Columns that identify a row when an editor's change set is applied.
+ROW_KEYS = {INVENTORY_FILE: ("Brand", "Type", "Color", "Size"), SALES_FILE: ("ID",),
+            ORDERS_FILE: ("Order_ID", "WAC_Group")}
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_COMPACT_THRESHOLD = 500
+
+# --- STORAGE BACKEND ---
+# 'csv' keeps the flat files above as the source of truth. 'sqlite' serves the
+# same database.py API from DB_FILE (run migrate_to_sql.py once to import).
+STORAGE_BACKEND = os.environ.get('THREDVAULT_BACKEND', 'csv').lower()
+DB_FILE = 'thredvault.db'
+SQL_TABLES = {INVENTORY_FILE: 'inventory', SALES_FILE: 'sales', ORDERS_FILE: 'orders'}
+
 # --- COLUMNS (UPDATED WITH DELIVERY DATE) ---
 ORDER_COLUMNS = [
     "Order_ID", "Date", "Delivery_Date", "WAC_Group", "Supplier", 
@@ -18,6 +41,59 @@ ORDER_COLUMNS = [
 INVENTORY_COLUMNS = ["Brand", "Type", "Color", "Size", "Quantity", "WAC_Cost", "WAC_Group"]
 SALES_COLUMNS = ["ID", "Date", "Brand", "Type", "Color", "Size", "Sale_Price", "Profit", "WAC_Group", "Status"]
 
+# Cash/payables ledger: one row per balance change, plus periodic checkpoints.
+FINANCIAL_ACCOUNTS = ["Cash_On_Hand", "Outstanding_Payables"]
+LEDGER_COLUMNS = ["Timestamp", "Account", "Delta", "Reason", "Ref_ID"]
+LEDGER_CHECKPOINT_COLUMNS = ["Timestamp", "Offset", "Entries"] + FINANCIAL_ACCOUNTS
+LEDGER_CHECKPOINT_EVERY = 100
+# Cash entries buffered by the write-behind store keep the time they were made
+# when flushed, back to at most this many seconds before the flush.
+LEDGER_BACKDATE_LIMIT = 3600
+
+# Committed groups stay in COMMIT_LOG_FILE until it grows past this size (or
+# the CLI exits); a checkpoint then syncs the files it names and empties it.
+COMMIT_LOG_CHECKPOINT_BYTES = 1 << 20
+
+# Attempts made by database.retry_on_conflict before a ConflictError is shown.
+CONFLICT_RETRIES = 5
+
+# CLI write-behind store: seconds between background flushes, and the columns
+# merged as counts (our change added to theirs) when another session also
+# wrote the file.
+WRITE_BEHIND_INTERVAL = 30
+COUNTER_COLUMNS = {INVENTORY_FILE: ("Quantity",)}
+
+# Files captured by database.create_backup(); contents are deduplicated in
+# BACKUP_DIR/objects and compressed with BACKUP_COMPRESSION ('gzip', 'lzma' or None).
+BACKUP_FILES = [INVENTORY_FILE, SALES_FILE, SALES_FILE + JOURNAL_SUFFIX, ORDERS_FILE, FINANCIALS_FILE,
+                LEDGER_FILE, LEDGER_CHECKPOINTS_FILE, SEQUENCES_FILE, DB_FILE]
+BACKUP_COMPRESSION = 'gzip'
+
+# Background backups run every BACKUP_INTERVAL seconds and after every
+# BACKUP_EVERY_WRITES writes; pruning keeps the newest backup of each of the
+# last N hours / days / weeks.
+BACKUP_INTERVAL = 3600
+BACKUP_EVERY_WRITES = 50
+BACKUP_RETENTION = {"hourly": 24, "daily": 7, "weekly": 8}
+
+# Point-in-time restore: files it rebuilds (ID counters only move forward), and
+# where checkpoints archive committed writes for it to replay.
+RESTORE_FILES = [INVENTORY_FILE, SALES_FILE, SALES_FILE + JOURNAL_SUFFIX, ORDERS_FILE, FINANCIALS_FILE,
+                 LEDGER_FILE, LEDGER_CHECKPOINTS_FILE]
+HISTORY_DIR = os.path.join(BACKUP_DIR, 'history')
+HISTORY_SEGMENT_BYTES = 4 << 20
+
+# Columnar (Parquet) copies of the long tables, read by the reports when
+# THREDVAULT_COLUMNAR=parquet and pyarrow is installed (see database.py).
+COLUMNAR_FORMAT = os.environ.get('THREDVAULT_COLUMNAR', '').lower()
+COLUMNAR_DIRS = {SALES_FILE: 'sales.parquet', ORDERS_FILE: 'orders.parquet'}
+COLUMNAR_DICTIONARY_COLUMNS = {"Brand", "Type", "Color", "Size", "WAC_Group", "Status",
+                               "Supplier", "Payment_Status"}
+COLUMNAR_ROW_GROUP = 16384
+COLUMNAR_MAX_PARTS = 64
+
+FILE_COLUMNS = {INVENTORY_FILE: INVENTORY_COLUMNS, SALES_FILE: SALES_COLUMNS, ORDERS_FILE: ORDER_COLUMNS}
+
 # --- DATA MAPPING ---
 VALID_WAC_GROUPS = [
     "Ess_HoodiePant", "Ess_TeeShort", "Spdr_HoodiePant", "Den_HoodiePant", "Eric_EmanShorts", "YZY_Slides"
@@ -67,9 +143,17 @@ BRAND_TYPES = {
     "YZY": ["SLIDES"]
 }
 
-def find_wac_group(brand, type_):
+# (BRAND, TYPE) -> WAC group, built once from the two maps above. Read-only so
+# every module can share it; the first group listing a pair wins, as before.
+def _build_wac_group_lookup():
+    lookup = {}
     for group, types in WAC_TO_TYPES.items():
-        mapped_brand = WAC_TO_BRAND.get(group)
-        if mapped_brand == str(brand).upper() and str(type_).upper() in types:
-            return group
-    return "UNKNOWN"
\ No newline at end of file
+        for t in types: lookup.setdefault((WAC_TO_BRAND[group], t), group)
+    return MappingProxyType(lookup)
+
+WAC_GROUP_LOOKUP = _build_wac_group_lookup()
+
+def find_wac_group(brand, type_):
+    group = WAC_GROUP_LOOKUP.get((brand, type_))
+    if group is not None: return group
+    return WAC_GROUP_LOOKUP.get((str(brand).upper(), str(type_).upper()), "UNKNOWN")
\ No newline at end of file
@@ -0,0 +1,119 @@
+# thredvault_system/records.py
+# Typed, read-only rows for inventory, sales and orders. database.load_records()
+# builds them once per file version and caches them apart from the dict rows:
+# numbers and dates are parsed once, the dimension strings (Brand/Type/Color/
+# Size/WAC_Group, statuses, suppliers, dates) are interned so every row shares
+# one copy, and __slots__ drops the per-row dict. Attributes are named after
+# the CSV columns.
+import sys
+from datetime import date
+from functools import lru_cache
+import models as md
+
+# --- PARSERS ---
+_texts = {}
+
+def text(value):
+    """Stripped, interned string; the few distinct dimension values are memoized."""
+    found = _texts.get(value)
+    if found is None:
+        found = _texts[value] = sys.intern(str(value).strip()) if value is not None else ''
+    return found
+
+def plain(value):
+    """Stripped string for unique keys (IDs), which gain nothing from interning."""
+    return str(value).strip() if value is not None else ''
+
+def to_int(value):
+    try: return int(value)
+    except (TypeError, ValueError): pass
+    try: return int(float(value or 0))
+    except (TypeError, ValueError): return 0
+
+def to_float(value):
+    try: return float(value or 0)
+    except (TypeError, ValueError): return 0.0
+
+@lru_cache(maxsize=None)
+def parse_date(value):
+    """date for 'mm/dd/yyyy' or 'yyyy-mm-dd' (shared per distinct string), else None."""
+    value = str(value or '').strip()
+    parts = value.split('/')
+    try:
+        if len(parts) == 3 and len(parts[2]) == 4: return date(int(parts[2]), int(parts[0]), int(parts[1]))
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=None)
+def group_of(brand, type_, wac_group):
+    """The stored WAC group label, or the one inferred from Brand/Type (looked
+    up once per distinct triple)."""
+    if wac_group and wac_group != 'None': return wac_group
+    return text(md.find_wac_group(brand, type_))
+
+# --- RECORDS ---
+# Each class lists its CSV columns in FIELDS (plus derived slots) and parses a
+# row in one straight-line __init__: this runs once per row per file version.
+class Record:
+    __slots__ = ()
+    FIELDS = ()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{c}={getattr(self, c)!r}' for c in self.FIELDS)})"
+
+class InventoryRecord(Record):
+    FIELDS = ("Brand", "Type", "Color", "Size", "Quantity", "WAC_Cost", "WAC_Group")
+    __slots__ = FIELDS + ("Group",)
+
+    def __init__(self, row):
+        get = row.get
+        self.Brand = text(get("Brand")); self.Type = text(get("Type"))
+        self.Color = text(get("Color")); self.Size = text(get("Size"))
+        self.Quantity = to_int(get("Quantity")); self.WAC_Cost = to_float(get("WAC_Cost"))
+        self.WAC_Group = text(get("WAC_Group"))
+        self.Group = group_of(self.Brand, self.Type, self.WAC_Group)
+
+    @property
+    def value(self):
+        return self.Quantity * self.WAC_Cost
+
+class SaleRecord(Record):
+    FIELDS = ("ID", "Date", "Brand", "Type", "Color", "Size", "Sale_Price", "Profit", "WAC_Group", "Status")
+    __slots__ = FIELDS + ("Day", "Group")
+
+    def __init__(self, row):
+        get = row.get
+        self.ID = plain(get("ID")); self.Date = text(get("Date"))
+        self.Brand = text(get("Brand")); self.Type = text(get("Type"))
+        self.Color = text(get("Color")); self.Size = text(get("Size"))
+        self.Sale_Price = to_float(get("Sale_Price")); self.Profit = to_float(get("Profit"))
+        self.WAC_Group = text(get("WAC_Group")); self.Status = text(get("Status")) or 'Completed'
+        self.Day = parse_date(self.Date)
+        self.Group = group_of(self.Brand, self.Type, self.WAC_Group)
+
+class OrderRecord(Record):
+    FIELDS = ("Order_ID", "Date", "Delivery_Date", "WAC_Group", "Supplier", "Total_Pieces",
+              "Total_Cost", "Unit_Cost", "Amount_Paid", "Payment_Status", "Status")
+    __slots__ = FIELDS + ("Day",)
+
+    def __init__(self, row):
+        get = row.get
+        self.Order_ID = plain(get("Order_ID")); self.Date = text(get("Date"))
+        self.Delivery_Date = text(get("Delivery_Date")); self.WAC_Group = text(get("WAC_Group"))
+        self.Supplier = text(get("Supplier")); self.Total_Pieces = to_int(get("Total_Pieces"))
+        self.Total_Cost = to_float(get("Total_Cost")); self.Unit_Cost = to_float(get("Unit_Cost"))
+        self.Amount_Paid = to_float(get("Amount_Paid"))
+        self.Payment_Status = text(get("Payment_Status")); self.Status = text(get("Status"))
+        self.Day = parse_date(self.Date)
+
+    @property
+    def remaining(self):
+        return self.Total_Cost - self.Amount_Paid
+
+RECORD_TYPES = {md.INVENTORY_FILE: InventoryRecord, md.SALES_FILE: SaleRecord, md.ORDERS_FILE: OrderRecord}
+
+def from_rows(filename, rows):
+    """Records for a file's rows, as a tuple (records are shared: never mutate them)."""
+    cls = RECORD_TYPES[filename]
+    return tuple(cls(r) for r in rows)
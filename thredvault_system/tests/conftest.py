@@ -0,0 +1,39 @@
+# thredvault_system/tests/conftest.py
+# Every test runs in its own empty data directory, on the backend it asks for.
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database as db
+import models as md
+
+def _fresh_state(monkeypatch, backend):
+    """Points the modules at an empty directory with nothing cached."""
+    monkeypatch.setattr(md, "STORAGE_BACKEND", backend)
+    for name, value in (("_schema_ready", False), ("_cache", {}), ("_write_versions", {}),
+                        ("_versions", (None, {})), ("_rollup", None), ("_kpi", None),
+                        ("_ledger_state", None), ("_store", None)):
+        monkeypatch.setattr(db, name, value)
+
+@pytest.fixture(params=["csv", "sqlite"])
+def backend(request, tmp_path, monkeypatch):
+    """Runs the test once per storage backend (THREDVAULT_BACKEND)."""
+    monkeypatch.chdir(tmp_path)
+    _fresh_state(monkeypatch, request.param)
+    return request.param
+
+@pytest.fixture
+def csv_files(tmp_path, monkeypatch):
+    """The CSV backend only (the commit log and write-behind store)."""
+    monkeypatch.chdir(tmp_path)
+    _fresh_state(monkeypatch, "csv")
+    return tmp_path
+
+def stock(qty, brand="ESSENTIALS", type_="HOODIE", color="BLACK", size="M", cost="10.0", group="ESS HOODIE"):
+    return {"Brand": brand, "Type": type_, "Color": color, "Size": size,
+            "Quantity": str(qty), "WAC_Cost": cost, "WAC_Group": group}
+
+def sale(id_, price="20.0", date="01/15/2025", status="Completed"):
+    return {"ID": str(id_), "Date": date, "Brand": "ESSENTIALS", "Type": "HOODIE", "Color": "BLACK",
+            "Size": "M", "Sale_Price": price, "Profit": "10.0", "WAC_Group": "ESS HOODIE", "Status": status}
@@ -0,0 +1,90 @@
+# thredvault_system/tests/test_backups.py
+# Backup retention (prune_backups) and point-in-time restore (restore_as_of).
+import os
+import time
+from datetime import datetime
+import pytest
+import database as db
+import models as md
+from conftest import sale, stock
+
+def contents(paths):
+    return {p: open(p, "rb").read() if os.path.exists(p) else None for p in paths}
+
+def moment():
+    """A time strictly between the writes before and after the call."""
+    time.sleep(0.01)
+    when = datetime.now()
+    time.sleep(0.01)
+    return when
+
+def test_restore_replays_up_to_the_time(csv_files):
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(3)])
+    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(1)])
+    db.update_cash_on_hand(100.0, "Opening", "")
+    db.create_backup()
+    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(2)])
+    db.checkpoint()  # archives the append to the change history
+    db.update_cash_on_hand(40.0, "Sale", "2")  # still only in the commit log
+    wanted, when = contents(md.RESTORE_FILES), moment()
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(1)])
+    db.journal_update(md.SALES_FILE, md.SALES_COLUMNS, [sale(1, price="30.0")])
+    db.update_cash_on_hand(-5.0, "Refund", "1")
+    latest, before_restore = contents(md.RESTORE_FILES), moment()
+
+    backup_id, replayed = db.restore_as_of(when)
+    assert replayed == 2
+    assert contents(md.RESTORE_FILES) == wanted
+    assert db.load_csv(md.INVENTORY_FILE) == [stock(3)]
+    assert db.load_csv(md.SALES_FILE) == [sale(1), sale(2)]
+    assert db.load_financials()["Cash_On_Hand"] == 140.0
+
+    db.restore_as_of(before_restore)  # a restore is undone like any other write
+    assert contents(md.RESTORE_FILES) == latest
+    assert db.load_financials()["Cash_On_Hand"] == 135.0
+
+def test_restore_before_any_backup_fails(csv_files):
+    when = moment()
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(3)])
+    db.create_backup()
+    with pytest.raises(ValueError):
+        db.restore_as_of(when)
+    assert db.load_csv(md.INVENTORY_FILE) == [stock(3)]
+
+def test_sqlite_restores_the_nearest_snapshot(backend):
+    if backend != "sqlite": pytest.skip("SQLite only")
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(3)])
+    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(1)])
+    db.create_backup()
+    when = moment()
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(1)])
+    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(2)])
+    db.restore_as_of(when)
+    assert db.load_csv(md.INVENTORY_FILE) == [stock(3)]
+    assert db.load_csv(md.SALES_FILE) == [sale(1)]
+
+def test_prune_keeps_the_newest_backup_of_each_bucket(csv_files):
+    for d in (db._BACKUP_MANIFESTS, db._BACKUP_OBJECTS): os.makedirs(d)
+    now = datetime(2026, 3, 10, 12, 0)  # a Tuesday
+    stamps = {
+        "A": (2026, 3, 10, 11, 50), "B": (2026, 3, 10, 11, 10),  # same hour as A
+        "C": (2026, 3, 10, 10, 30), "D": (2026, 3, 10, 9, 59), "E": (2026, 3, 10, 9, 1),
+        "F": (2026, 3, 9, 20, 0), "G": (2026, 3, 9, 8, 0),  # Monday: same ISO week as A
+        "H": (2026, 3, 5, 18, 0), "I": (2026, 3, 4, 18, 0),  # the week before
+        "J": (2026, 2, 20, 18, 0),
+    }
+    ids = {}
+    for name, parts in stamps.items():
+        files = {md.SALES_FILE: db._put_object(name.encode(), [1, 0, 0])}
+        ids[db._write_manifest(datetime(*parts), files)] = name
+    old = now.timestamp() - db.BACKUP_GC_GRACE - 1
+    for entry in os.listdir(db._BACKUP_OBJECTS):
+        os.utime(os.path.join(db._BACKUP_OBJECTS, entry), (old, old))
+    db._put_object(b"staged by a backup in progress", [1, 0, 0])
+
+    removed = db.prune_backups({"hourly": 3, "daily": 2, "weekly": 2}, now=now.timestamp())
+    assert sorted(ids[i] for i in removed) == ["B", "E", "G", "I", "J"]
+    assert sorted(ids[i] for i in db.list_backups()) == ["A", "C", "D", "F", "H"]
+    # Objects only removed backups used are collected; a fresh one is spared.
+    assert sorted(db.backup_contents(i, md.SALES_FILE) for i in db.list_backups()) == [b"A", b"C", b"D", b"F", b"H"]
+    assert len(os.listdir(db._BACKUP_OBJECTS)) == 6
@@ -0,0 +1,81 @@
+# thredvault_system/tests/test_checkout.py
+# db.checkout() is all or nothing, on both backends.
+import pytest
+import database as db
+import models as md
+from conftest import stock
+
+def line(qty, size="M", total=None):
+    return {"Brand": "ESSENTIALS", "Type": "HOODIE", "Color": "BLACK", "Size": size,
+            "Quantity": qty, "Total": total if total is not None else 20.0 * qty, "Cost": 10.0,
+            "WAC_Group": "ESS HOODIE"}
+
+def snapshot():
+    return db.load_csv(md.INVENTORY_FILE), db.load_csv(md.SALES_FILE), db.load_financials()
+
+@pytest.fixture
+def shelf(backend):
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(3), stock(1, size="L")])
+    return backend
+
+def test_checkout_sells_every_line(shelf):
+    sale_ids, errors = db.checkout([line(2), line(1, size="L")])
+    assert (sale_ids, errors) == (["1", "2"], [])
+    assert [r["Quantity"] for r in db.load_csv(md.INVENTORY_FILE)] == ["1", "0"]
+    assert [(s["ID"], s["Size"], s["Status"]) for s in db.load_csv(md.SALES_FILE)] == [
+        ("1", "M", "Completed"), ("2", "L", "Completed")]
+    assert db.load_financials()["Cash_On_Hand"] == 60.0
+
+@pytest.mark.parametrize("bad", [line(2, size="L"), line(0), line(1, size="XXL")])
+def test_any_line_error_writes_nothing(shelf, bad):
+    before = snapshot()
+    sale_ids, errors = db.checkout([line(1), bad])
+    assert sale_ids == [] and [n for n, _ in errors] == [2]
+    assert snapshot() == before
+    assert db.allocate_ids("sale") == ["1"]  # no IDs were used up either
+
+def test_lines_for_one_sku_cannot_oversell(shelf):
+    before = snapshot()
+    sale_ids, errors = db.checkout([line(2), line(2)])
+    assert sale_ids == [] and [n for n, _ in errors] == [2]
+    assert snapshot() == before
+    assert db.checkout([line(2), line(1)])[1] == []
+    assert db.load_csv(md.INVENTORY_FILE)[0]["Quantity"] == "0"
+
+def test_pending_sale_moves_no_cash(shelf):
+    db.checkout([line(1)], "Pending")
+    assert db.load_csv(md.SALES_FILE)[0]["Status"] == "Pending"
+    assert db.load_financials()["Cash_On_Hand"] == 0.0
+
+def test_checkout_with_store_open_writes_through(csv_files):
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(2)])
+    db.open_store(background=False)
+    try:
+        assert db.checkout([line(2)])[1] == []
+        with db._disk_access():
+            assert db.load_csv(md.INVENTORY_FILE)[0]["Quantity"] == "0"
+            assert len(db.load_csv(md.SALES_FILE)) == 1
+        assert db.checkout([line(1)])[1] != []
+    finally:
+        db.close_store()
+
+def test_stock_conflict_keeps_unrelated_writes(csv_files):
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(3), stock(1, size="L")])
+    db.open_store(background=False)
+    try:
+        ix = db.load_inventory_index()
+        ix.update(ix.get("ESSENTIALS", "HOODIE", "BLACK", "M"), Quantity="0")  # took 3
+        ix.update(ix.get("ESSENTIALS", "HOODIE", "BLACK", "L"), Quantity="4")
+        db.save_inventory(ix)
+        db.update_cash_on_hand(50.0, "Payment", "7")
+        with db._disk_access():  # another session sells 2 of the M hoodies meanwhile
+            db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(1), stock(1, size="L")])
+        with pytest.raises(db.StockConflict):
+            db.flush_store()
+        with db._disk_access():
+            assert [r["Quantity"] for r in db.load_csv(md.INVENTORY_FILE)] == ["1", "4"]
+            assert db.load_financials()["Cash_On_Hand"] == 50.0
+        assert [r["Quantity"] for r in db.load_csv(md.INVENTORY_FILE)] == ["1", "4"]
+        assert db.flush_store() == []
+    finally:
+        db.close_store()
@@ -0,0 +1,43 @@
+# thredvault_system/tests/test_columnar.py
+# The Parquet copies of sales and orders convert back to the CSV layout
+# byte for byte (migrate_to_parquet.py --to-csv).
+import glob
+import os
+import shutil
+import pytest
+import database as db
+import models as md
+from conftest import sale
+
+pytestmark = pytest.mark.skipif(db.pa is None, reason="needs pyarrow")
+
+DATA_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SHIPPED = {md.SALES_FILE: sorted(glob.glob(os.path.join(DATA_DIR, "backups", "sales.csv_*.bak"))),
+           md.ORDERS_FILE: [os.path.join(DATA_DIR, "orders.csv")]
+                           + sorted(glob.glob(os.path.join(DATA_DIR, "backups", "orders.csv_*.bak")))}
+
+@pytest.mark.parametrize("filename", list(SHIPPED))
+def test_shipped_files_round_trip(csv_files, filename):
+    assert SHIPPED[filename]
+    for path in SHIPPED[filename]:
+        shutil.copyfile(path, filename)
+        # Older layouts are brought up to the current columns first, as any save does.
+        db.save_csv(filename, md.FILE_COLUMNS[filename], db.load_csv(filename))
+        with open(filename, "rb") as f: before = f.read()
+        db.export_columnar(filename)
+        assert db.import_columnar(filename) == len(db.load_csv(filename))
+        with open(filename, "rb") as f: assert f.read() == before, path
+
+def test_text_that_types_would_change_round_trips(csv_files, monkeypatch):
+    monkeypatch.setattr(md, "COLUMNAR_FORMAT", "parquet")
+    rows = [sale(3), sale(10, price="42", status=""), sale(2, date="not a date"), sale(1, date="1/5/2025"),
+            dict(sale(4), Brand=" ESSENTIALS ", Profit="")]
+    db.save_csv(md.SALES_FILE, md.SALES_COLUMNS, rows)
+    db.export_columnar(md.SALES_FILE)
+    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(5, price="7")])
+    assert sorted(db.scan_columns(md.SALES_FILE, ["Sale_Price"])["Sale_Price"]) == [7.0, 20.0, 20.0, 20.0, 20.0, 42.0]
+    assert db._columnar_state(md.COLUMNAR_DIRS[md.SALES_FILE])["parts"] == 2  # the new row went in its own part
+    with open(md.SALES_FILE, "rb") as f: before = f.read()
+    assert db.import_columnar(md.SALES_FILE) == 6
+    with open(md.SALES_FILE, "rb") as f: assert f.read() == before
+    assert db.load_csv(md.SALES_FILE) == rows + [sale(5, price="7")]
@@ -0,0 +1,97 @@
+# thredvault_system/tests/test_commit_log.py
+# Crash recovery: recover() rolls back a group whose writer died and replays
+# committed groups onto files a crash left behind; a crashed writer's lock is
+# broken, a live one's is not.
+import json
+import os
+import subprocess
+import sys
+import time
+import pytest
+import database as db
+import models as md
+from conftest import sale, stock
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_and_die(body):
+    """Runs `body` in a fresh process that exits without any cleanup."""
+    code = f"import os, sys\nsys.path.insert(0, {CODE_DIR!r})\nimport database as db, models as md\n{body}\nos._exit(9)\n"
+    env = dict(os.environ, THREDVAULT_BACKEND="csv")
+    assert subprocess.run([sys.executable, "-c", code], env=env).returncode == 9
+
+def contents(*paths):
+    return {p: open(p, "rb").read() if os.path.exists(p) else None for p in paths}
+
+def test_killed_writer_is_rolled_back(csv_files):
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(3), stock(1, size="L")])
+    db.update_cash_on_hand(100.0, "Opening", "")
+    db.checkpoint()
+    files = (md.INVENTORY_FILE, md.SALES_FILE, md.LEDGER_FILE, md.FINANCIALS_FILE)
+    before = contents(*files)
+    run_and_die(
+        "with db.commit_group():\n"
+        "    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [])\n"
+        f"    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [{sale(1)!r}])\n"
+        "    db.update_cash_on_hand(20.0, 'Sale', '1')\n"
+        "    os._exit(9)")
+    assert contents(*files) != before
+    assert db.recover() == (0, 1)
+    assert contents(*files) == before
+    assert not [f for f in os.listdir() if f.endswith((".pre", ".tmp"))]
+    assert db.load_financials()["Cash_On_Hand"] == 100.0
+
+def test_lost_writes_are_replayed(csv_files):
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(3), stock(1, size="L")])
+    db.checkpoint()
+    checkpointed = contents(md.INVENTORY_FILE)
+    run_and_die(
+        "ix = db.load_inventory_index()\n"
+        "ix.update(ix.get('ESSENTIALS', 'HOODIE', 'BLACK', 'M'), Quantity='2')\n"
+        "db.save_inventory(ix)\n"
+        "middle = open(md.INVENTORY_FILE, 'rb').read()\n"
+        "ix.upsert(" + repr(stock(5, size="XL")) + ")\n"
+        "db.save_inventory(ix)\n"
+        "open('middle.bin', 'wb').write(middle)")
+    final = contents(md.INVENTORY_FILE)
+    middle = {md.INVENTORY_FILE: open("middle.bin", "rb").read()}
+    # A power cut can leave the file at any state since the checkpoint, with
+    # an older mtime than the commit recorded.
+    for state in (checkpointed, middle):
+        with open(md.INVENTORY_FILE, "wb") as f: f.write(state[md.INVENTORY_FILE])
+        os.utime(md.INVENTORY_FILE, ns=(0, 0))
+        with open(md.COMMIT_LOG_FILE) as f: log = f.read()
+        replayed, rolled_back = db.recover()
+        assert (replayed, rolled_back) == (2, 0) and contents(md.INVENTORY_FILE) == final
+        with open(md.COMMIT_LOG_FILE, "w") as f: f.write(log)  # undo the checkpoint recover() ran
+    assert db.load_csv(md.INVENTORY_FILE) == [stock(2), stock(1, size="L"), stock(5, size="XL")]
+
+def test_log_holds_only_the_changed_bytes(csv_files):
+    rows = [stock(i, brand="CAFÉ", size=f"S{i}") for i in range(2000)]
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, rows)
+    db.checkpoint()
+    rows[1000] = stock(7, brand="CAFÉ", size="S1000")
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, rows)
+    with open(md.COMMIT_LOG_FILE, "rb") as f: log = f.read()
+    assert len(log) < 2000 < os.path.getsize(md.INVENTORY_FILE)
+    ops = [op for line in log.splitlines() for op in json.loads(line).get("commit", [])]
+    splice = next(op for op in ops if op["path"] == md.INVENTORY_FILE and op["op"] != "stat")
+    assert splice["op"] == "splice" and splice["text"] == "7"
+
+def test_held_lock_is_not_broken(csv_files, monkeypatch):
+    # The holder keeps its lock far longer than STALE_LOCK_AGE.
+    code = (f"import os, sys, time\nsys.path.insert(0, {CODE_DIR!r})\nimport database as db, models as md\n"
+            "db.STALE_LOCK_AGE, db.LOCK_RENEW_INTERVAL = 0.3, 0.05\n"
+            "with db.file_lock(md.SALES_FILE):\n"
+            "    open('held', 'w').close()\n"
+            "    time.sleep(1.5)\n")
+    holder = subprocess.Popen([sys.executable, "-c", code])
+    try:
+        while not os.path.exists("held"): time.sleep(0.01)
+        monkeypatch.setattr(db, "STALE_LOCK_AGE", 0.3)
+        monkeypatch.setattr(db, "LOCK_TIMEOUT", 0.8)
+        with pytest.raises(TimeoutError):
+            with db.file_lock(md.SALES_FILE): pass
+    finally:
+        holder.wait()
+    with db.file_lock(md.SALES_FILE): pass
@@ -0,0 +1,78 @@
+# thredvault_system/tests/test_migrate_to_sql.py
+# Importing the CSVs into thredvault.db (init_db) and keeping it in step (sync_db).
+import sqlite3
+from contextlib import closing
+import pytest
+import database as db
+import migrate_to_sql as ms
+import models as md
+from conftest import sale, stock
+
+def table(name, order="rowid"):
+    with closing(sqlite3.connect(md.DB_FILE)) as conn:
+        return conn.execute(f"SELECT * FROM {name} ORDER BY {order}").fetchall()
+
+def test_import_makes_sale_ids_unique(csv_files):
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(2)])
+    db.save_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(1), sale(2), dict(sale(2), Size="L"), sale(2, price="10")])
+    ms.init_db()
+    assert [(r[0], r[5], r[6]) for r in table("sales")] == [(1, "M", "20.0"), (2, "M", "20.0"), (3, "L", "20.0"), (4, "M", "10")]
+    assert table("sequences") == [("sale", 4)]
+    with closing(sqlite3.connect(md.DB_FILE)) as conn:
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute("INSERT INTO sales (ID) VALUES (3)")
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute("INSERT INTO orders (Order_ID, WAC_Group) VALUES (1, 'G'), (1, 'G')")
+        conn.execute("INSERT INTO orders (Order_ID, WAC_Group) VALUES (1, 'G'), (1, 'H')")  # one order, two groups
+
+def db_rows(filename):
+    """A table as the CSV layer would return it."""
+    cols = md.FILE_COLUMNS[filename]
+    with closing(sqlite3.connect(md.DB_FILE)) as conn:
+        cur = conn.execute(f"SELECT {', '.join(cols)} FROM {md.SQL_TABLES[filename]} ORDER BY rowid")
+        return [{c: ms.from_sql_value(c, v) for c, v in zip(cols, r)} for r in cur]
+
+@pytest.fixture
+def synced(csv_files):
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(2), stock(5, size="L")])
+    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(1), sale(2)])
+    db.save_csv(md.ORDERS_FILE, md.ORDER_COLUMNS, [])
+    ms.init_db()
+    return csv_files
+
+def sync(capsys):
+    capsys.readouterr()
+    ms.sync_db()
+    return capsys.readouterr().out
+
+def test_sync_applies_only_appended_rows(synced, capsys):
+    assert sync(capsys) == ""
+    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(3), sale(4, price="10")])
+    assert sync(capsys) == "sales.csv: +2 rows\n"
+    assert db_rows(md.SALES_FILE) == db.load_csv(md.SALES_FILE)
+    with open(md.SALES_FILE, "ab") as f: f.write(b"5,01/16/2025,ESSENTIALS,HOO")  # a write in progress
+    assert sync(capsys) == ""
+    with open(md.SALES_FILE, "ab") as f: f.write(b"DIE,BLACK,M,20.0,10.0,ESS HOODIE,Completed\r\n")
+    assert sync(capsys) == "sales.csv: +1 rows\n"
+    assert [r["ID"] for r in db_rows(md.SALES_FILE)] == ["1", "2", "3", "4", "5"]
+
+def test_sync_applies_journaled_edits(synced, capsys):
+    db.journal_update(md.SALES_FILE, md.SALES_COLUMNS, [sale(2, price="25.0")])
+    db.journal_delete(md.SALES_FILE, md.SALES_COLUMNS, ["1"])
+    assert "applied 2 journal entries" in sync(capsys)
+    assert db_rows(md.SALES_FILE) == [sale(2, price="25.0")]
+    db.journal_update(md.SALES_FILE, md.SALES_COLUMNS, [sale(2, price="30.0")])
+    assert sync(capsys) == "sales.csv: applied 1 journal entries\n"
+    assert db_rows(md.SALES_FILE) == db.load_csv(md.SALES_FILE)
+    db.compact_journal(md.SALES_FILE, md.SALES_COLUMNS)  # rewrites the base file
+    assert sync(capsys) == "sales.csv: reloaded (1 rows)\n"
+    assert db_rows(md.SALES_FILE) == [sale(2, price="30.0")]
+
+def test_sync_reloads_a_rewritten_file(synced, capsys):
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(7), stock(1, size="XL")])
+    assert sync(capsys) == "inventory.csv: reloaded (2 rows)\n"
+    assert db_rows(md.INVENTORY_FILE) == [stock(7), stock(1, size="XL")]
+    # An appended row that repeats an ID (an old app version) reloads and renumbers.
+    with open(md.SALES_FILE, "ab") as f: f.write(b"2,01/15/2025,ESSENTIALS,HOODIE,BLACK,L,20.0,10.0,ESS HOODIE,Completed\r\n")
+    assert "sales.csv: reloaded (3 rows)" in sync(capsys)
+    assert [(r["ID"], r["Size"]) for r in db_rows(md.SALES_FILE)] == [("1", "M"), ("2", "M"), ("3", "L")]
@@ -0,0 +1,128 @@
+# thredvault_system/tests/test_storage.py
+# The database.py API must behave the same on both backends.
+import sqlite3
+from datetime import date, datetime, timedelta
+import pytest
+import database as db
+import migrate_to_sql as ms
+import models as md
+from conftest import sale, stock
+
+def test_save_load_append(backend):
+    rows = [stock(2), stock(5, size="L", cost="12")]
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, rows)
+    assert db.load_csv(md.INVENTORY_FILE) == rows
+    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(1, price="10")])
+    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(2), sale(3, status="Pending", date="")])
+    assert db.load_csv(md.SALES_FILE) == [sale(1, price="10"), sale(2), sale(3, status="Pending", date="")]
+    db.journal_update(md.SALES_FILE, md.SALES_COLUMNS, [sale(2, price="25")])
+    assert db.load_csv(md.SALES_FILE)[1] == sale(2, price="25")
+
+def test_save_is_compare_and_swap(backend):
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(2)])
+    rows, version = db.load_versioned(md.INVENTORY_FILE)
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, [stock(3)])
+    with pytest.raises(db.ConflictError):
+        db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, rows, version)
+    assert db.load_csv(md.INVENTORY_FILE) == [stock(3)]
+
+def test_save_keeps_unchanged_rows(backend):
+    rows = [stock(2), stock(5, size="L"), stock(1, size="S")]
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, rows)
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS,
+                [rows[0], stock(4, size="L"), stock(7, size="XL")])
+    assert db.load_csv(md.INVENTORY_FILE) == [rows[0], stock(4, size="L"), stock(7, size="XL")]
+
+def test_sqlite_save_writes_only_changed_rows(backend):
+    if backend != "sqlite": pytest.skip("SQLite only")
+    rows = [stock(i, size=f"S{i}") for i in range(1, 21)]
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, rows)
+    with db._sql_session() as conn:
+        conn.execute("CREATE TABLE writes (op TEXT)")
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"CREATE TRIGGER count_{op.lower()} AFTER {op} ON inventory "
+                         f"BEGIN INSERT INTO writes VALUES ('{op}'); END")
+    rows[3] = stock(99, size="S4")
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, rows + [stock(1, size="NEW")])
+    with db._sql_session() as conn:
+        assert sorted(r[0] for r in conn.execute("SELECT op FROM writes")) == ["INSERT", "UPDATE"]
+
+def test_apply_row_changes(backend):
+    rows = [stock(2), stock(5, size="L"), stock(1, size="S")]
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, rows)
+    assert db.apply_row_changes(md.INVENTORY_FILE, md.INVENTORY_COLUMNS, added=[stock(4, size="XL")]) == 0
+    missing = db.apply_row_changes(md.INVENTORY_FILE, md.INVENTORY_COLUMNS,
+                                   updated=[(rows[0], dict(rows[0], WAC_Cost="12.0")), (stock(9, size="XS"), stock(8, size="XS"))],
+                                   deleted=[rows[2]])
+    assert missing == 1
+    assert db.load_csv(md.INVENTORY_FILE) == [stock(2, cost="12.0"), stock(5, size="L"), stock(4, size="XL")]
+
+def test_journal_edits(backend):
+    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(1), sale(2), sale(3)])
+    db.journal_update(md.SALES_FILE, md.SALES_COLUMNS, [sale(2, price="25.0")])
+    db.journal_delete(md.SALES_FILE, md.SALES_COLUMNS, ["1"])
+    expected = [sale(2, price="25.0"), sale(3)]
+    assert db.load_csv(md.SALES_FILE) == expected
+    db.compact_journal(md.SALES_FILE, md.SALES_COLUMNS)
+    assert db.load_csv(md.SALES_FILE) == expected
+
+def test_repeated_ids_are_renumbered(backend):
+    first, second = sale(2), dict(sale(2), Size="L")
+    if backend == "sqlite":  # a database imported before IDs were unique
+        with db._sql_session() as conn: ms.drop_unique_indexes(conn, "sales")
+    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(1), first, second, sale(3)])
+    if backend == "csv":
+        with pytest.raises(db.ConflictError):
+            db.apply_row_changes(md.SALES_FILE, md.SALES_COLUMNS, updated=[(second, dict(second, Sale_Price="30.0"))])
+    assert db.unique_ids() == 1
+    second = dict(second, ID="4")
+    assert db.load_csv(md.SALES_FILE) == [sale(1), first, second, sale(3)]
+    db.journal_delete(md.SALES_FILE, md.SALES_COLUMNS, ["2"])
+    assert db.apply_row_changes(md.SALES_FILE, md.SALES_COLUMNS, updated=[(second, dict(second, Sale_Price="30.0"))]) == 0
+    assert db.load_csv(md.SALES_FILE) == [sale(1), dict(second, Sale_Price="30.0"), sale(3)]
+    assert db.unique_ids() == 0
+    assert db.get_next_sale_id() == "5"
+    if backend == "sqlite":  # and from now on the key is enforced
+        with pytest.raises(sqlite3.IntegrityError):
+            db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(3)])
+
+def test_id_allocation(backend):
+    db.append_csv(md.SALES_FILE, md.SALES_COLUMNS, [sale(7)])
+    assert db.allocate_ids("sale", 3) == ["8", "9", "10"]
+    assert db.get_next_sale_id() == "11"
+    assert db.get_next_order_id() == "1"
+    assert db.allocate_ids("sale", 0) == []
+
+def test_financials(backend):
+    assert db.load_financials() == {"Cash_On_Hand": 0.0, "Outstanding_Payables": 0.0}
+    assert db.update_cash_on_hand(100.0, "Sale", "1") == 100.0
+    db.update_cash_on_hand(-30.5, "Refund", "1")
+    db.save_financials(200.0, 40.0)
+    assert db.load_financials() == {"Cash_On_Hand": 200.0, "Outstanding_Payables": 40.0}
+    assert db.balance_as_of(date.today()) == {"Cash_On_Hand": 200.0, "Outstanding_Payables": 40.0}
+    assert db.balance_as_of(date(2000, 1, 1)) == {"Cash_On_Hand": 0.0, "Outstanding_Payables": 0.0}
+
+def test_recalculate_global_wac(backend):
+    db.save_csv(md.INVENTORY_FILE, md.INVENTORY_COLUMNS,
+                [stock(1, cost="10.0"), stock(3, size="L", cost="20.0"), stock(4, type_="PANT", cost="5.0", group="ESS PANT")])
+    assert db.recalculate_global_wac("ESS HOODIE") == 17.5
+    assert [r["WAC_Cost"] for r in db.load_csv(md.INVENTORY_FILE)] == ["17.5", "17.5", "5.0"]
+    assert db.verify_wac_totals() == {}
+    assert db.recalculate_global_wac("UNKNOWN") is None
+
+def test_buffered_cash_keeps_its_time(csv_files, monkeypatch):
+    made = datetime.now().replace(microsecond=0) - timedelta(minutes=10)
+    db.open_store(background=False)
+    try:
+        with monkeypatch.context() as m:
+            m.setattr(db, "_now_stamp", lambda: made.isoformat())
+            db.update_cash_on_hand(5.0, "Sale", "1")
+        db.update_cash_on_hand(2.0, "Sale", "2")
+        db.flush_store()
+    finally:
+        db.close_store()
+    with open(md.LEDGER_FILE) as f:
+        assert [line.split(",")[0] for line in f if "Sale" in line][0] == made.isoformat()
+    assert db.balance_as_of(made + timedelta(minutes=5))["Cash_On_Hand"] == 5.0
+    assert db.balance_as_of(made - timedelta(minutes=5))["Cash_On_Hand"] == 0.0
+    assert db.load_financials()["Cash_On_Hand"] == 7.0